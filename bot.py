@@ -2,10 +2,20 @@
 import os
 import discord
 from discord.ext import commands
+from discord import app_commands
 from dotenv import load_dotenv
 import asyncio
 from typing import Literal, Optional
 import json
+from utils.database import Database
+from utils.draw_engine import DrawEngine
+from utils.forum_sync import ForumSync
+from utils.permissions import RolePermissions, respond_to_check_failure
+from utils.preset_cache import PresetCache
+from utils.preset_index import register_sql_functions
+from utils.thread_cards import ThreadCardCache
+from utils.tombstones import TombstoneQueue
+from utils.thread_pool import ThreadPool
 
 # --- 初始化 ---
 # 加载 .env 文件中的环境变量
@@ -16,6 +26,9 @@ ALLOWED_CHANNEL_IDS_STR = os.getenv("ALLOWED_CHANNEL_IDS", "")
 DELIVERY_CHANNEL_ID_STR = os.getenv("DELIVERY_CHANNEL_ID", "")
 DEFAULT_POOL_EXCLUSION_IDS_STR = os.getenv("DEFAULT_POOL_EXCLUSION_IDS", "")
 
+# --- 数据库文件路径 ---
+DB_FILE = 'posts.db'
+
 # --- Bot 设置 ---
 # 创建一个 Bot 实例，并启用所有默认的 Intents
 intents = discord.Intents.default()
@@ -31,6 +44,35 @@ class MyBot(commands.Bot):
         self.allowed_forum_ids = {int(cid.strip()) for cid in ALLOWED_CHANNEL_IDS_STR.split(',') if cid.strip()}
         self.delivery_channel_id = int(DELIVERY_CHANNEL_ID_STR) if DELIVERY_CHANNEL_ID_STR else None
         self.default_pool_exclusions = {int(cid.strip()) for cid in DEFAULT_POOL_EXCLUSION_IDS_STR.split(',') if cid.strip()}
+        # --- 身份组权限：预先解析为集合，.env 修改后自动重新加载 ---
+        self.permissions = RolePermissions()
+        self.tree.error(self.on_app_command_error)
+        # --- 共享的数据库访问层，所有 Cog 都通过它读写 SQLite ---
+        self.db = Database(DB_FILE)
+        # 注册 jieba_segment 等自定义 SQL 函数（预设消息的 FTS 触发器依赖它），必须在首次访问数据库前完成
+        self.db.add_connection_hook(register_sql_functions)
+        # --- 常驻内存的卡池索引，由 RandomPost Cog 在加载时从数据库填充 ---
+        self.thread_pool = ThreadPool()
+        # --- 抽卡引擎：加权抽样 + 排除用户最近抽到的帖子，配置见 DRAW_* 环境变量 ---
+        self.draw_engine = DrawEngine.from_env(self.thread_pool)
+        # --- 帖子卡片缓存：抽卡与速递渲染 Embed 时复用，避免重复请求起始消息 ---
+        self.thread_cards = ThreadCardCache.from_env()
+        # --- 失效帖子的墓碑队列：立即移出卡池，数据库删除由后台批量执行 ---
+        self.tombstones = TombstoneQueue(self.thread_pool, self.thread_cards)
+        # --- 论坛增量同步引擎：多论坛并发、共享请求预算，配置见 SYNC_* 环境变量 ---
+        self.forum_sync = ForumSync.from_env(self.db, self.thread_pool)
+        # --- 预设消息缓存：按服务器缓存名称与内容，写入时同步更新，配置见 PRESET_CACHE_MAX_GUILDS ---
+        self.preset_cache = PresetCache.from_env(self.db)
+
+    async def on_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        """统一回复权限检查失败；其他错误交给默认处理（打印异常）。"""
+        if not await respond_to_check_failure(interaction, error):
+            await app_commands.CommandTree.on_error(self.tree, interaction, error)
+
+    async def close(self):
+        """关闭机器人时，等待数据库中排队的写入完成后再关闭连接。"""
+        await super().close()
+        await asyncio.to_thread(self.db.close)
 
     async def setup_hook(self):
         """
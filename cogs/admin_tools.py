@@ -3,12 +3,8 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 import openpyxl
-import sqlite3
 import io
 
-# --- 数据库文件路径 ---
-DB_FILE = 'posts.db'
-
 # --- 权限检查 ---
 async def is_owner_check(interaction: discord.Interaction) -> bool:
     """检查命令使用者是否为机器人所有者。"""
@@ -72,12 +68,9 @@ class AdminTools(commands.Cog):
             
             thread_data = [(thread_id, forum_id, guild_id) for thread_id in thread_ids]
 
-            con = sqlite3.connect(DB_FILE)
-            cur = con.cursor()
-            cur.executemany("INSERT OR IGNORE INTO threads (thread_id, forum_id, guild_id) VALUES (?, ?, ?)", thread_data)
-            con.commit()
-            added_count = cur.rowcount
-            con.close()
+            added_count = await self.bot.db.executemany("INSERT OR IGNORE INTO threads (thread_id, forum_id, guild_id) VALUES (?, ?, ?)", thread_data)
+            # 同步更新内存卡池索引，导入的帖子立即可被抽到
+            self.bot.thread_pool.add_rows(thread_data)
 
             await interaction.followup.send(
                 f"✅ **跨服务器导入成功！**\n"
@@ -1,6 +1,6 @@
 # cogs/backup_manager.py
 import os
-import shutil
+import sqlite3
 import asyncio
 import logging
 from datetime import datetime, timedelta
@@ -29,9 +29,11 @@ class BackupManager(commands.Cog):
     def cog_unload(self):
         self.backup_database.cancel()
 
-    def _run_backup_and_cleanup(self):
+    def _run_backup(self, con: sqlite3.Connection):
         """
-        在同步函数中执行所有阻塞的文件 I/O 操作。
+        在数据库读线程中执行备份。
+        数据库运行在 WAL 模式下，直接复制文件可能丢失尚未合并的写入，
+        因此使用 SQLite 的在线备份 API 生成一致的快照。
         """
         log.info("--- [同步线程] 开始执行每日数据库备份任务 ---")
         
@@ -51,12 +53,20 @@ class BackupManager(commands.Cog):
             backup_filename = f"backup_{timestamp}.db"
             destination_path = os.path.join(BACKUP_DIR, backup_filename)
             
-            shutil.copy2(source_path, destination_path)
+            destination = sqlite3.connect(destination_path)
+            try:
+                con.backup(destination)
+            finally:
+                destination.close()
             log.info(f"✅ 数据库成功备份到: {destination_path}")
 
         except Exception as e:
             log.error(f"❌ 数据库备份失败: {e}", exc_info=True)
 
+    def _run_cleanup(self):
+        """
+        在同步函数中执行清理旧备份的阻塞文件 I/O 操作。
+        """
         # 2. 清理旧备份
         try:
             cutoff_date = datetime.now() - timedelta(days=BACKUP_RETENTION_DAYS)
@@ -93,7 +103,8 @@ class BackupManager(commands.Cog):
         """
         每天执行一次的数据库备份和清理任务（异步包装器）。
         """
-        await asyncio.to_thread(self._run_backup_and_cleanup)
+        await self.bot.db.read(self._run_backup)
+        await asyncio.to_thread(self._run_cleanup)
 
     @backup_database.before_loop
     async def before_backup_loop(self):
@@ -5,16 +5,19 @@ from discord.ext import commands
 from discord import app_commands
 from discord.ext import tasks
 import os
-import sqlite3
 from typing import Optional
 import datetime
 from dotenv import set_key, unset_key
-from .random_post import create_gacha_panel
+from .random_post import replace_gacha_panel
+from utils.thread_cards import ThreadCard
+from utils.card_embeds import card_embed
+from utils.forum_sync import ForumSyncResult
+from utils.debounce import KeyedDebouncer
+from utils.rate_limit import RequestBudget
+from utils.delivery_queue import DIGEST_MAX_EMBEDS, DeliveryJob, DeliveryQueue, PermanentDeliveryError, init_delivery_db
+from utils.permissions import ADMIN_ROLES, require_roles
 import json
 
-# --- 数据库文件路径 ---
-DB_FILE = 'posts.db'
-
 # --- Cog 类 ---
 class ForumTools(commands.Cog):
     """
@@ -35,10 +38,39 @@ class ForumTools(commands.Cog):
         
         # 启动新的清理任务
         self.cleanup_old_posts_task.start()
+        # 后台全量同步任务（不依附于某一次交互，重启后会从断点恢复）
+        self.full_sync_job: Optional[asyncio.Task] = None
+        # 新帖速递队列：任务保存在数据库中，由固定数量的工作协程发送，配置见 DELIVERY_* 环境变量
+        self.delivery_queue = DeliveryQueue.from_env(bot.db, self._send_deliveries)
+        # 速递成功后的面板重建会被合并：一段时间内没有新的速递时才重建一次
+        try:
+            panel_delay = float(os.getenv("PANEL_REBUILD_DELAY_SECONDS", "10"))
+            panel_max_wait = float(os.getenv("PANEL_REBUILD_MAX_WAIT_SECONDS", "60"))
+        except ValueError:
+            print("⚠️ 面板重建的 .env 配置值无效，将使用默认值。")
+            panel_delay, panel_max_wait = 10.0, 60.0
+        self.panel_rebuilds = KeyedDebouncer(panel_delay, panel_max_wait)
+        # 速递消息的保留时长，以及无法批量删除时逐条删除的速率
+        try:
+            self.delivery_retention_hours = float(os.getenv("DELIVERY_RETENTION_HOURS", "24"))
+            cleanup_deletes_per_minute = float(os.getenv("CLEANUP_DELETES_PER_MINUTE", "30"))
+        except ValueError:
+            print("⚠️ 速递清理的 .env 配置值无效，将使用默认值。")
+            self.delivery_retention_hours, cleanup_deletes_per_minute = 24.0, 30.0
+        self.cleanup_budget = RequestBudget(cleanup_deletes_per_minute)
+        # 升级前发送的速递不在索引中，启动后的第一次清理会额外扫描一次频道历史
+        self.legacy_cleanup_done = False
+
+    async def cog_load(self):
+        await self.bot.db.transaction(init_delivery_db)
 
     def cog_unload(self):
         self.incremental_sync_task.cancel()
         self.cleanup_old_posts_task.cancel()
+        if self.full_sync_job:
+            self.full_sync_job.cancel()
+        self.delivery_queue.stop()
+        self.panel_rebuilds.cancel_all()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -49,6 +81,10 @@ class ForumTools(commands.Cog):
         if not self.cleanup_old_posts_task.is_running():
             print("[ForumTools] Bot is ready, starting cleanup_old_posts_task.")
             self.cleanup_old_posts_task.start()
+        if self.full_sync_job is None:
+            await self._resume_full_sync()
+        # 继续发送上次运行时尚未完成的速递
+        await self.delivery_queue.start()
 
     # 移除这里的硬编码时间, 在 __init__ 中动态设置
     @tasks.loop()
@@ -67,60 +103,30 @@ class ForumTools(commands.Cog):
             print("="*50 + "\n")
             return
 
-        def _get_last_id_from_db(forum_id):
-            con = sqlite3.connect(DB_FILE)
-            cur = con.cursor()
-            cur.execute("SELECT MAX(thread_id) FROM threads WHERE forum_id = ?", (forum_id,))
-            row = cur.fetchone()
-            con.close()
-            return row[0] if row and row[0] else None
-
-        def _insert_threads_to_db(thread_data):
-            if not thread_data:
-                return 0
-            con = sqlite3.connect(DB_FILE)
-            cur = con.cursor()
-            cur.executemany("INSERT OR IGNORE INTO threads (thread_id, forum_id, guild_id) VALUES (?, ?, ?)", thread_data)
-            row_count = cur.rowcount
-            con.commit()
-            con.close()
-            return row_count
-
-        total_added = 0
+        forums = []
         for forum_id in forum_ids_to_scan:
             try:
                 forum = self.bot.get_channel(forum_id) or await self.bot.fetch_channel(forum_id)
-                if not forum or not isinstance(forum, discord.ForumChannel):
-                    print(f"[后台任务] 找不到或无效的论坛频道ID: {forum_id}，从列表跳过。")
-                    continue
-                
-                print(f"[后台任务] ==> 正在处理频道: {forum.name} (ID: {forum_id})")
-                
-                last_id = await asyncio.to_thread(_get_last_id_from_db, forum_id)
-
-                if last_id is None:
-                    print(f"[后台任务] 论坛 '{forum.name}' 在数据库中为空，跳过。等待手动全量同步。")
-                    continue
-
-                new_threads = []
-                for thread in forum.threads:
-                    if thread.id > last_id:
-                        new_threads.append(thread)
-                async for thread in forum.archived_threads(limit=None):
-                    if thread.id > last_id:
-                        new_threads.append(thread)
-
-                if new_threads:
-                    unique_new_threads = {t.id: t for t in new_threads}.values()
-                    thread_data = [(t.id, forum.id, forum.guild.id) for t in unique_new_threads]
-                    added_count = await asyncio.to_thread(_insert_threads_to_db, thread_data)
-                    total_added += added_count
+            except (discord.NotFound, discord.Forbidden):
+                forum = None
+            if not forum or not isinstance(forum, discord.ForumChannel):
+                print(f"[后台任务] 找不到或无效的论坛频道ID: {forum_id}，从列表跳过。")
+                continue
+            forums.append(forum)
+
+        # 多个论坛并发同步，共享同一个请求预算；每个论坛只翻到上次的归档游标为止
+        results = await self.bot.forum_sync.sync_forums(forums)
+
+        total_added = 0
+        for result in results:
+            if result.skipped:
+                print(f"[后台任务] 论坛 '{result.forum_name}' 在数据库中为空，跳过。等待手动全量同步。")
+            elif result.error:
+                print(f"[后台任务] 增量同步论坛 '{result.forum_name}' (ID: {result.forum_id}) 时出错: {result.error}")
+            else:
+                print(f"[后台任务] ==> 论坛 '{result.forum_name}': 扫描 {result.scanned} 个帖子，新增 {result.added} 个，耗时 {result.duration:.1f} 秒。")
+            total_added += result.added
 
-            except discord.Forbidden:
-                print(f"[后台任务] 权限不足，无法增量同步论坛 (ID: {forum_id})。")
-            except Exception as e:
-                print(f"[后台任务] 增量同步论坛 (ID: {forum_id}) 时出错: {type(e).__name__}: {e}")
-        
         if total_added > 0:
             print(f"[后台任务] 增量同步完成。本次新增了 {total_added} 个帖子。")
         else:
@@ -153,284 +159,418 @@ class ForumTools(commands.Cog):
             return
 
         # 1. 更新数据库
-        def _update_db(thread_id, forum_id, guild_id):
+        try:
+            await self.bot.db.execute(
+                "INSERT OR IGNORE INTO threads (thread_id, forum_id, guild_id) VALUES (?, ?, ?)",
+                (thread.id, forum_id, thread.guild.id)
+            )
+        except Exception as e:
+            log_with_timestamp(f"数据库错误 (on_thread_create): {e}")
+        self.bot.thread_pool.add(thread.guild.id, forum_id, thread.id)
+
+        # 如果起始消息已在缓存中，立即生成帖子卡片；否则由速递任务在获取到起始消息后生成
+        if thread.starter_message:
             try:
-                con = sqlite3.connect(DB_FILE)
-                cur = con.cursor()
-                cur.execute(
-                    "INSERT OR IGNORE INTO threads (thread_id, forum_id, guild_id) VALUES (?, ?, ?)",
-                    (thread_id, forum_id, guild_id)
-                )
-                con.commit()
-                con.close()
+                await self.bot.thread_cards.put(self.bot.db, ThreadCard.from_thread(thread, thread.starter_message))
             except Exception as e:
-                log_with_timestamp(f"数据库错误 (on_thread_create): {e}")
+                log_with_timestamp(f"写入帖子卡片缓存失败 (on_thread_create): {e}")
+
+        # 2. 处理新帖速递：写入持久化队列，由队列的工作协程在延迟后发送（失败时按指数退避重试，重启后继续）
+        if self.bot.delivery_channel_id:
+            try:
+                await self.delivery_queue.enqueue(thread.id, thread.guild.id, forum_id)
+            except Exception as e:
+                log_with_timestamp(f"[新帖速递] 加入速递队列失败: {e}")
+
+    async def _prepare_delivery(self, job: DeliveryJob) -> discord.Embed:
+        """获取帖子与起始消息并构建速递 Embed。抛出 PermanentDeliveryError 表示无需再重试。"""
+        def log_with_timestamp(message):
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}")
+
+        try:
+            thread = self.bot.get_channel(job.thread_id) or await self.bot.fetch_channel(job.thread_id)
+        except discord.NotFound:
+            raise PermanentDeliveryError("帖子已被删除")
+        except discord.Forbidden:
+            raise PermanentDeliveryError("机器人权限不足，无法获取帖子")
+
+        log_with_timestamp(f"[新帖速递] 正在为 '{thread.name}' 进行第 {job.attempts + 1} 次构建和发送尝试...")
 
-        await asyncio.to_thread(_update_db, thread.id, forum_id, thread.guild.id)
+        starter_message = None
+        try:
+            # 使用更短的超时来快速失败
+            starter_message = await asyncio.wait_for(thread.fetch_message(thread.id), timeout=10.0)
+        except (discord.NotFound, asyncio.TimeoutError):
+            # 即使没有消息，我们仍然可以发送一个不带内容的速递
+            log_with_timestamp(f"[新帖速递] 注意：在第 {job.attempts + 1} 次尝试中未能获取到帖子 '{thread.name}' 的起始消息。")
+        except discord.Forbidden:
+            raise PermanentDeliveryError(f"机器人权限不足，无法获取帖子 '{thread.name}' 的起始消息")
 
-        # 2. 处理新帖速递
-        # 2. 异步处理新帖速递
-        # 创建一个后台任务来处理，这样 on_thread_create 不会被长时间阻塞
-        asyncio.create_task(self._send_delivery_with_retries(thread))
+        # 与抽卡共用同一套卡片渲染；获取到起始消息时顺便写入帖子卡片缓存，之后抽到这个帖子时无需再次请求
+        card = ThreadCard.from_thread(thread, starter_message)
+        if starter_message:
+            await self.bot.thread_cards.put(self.bot.db, card)
 
-    async def _send_delivery_with_retries(self, thread: discord.Thread):
+        embed = card_embed(card)
+        log_with_timestamp(f"[诊断日志] 准备为帖子 '{thread.name}' (ID: {thread.id}) 发送以下 Embed 内容:\n{embed.to_dict()}")
+        return embed
+
+    async def _send_deliveries(self, jobs: list[DeliveryJob]) -> dict[int, Exception]:
         """
-        一个独立的、带重试逻辑的异步任务，用于构建和发送新帖速递。
-        每次重试都会从头开始构建 Embed。
+        速递队列的处理函数：为一批帖子构建 Embed 并发送，返回失败的 {帖子ID: 异常}，由队列安排重试或放弃。
+        一批只有一个帖子时与逐条速递相同；摘要模式下多个 Embed 合并到同一条消息中
+        （单条消息最多 10 个 Embed、总计 6000 字符，超出时拆成多条）。
         """
-        # --- 从 .env 加载速递相关配置, 提供默认值 ---
-        try:
-            fetch_delay = float(os.getenv("FETCH_STARTER_MESSAGE_DELAY_SECONDS", "15.0"))
-            send_max_attempts = int(os.getenv("DELIVERY_MAX_RETRIES", "5"))
-            send_retry_delay = float(os.getenv("DELIVERY_RETRY_DELAY_SECONDS", "60.0"))
-        except ValueError:
-            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] ⚠️ .env 文件中的速递配置值无效，将使用默认值。")
-            fetch_delay = 15.0
-            send_max_attempts = 5
-            send_retry_delay = 60.0
+        def log_with_timestamp(message):
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}")
 
         delivery_channel_id = self.bot.delivery_channel_id
         if not delivery_channel_id:
-            return
-        
+            return {}  # 速递功能已被关闭，直接丢弃
+
         delivery_channel = self.bot.get_channel(delivery_channel_id)
         if not delivery_channel:
-            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] ❌ 错误：在 .env 中配置的速递频道ID {delivery_channel_id} 找不到。")
+            error = PermanentDeliveryError(f"在 .env 中配置的速递频道ID {delivery_channel_id} 找不到")
+            return {job.thread_id: error for job in jobs}
+
+        # --- 步骤 1: 并发获取起始消息并构建 Embed ---
+        errors: dict[int, Exception] = {}
+        prepared: list[tuple[DeliveryJob, discord.Embed]] = []
+        results = await asyncio.gather(*(self._prepare_delivery(job) for job in jobs), return_exceptions=True)
+        for job, result in zip(jobs, results):
+            if isinstance(result, BaseException):
+                errors[job.thread_id] = result
+            else:
+                prepared.append((job, result))
+
+        # --- 步骤 2: 按 Discord 的限制分组发送（HTTP 错误记为失败，由队列安排重试） ---
+        groups: list[list[tuple[DeliveryJob, discord.Embed]]] = []
+        size = 0
+        for item in prepared:
+            if not groups or len(groups[-1]) >= DIGEST_MAX_EMBEDS or size + len(item[1]) > 6000:
+                groups.append([])
+                size = 0
+            groups[-1].append(item)
+            size += len(item[1])
+
+        for group in groups:
+            try:
+                sent_message = await delivery_channel.send(embeds=[embed for _, embed in group])
+                if not sent_message or not sent_message.embeds:
+                    raise RuntimeError("API返回了空消息或无效消息对象")
+            except Exception as e:
+                errors.update((job.thread_id, e) for job, _ in group)
+                continue
+            log_with_timestamp(f"[新帖速递] ✅ 已发送 {len(group)} 个帖子的速递 (消息ID: {sent_message.id})。")
+            # 记录到已发送消息索引，过期后由清理任务批量删除（摘要消息只记录第一个帖子）
+            # 消息已经发出：索引写入失败只记录日志，不能让队列把这批帖子当作失败而重复发送
+            try:
+                await self.bot.db.execute(
+                    "INSERT OR IGNORE INTO delivery_messages (message_id, channel_id, guild_id, thread_id, sent_at) VALUES (?, ?, ?, ?, ?)",
+                    (sent_message.id, delivery_channel.id, delivery_channel.guild.id, group[0][0].thread_id, sent_message.created_at.timestamp())
+                )
+            except Exception as e:
+                log_with_timestamp(f"[新帖速递] ⚠️ 记录速递消息 {sent_message.id} 失败，该消息不会被自动清理: {type(e).__name__}: {e}")
+
+        # --- 成功后，安排面板重建（短时间内的多次速递只会重建一次） ---
+        if len(errors) < len(jobs):
+            self.panel_rebuilds.schedule(delivery_channel.id, lambda: self._rebuild_panel(delivery_channel))
+        return errors
+
+    async def _rebuild_panel(self, delivery_channel: discord.TextChannel):
+        """删除速递频道中的旧抽卡面板并发送新面板，让面板始终位于频道底部。"""
+        try:
+            await replace_gacha_panel(self.bot, delivery_channel)
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [面板管理] 抽卡面板已在速递频道重建。")
+        except Exception as e:
+            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [面板管理] 严重错误：重建抽卡面板时失败: {e}")
+
+
+    # --- 事件监听器：帖子被删除、移动或置顶时，增量维护卡池 ---
+    @commands.Cog.listener()
+    async def on_raw_thread_delete(self, payload: discord.RawThreadDeleteEvent):
+        if payload.parent_id not in self.bot.allowed_forum_ids:
+            return
+        # 交给墓碑队列：立即移出内存卡池，数据库删除由后台任务批量提交
+        self.bot.tombstones.bury(payload.thread_id, payload.guild_id, payload.parent_id)
+        print(f"[卡池维护] 帖子 (ID: {payload.thread_id}) 已被删除，已移出卡池。")
+
+    async def _restore_thread(self, thread: discord.Thread):
+        """把帖子写回（或移动到）其当前所在的论坛，并同步内存卡池。"""
+        self.bot.tombstones.revive(thread.id)
+        await self.bot.db.execute(
+            "INSERT INTO threads (thread_id, forum_id, guild_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(thread_id) DO UPDATE SET forum_id = excluded.forum_id, guild_id = excluded.guild_id",
+            (thread.id, thread.parent_id, thread.guild.id)
+        )
+        self.bot.thread_pool.add(thread.guild.id, thread.parent_id, thread.id)
+
+    # --- 事件监听器：帖子或起始消息变化时，使对应的帖子卡片缓存失效 ---
+    @commands.Cog.listener()
+    async def on_thread_update(self, before: discord.Thread, after: discord.Thread):
+        was_tracked = before.parent_id in self.bot.allowed_forum_ids
+        is_tracked = after.parent_id in self.bot.allowed_forum_ids
+        if not was_tracked and not is_tracked:
             return
 
-        # --- 首次尝试前的初始延迟 ---
-        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] 检测到新帖 '{thread.name}'。等待 {fetch_delay} 秒，以确保CDN资源就绪...")
-        await asyncio.sleep(fetch_delay)
+        moved = before.parent_id != after.parent_id
+        pin_changed = before.flags.pinned != after.flags.pinned
+        try:
+            if is_tracked and after.flags.pinned:
+                # 置顶帖（通常是版规/公告）不参与抽卡
+                if pin_changed or moved:
+                    self.bot.tombstones.bury(after.id, before.guild.id, before.parent_id)
+                    print(f"[卡池维护] 帖子 '{after.name}' (ID: {after.id}) 被置顶，已移出卡池。")
+            elif not is_tracked:
+                # 被移动到了不受监控的频道
+                self.bot.tombstones.bury(after.id, before.guild.id, before.parent_id)
+                print(f"[卡池维护] 帖子 '{after.name}' (ID: {after.id}) 已移出监控论坛，已移出卡池。")
+            elif moved or pin_changed:
+                if moved:
+                    self.bot.thread_pool.discard(after.id, before.guild.id, before.parent_id)
+                await self._restore_thread(after)
+                print(f"[卡池维护] 帖子 '{after.name}' (ID: {after.id}) 已{'移动到论坛 ' + str(after.parent_id) if moved else '取消置顶'}，卡池已更新。")
+        except Exception as e:
+            print(f"[卡池维护] 更新帖子 (ID: {after.id}) 时出错: {type(e).__name__}: {e}")
 
-        for attempt in range(send_max_attempts):
-            try:
-                print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] 正在为 '{thread.name}' 进行第 {attempt + 1}/{send_max_attempts} 次构建和发送尝试...")
-                
-                # --- 步骤 1: 在每次循环内部获取起始消息 ---
-                starter_message = None
-                try:
-                    # 使用更短的超时来快速失败
-                    starter_message = await asyncio.wait_for(thread.fetch_message(thread.id), timeout=10.0)
-                except (discord.NotFound, asyncio.TimeoutError):
-                    print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] 注意：在第 {attempt + 1} 次尝试中未能获取到帖子 '{thread.name}' 的起始消息。")
-                    # 即使没有消息，我们仍然可以发送一个不带内容的速递
-                    pass
-                except discord.Forbidden:
-                    print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] ❌ 失败：机器人权限不足，无法获取帖子 '{thread.name}' 的起始消息。已终止对此帖的速递。")
-                    return # 权限问题无法通过重试解决，直接返回
-
-                # --- 步骤 2: 在每次循环内部构建 Embed ---
-                author_mention = f"**👤 作者:** {thread.owner.name}" if thread.owner else f"**👤 作者:** 未知"
-                thread_title = thread.name[:97] + "..." if len(thread.name) > 100 else thread.name
-                header_line = f"**{thread_title}** | {author_mention}"
-
-                if starter_message and starter_message.content:
-                    post_content = starter_message.content
-                    if len(post_content) > 400:
-                        post_content = post_content[:400] + "..."
-                    content_section = f"**📝 内容速览:**\n{post_content}"
-                else:
-                    content_section = "**📝 内容速览:**\n*(无法加载起始消息，可能已被删除或帖子格式特殊)*"
-                
-                full_description = f"{header_line}\n\n{content_section}"
-                embed = discord.Embed(title="✨ 新卡速递", description=full_description, color=discord.Color.blue())
-                embed.add_field(name="🚪 传送门", value=f"[点击查看原帖]({thread.jump_url})", inline=False)
-
-                if starter_message and starter_message.attachments:
-                    for attachment in starter_message.attachments:
-                        if attachment.content_type and attachment.content_type.startswith('image/'):
-                            embed.set_thumbnail(url=attachment.url)
-                            break
-                
-                if thread.applied_tags:
-                    tags_str = ", ".join(tag.name for tag in thread.applied_tags)
-                    if len(tags_str) > 1024:
-                        tags_str = tags_str[:1021] + "..."
-                    embed.add_field(name="🏷️ 标签", value=tags_str, inline=False)
-
-                print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [诊断日志] 准备为帖子 '{thread.name}' (ID: {thread.id}) 发送以下 Embed 内容:\n{embed.to_dict()}")
-
-                # --- 步骤 3: 发送 Embed ---
-                sent_message = await delivery_channel.send(embed=embed)
-
-                # --- 步骤 4: 验证 ---
-                if sent_message and sent_message.embeds:
-                    print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] ✅ 第 {attempt + 1} 次尝试成功！消息 (ID: {sent_message.id}) 已成功发送。")
-                    
-                    # --- 成功后，异步执行面板重建 ---
-                    async def rebuild_panel():
-                        await asyncio.sleep(2) # 战略性延迟
-                        try:
-                            # 查找并删除旧面板
-                            async for message in delivery_channel.history(limit=100):
-                                if message.author == self.bot.user and message.embeds and message.embeds[0].title == "🎉 类脑抽抽乐 🎉":
-                                    await message.delete()
-                                    break
-                            # 创建新面板
-                            await create_gacha_panel(self.bot, delivery_channel)
-                            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [面板管理] 抽卡面板已成功为帖子 '{thread.name}' 重建。")
-                        except Exception as e:
-                            print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [面板管理] 严重错误：为帖子 '{thread.name}' 重建抽卡面板时失败: {e}")
-                    
-                    asyncio.create_task(rebuild_panel())
-                    return # 任务完成，退出函数
+        await self.bot.thread_cards.invalidate(self.bot.db, after.id)
 
-                else:
-                    print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] ⚠️ 第 {attempt + 1} 次尝试失败：API返回了空消息或无效消息对象。将在 {send_retry_delay} 秒后重试...")
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        # 论坛帖子的起始消息ID与帖子ID相同
+        if payload.message_id != payload.channel_id:
+            return
+        await self.bot.thread_cards.invalidate(self.bot.db, payload.message_id)
 
+    async def _delete_messages(self, channel: discord.TextChannel, message_ids: list[int]) -> list[int]:
+        """
+        删除一批消息，返回已删除（或本来就不存在）的消息ID。
+        14 天内的消息每 100 条用一次批量删除；更早的消息，以及批量删除失败的批次，按请求预算逐条删除。
+        """
+        # Discord 只允许批量删除 14 天内的消息，留出一小时余量
+        bulk_limit = discord.utils.time_snowflake(discord.utils.utcnow() - datetime.timedelta(days=14, hours=-1))
+        recent = [message_id for message_id in message_ids if message_id > bulk_limit]
+        single = [message_id for message_id in message_ids if message_id <= bulk_limit]
+        deleted = []
+
+        for i in range(0, len(recent), 100):
+            batch = recent[i:i + 100]
+            try:
+                await channel.delete_messages([discord.Object(id=message_id) for message_id in batch])
+                deleted.extend(batch)
             except discord.HTTPException as e:
-                print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] ⚠️ 第 {attempt + 1} 次尝试失败：遇到HTTP异常 {e.status} (Code: {e.code})。将在 {send_retry_delay} 秒后重试...")
-            except Exception as e:
-                import traceback
-                print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] ❌ 第 {attempt + 1} 次尝试时遇到严重未知错误: {type(e).__name__}: {e}。")
-                print(f"Traceback: {traceback.format_exc()}")
-                # 遇到未知错误，可能重试也无用，直接终止
-                break
-            
-            # 如果还未成功，且不是最后一次尝试，则等待
-            if attempt < send_max_attempts - 1:
-                await asyncio.sleep(send_retry_delay)
-
-        # 如果循环完成所有次数都未成功
-        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [新帖速递] ❌ 最终失败：在 {send_max_attempts} 次尝试后，仍未能成功发送关于帖子 '{thread.name}' 的速递。")
+                # 例如缺少“管理消息”权限（删除自己的消息不需要该权限），退回到逐条删除
+                print(f"[清理任务] 批量删除失败 ({e})，改为逐条删除这 {len(batch)} 条消息。")
+                single.extend(batch)
 
+        for message_id in single:
+            await self.cleanup_budget.acquire()
+            try:
+                await channel.get_partial_message(message_id).delete()
+            except discord.NotFound:
+                pass
+            except discord.Forbidden:
+                print(f"[清理任务] 权限不足，无法删除消息 {message_id}。")
+                break
+            except discord.HTTPException as e:
+                print(f"[清理任务] 删除消息 {message_id} 时出错: {e}")
+                continue
+            deleted.append(message_id)
+        return deleted
+
+    async def _legacy_cleanup_ids(self, channel: discord.TextChannel, time_limit: datetime.datetime) -> list[int]:
+        """扫描一次频道历史，找出升级前发送、不在索引中的旧速递与空消息。"""
+        message_ids = []
+        async for message in channel.history(limit=None, before=time_limit, oldest_first=True):
+            if message.author != self.bot.user:
+                continue
+            if message.embeds:
+                if message.embeds[0].title and "新卡速递" in message.embeds[0].title:
+                    message_ids.append(message.id)
+            elif not message.content:
+                message_ids.append(message.id)
+        return message_ids
 
     @tasks.loop(hours=1)
     async def cleanup_old_posts_task(self):
-        """后台任务，每小时运行一次，清理超过24小时的速递消息。"""
+        """后台任务，每小时运行一次，按已发送消息索引清理超过保留时长（默认24小时）的速递消息。"""
         await self.bot.wait_until_ready()
-        
-        delivery_channel_id = self.bot.delivery_channel_id
-        if not delivery_channel_id:
-            return # 如果没有设置速递频道，则不执行任何操作
 
-        channel = self.bot.get_channel(delivery_channel_id)
-        if not channel:
+        time_limit = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=self.delivery_retention_hours)
+        try:
+            rows = await self.bot.db.fetchall(
+                "SELECT channel_id, message_id FROM delivery_messages WHERE sent_at < ? ORDER BY sent_at", (time_limit.timestamp(),)
+            )
+        except Exception as e:
+            print(f"[清理任务] 读取速递消息索引失败: {e}")
             return
 
-        # print(f"[清理任务] 开始检查频道 '{channel.name}' 中的旧帖子...") # 注释掉，以减少不必要的日志
-        deleted_count = 0
-        
-        # 计算24小时前的时间点
-        time_limit = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=24)
+        by_channel: dict[int, list[int]] = {}
+        for channel_id, message_id in rows:
+            by_channel.setdefault(channel_id, []).append(message_id)
 
-        try:
-            async for message in channel.history(limit=None, oldest_first=True):
-                # 如果消息比时间限制还早，就处理它
-                if message.created_at < time_limit:
-                    # --- 规则1: 删除带有 "新卡速递" embed 的旧机器人消息 ---
-                    if message.author == self.bot.user and message.embeds:
-                        if message.embeds[0].title and "新卡速递" in message.embeds[0].title:
-                            try:
-                                await message.delete()
-                                deleted_count += 1
-                                await asyncio.sleep(1) # 增加延迟避免速率限制
-                            except discord.Forbidden:
-                                print(f"[清理任务] 权限不足，无法删除消息 {message.id}。")
-                                break
-                            except discord.HTTPException as e:
-                                print(f"[清理任务] 删除消息 {message.id} 时出错: {e}")
-                    # --- 规则2: 删除由机器人发送的、完全为空的旧消息 ---
-                    elif message.author == self.bot.user and not message.embeds and not message.content:
-                        try:
-                            await message.delete()
-                            deleted_count += 1
-                            print(f"[清理任务] 发现并删除了一条旧的空消息 (ID: {message.id})。")
-                            await asyncio.sleep(1) # 增加延迟避免速率限制
-                        except discord.Forbidden:
-                            print(f"[清理任务] 权限不足，无法删除空消息 {message.id}。")
-                            break
-                        except discord.HTTPException as e:
-                            print(f"[清理任务] 删除空消息 {message.id} 时出错: {e}")
-                else:
-                    # 因为我们从最旧的消息开始，一旦遇到一个在24小时内的消息，
-                    # 就可以确定后面的所有消息都是新的，无需再检查
-                    break
-        except discord.Forbidden:
-            print(f"[清理任务] 权限不足，无法读取频道 '{channel.name}' 的历史记录。")
-        except Exception as e:
-            print(f"[清理任务] 发生未知错误: {e}")
+        if not self.legacy_cleanup_done and self.bot.delivery_channel_id:
+            channel = self.bot.get_channel(self.bot.delivery_channel_id)
+            if channel:
+                try:
+                    legacy_ids = await self._legacy_cleanup_ids(channel, time_limit)
+                    by_channel.setdefault(channel.id, []).extend(set(legacy_ids) - set(by_channel.get(channel.id, ())))
+                    self.legacy_cleanup_done = True
+                except discord.Forbidden:
+                    print(f"[清理任务] 权限不足，无法读取频道 '{channel.name}' 的历史记录。")
+                except Exception as e:
+                    print(f"[清理任务] 扫描旧速递时发生未知错误: {e}")
 
-        if deleted_count > 0:
-            print(f"[清理任务] 清理完成，在频道 '{channel.name}' 中成功删除了 {deleted_count} 条超过24小时的旧速递。")
+        for channel_id, message_ids in by_channel.items():
+            channel = self.bot.get_channel(channel_id)
+            try:
+                # 频道已不存在时直接丢弃索引记录
+                deleted = await self._delete_messages(channel, message_ids) if channel else message_ids
+                await self.bot.db.executemany("DELETE FROM delivery_messages WHERE message_id = ?", [(message_id,) for message_id in deleted])
+            except Exception as e:
+                print(f"[清理任务] 清理频道 {channel_id} 时发生未知错误: {e}")
+                continue
+            if channel and deleted:
+                print(f"[清理任务] 清理完成，在频道 '{channel.name}' 中成功删除了 {len(deleted)} 条超过保留时长的旧速递。")
 
     # --- 斜杠命令组：/设置 ---
     # 移除了所有动态配置命令，现在只保留手动同步
     config_group = app_commands.Group(name="设置", description="机器人设置与管理", guild_only=True)
 
     @config_group.command(name="手动全量同步", description="【重要】将.env中配置的论坛所有帖子同步到数据库。")
-    async def full_sync_command(self, interaction: discord.Interaction):
+    @app_commands.describe(restart="放弃上次未完成的全量同步进度，从头开始（默认从断点继续）")
+    @require_roles(ADMIN_ROLES)
+    async def full_sync_command(self, interaction: discord.Interaction, restart: bool = False):
         """手动执行一次全量同步，获取所有活跃和归档的帖子。"""
         await interaction.response.defer(ephemeral=True, thinking=True)
 
-        # --- 从 .env 加载管理员配置 ---
-        admin_role_ids_str = os.getenv("ADMIN_ROLE_IDS", "")
-        if not admin_role_ids_str:
-            await interaction.followup.send("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `ADMIN_ROLE_IDS`。", ephemeral=True)
-            return
-        admin_role_ids = {int(rid.strip()) for rid in admin_role_ids_str.split(',')}
-
-        # --- 权限检查 ---
-        user_roles = {role.id for role in interaction.user.roles}
-        if not user_roles.intersection(admin_role_ids):
-            await interaction.followup.send("🚫 **权限不足**：只有拥有特定管理员身份组的用户才能执行此操作。", ephemeral=True)
-            return
-
         # --- 从 bot 实例获取监控频道列表 ---
         forum_ids_to_scan = self.bot.allowed_forum_ids
         if not forum_ids_to_scan:
             await interaction.followup.send("❌ **配置错误**：机器人尚未在 `.env` 文件中配置 `ALLOWED_CHANNEL_IDS`。", ephemeral=True)
             return
 
-        # --- 异步收集数据 ---
-        all_thread_data = []
-        guild = interaction.guild
-        for forum_id in forum_ids_to_scan:
-            forum = guild.get_channel(forum_id)
-            if not forum or not isinstance(forum, discord.ForumChannel):
-                continue
+        forums = [forum for forum_id in forum_ids_to_scan if isinstance(forum := interaction.guild.get_channel(forum_id), discord.ForumChannel)]
+        if not forums:
+            await interaction.followup.send("❌ 在本服务器中找不到任何已配置的论坛频道。", ephemeral=True)
+            return
+
+        if self.full_sync_job and not self.full_sync_job.done():
+            await interaction.followup.send("⏳ 已有一个全量同步任务正在后台运行，请等待其完成。", ephemeral=True)
+            return
+
+        # --- 登记断点并在后台运行，进度通过编辑这条消息实时展示 ---
+        resumed = await self.bot.forum_sync.begin_full_sync(forums, restart=restart)
+        if resumed:
+            # 继续上一次未完成的全量同步时，跳过上次已经完成的论坛
+            pending_ids = set(await self.bot.forum_sync.unfinished_full_sync(interaction.guild.id))
+            forums = [forum for forum in forums if forum.id in pending_ids]
+        status = "检测到上次未完成的全量同步，将从断点继续" if resumed else "全量同步已在后台启动"
+        progress_message = await interaction.followup.send(f"⏳ **{status}**，共 {len(forums)} 个论坛...", ephemeral=True, wait=True)
+        self.full_sync_job = asyncio.create_task(self._run_full_sync(forums, progress_message))
+
+    @staticmethod
+    def _format_full_sync_progress(results: dict, finished: bool) -> str:
+        lines = ["✅ **全量同步完成！**" if finished else "⏳ **全量同步进行中...**"]
+        for result in results.values():
+            if result.error:
+                state = f"❌ {result.error}"
+            elif result.done:
+                state = "✅"
+            else:
+                state = "⏳"
+            lines.append(f"{state} **{result.forum_name}**: 已扫描 {result.scanned} 个帖子，新增 {result.added} 个")
+        total_added = sum(result.added for result in results.values())
+        lines.append(f"\n本次共新增了 **{total_added}** 个帖子到总卡池中。")
+        return "\n".join(lines)
+
+    async def _run_full_sync(self, forums: list, progress_message: Optional[discord.WebhookMessage] = None):
+        """后台运行的全量同步任务：每写入一块数据保存一次断点，并节流地编辑进度消息。"""
+        results = {forum.id: ForumSyncResult(forum.id, forum.name) for forum in forums}
+        last_edit = 0.0
+
+        async def _edit(finished: bool = False):
+            nonlocal progress_message, last_edit
+            if progress_message is None:
+                return
+            last_edit = asyncio.get_running_loop().time()
             try:
-                active_threads = forum.threads
-                archived_threads = [t async for t in forum.archived_threads(limit=None)]
-                
-                for thread in active_threads + archived_threads:
-                    all_thread_data.append((thread.id, forum.id, guild.id))
-            except discord.Forbidden:
-                print(f"[手动同步] 权限警告：无法同步论坛 {forum.mention} 的归档帖子。")
-            except Exception as e:
-                print(f"[手动同步] 收集论坛 '{forum.name}' 数据时出错: {e}")
-
-        # --- 同步写入数据库 ---
-        def _write_to_db(data):
-            if not data:
-                return 0
-            con = sqlite3.connect(DB_FILE)
-            cur = con.cursor()
-            cur.executemany("INSERT OR IGNORE INTO threads (thread_id, forum_id, guild_id) VALUES (?, ?, ?)", data)
-            added_count = cur.rowcount
-            con.commit()
-            con.close()
-            return added_count
-
-        total_added = await asyncio.to_thread(_write_to_db, all_thread_data)
-        
-        await interaction.followup.send(f"✅ **全量同步完成！** 本次新增了 **{total_added}** 个帖子到总卡池中。", ephemeral=True)
+                await progress_message.edit(content=self._format_full_sync_progress(results, finished))
+            except discord.HTTPException:
+                # 交互令牌 15 分钟后失效，之后只在控制台输出进度
+                progress_message = None
+
+        async def on_progress(result):
+            results[result.forum_id] = result
+            if asyncio.get_running_loop().time() - last_edit >= 5:
+                await _edit()
+
+        print(f"[手动同步] 开始全量同步 {len(forums)} 个论坛...")
+        try:
+            for result in await self.bot.forum_sync.full_sync_forums(forums, on_progress):
+                results[result.forum_id] = result
+                if result.error and result.done:
+                    print(f"[手动同步] 论坛 '{result.forum_name}' 无法同步，已放弃其断点: {result.error}")
+                elif result.error:
+                    print(f"[手动同步] 全量同步论坛 '{result.forum_name}' 时出错（断点已保存，可再次执行以继续）: {result.error}")
+                else:
+                    print(f"[手动同步] 论坛 '{result.forum_name}' 同步完成: 扫描 {result.scanned} 个帖子，新增 {result.added} 个。")
+        except Exception as e:
+            print(f"[手动同步] 全量同步任务异常终止（断点已保存）: {type(e).__name__}: {e}")
+        await _edit(finished=all(result.done for result in results.values()))
+
+    async def _resume_full_sync(self):
+        """机器人重启后，自动在后台继续未完成的全量同步。"""
+        pending_ids = await self.bot.forum_sync.unfinished_full_sync()
+        if not pending_ids:
+            return
+        forums = [forum for forum_id in pending_ids if isinstance(forum := self.bot.get_channel(forum_id), discord.ForumChannel)]
+        found_ids = {forum.id for forum in forums}
+        missing = [forum_id for forum_id in pending_ids if forum_id not in found_ids]
+        if missing:
+            # 论坛已被删除或不再可见：结束其断点，不再在每次重启时重试
+            print(f"[手动同步] 有 {len(missing)} 个论坛的全量同步未完成，但找不到对应的论坛频道，已放弃这些论坛的断点。")
+            await self.bot.forum_sync.abandon_full_sync(missing)
+        if not forums:
+            return
+        print(f"[手动同步] 检测到未完成的全量同步，正在从断点恢复 {len(forums)} 个论坛...")
+        self.full_sync_job = asyncio.create_task(self._run_full_sync(forums))
+
+    @config_group.command(name="卡池状态", description="查看内存卡池与失效帖子清理的统计信息。")
+    @require_roles(ADMIN_ROLES)
+    async def pool_status(self, interaction: discord.Interaction):
+        """展示卡池规模以及每小时清理的失效帖子数量。"""
+        tombstones = self.bot.tombstones
+        embed = discord.Embed(title="📊 卡池状态", color=discord.Color.teal())
+        embed.add_field(name="卡池帖子总数", value=str(self.bot.thread_pool.total()), inline=True)
+        embed.add_field(name="待清理的失效帖子", value=str(tombstones.pending()), inline=True)
+        embed.add_field(name="本小时已清理", value=str(tombstones.purged_this_hour()), inline=True)
+
+        queue = await self.delivery_queue.stats()
+        embed.add_field(
+            name="新帖速递队列",
+            value=(
+                f"排队 {queue.depth} 个（已到期 {queue.due} 个，发送中 {queue.in_flight} 个）\n"
+                f"最早的任务已等待 {int(queue.oldest_age)} 秒\n"
+                f"本次启动以来：成功 {queue.delivered} 个，放弃 {queue.failed} 个"
+            ),
+            inline=False
+        )
+
+        hourly = tombstones.hourly_stats(hours=24)
+        if hourly:
+            lines = [f"`{datetime.datetime.fromtimestamp(hour).strftime('%m-%d %H:00')}` 清理 {count} 个" for hour, count in hourly]
+            embed.add_field(name="最近24小时（每小时清理数）", value="\n".join(lines)[:1024], inline=False)
+        else:
+            embed.add_field(name="最近24小时（每小时清理数）", value="暂无清理记录", inline=False)
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
     @config_group.command(name="设置速递频道", description="【重要】设置或更新新帖速递的目标频道。")
     @app_commands.describe(channel="要设置为速递目标的文本频道")
+    @require_roles(ADMIN_ROLES)
     async def set_delivery_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
         """处理设置速递频道的命令。"""
-        # --- 权限检查 (复用 ADMIN_ROLE_IDS) ---
-        admin_role_ids_str = os.getenv("ADMIN_ROLE_IDS", "")
-        if not admin_role_ids_str:
-            await interaction.response.send_message("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `ADMIN_ROLE_IDS`。", ephemeral=True)
-            return
-        admin_role_ids = {int(rid.strip()) for rid in admin_role_ids_str.split(',')}
-        user_roles = {role.id for role in interaction.user.roles}
-        if not user_roles.intersection(admin_role_ids):
-            await interaction.response.send_message("🚫 **权限不足**：只有拥有特定管理员身份组的用户才能执行此操作。", ephemeral=True)
-            return
-        
         try:
             dotenv_path = os.path.join(os.getcwd(), '.env')
             await asyncio.to_thread(set_key, dotenv_path, "DELIVERY_CHANNEL_ID", str(channel.id))
@@ -446,19 +586,9 @@ class ForumTools(commands.Cog):
             await interaction.response.send_message(f"❌ **写入 .env 文件失败**: `{e}`", ephemeral=True)
 
     @config_group.command(name="移除速递频道", description="【重要】禁用新帖速递功能。")
+    @require_roles(ADMIN_ROLES)
     async def unset_delivery_channel(self, interaction: discord.Interaction):
         """处理移除速递频道的命令。"""
-        # --- 权限检查 (复用 ADMIN_ROLE_IDS) ---
-        admin_role_ids_str = os.getenv("ADMIN_ROLE_IDS", "")
-        if not admin_role_ids_str:
-            await interaction.response.send_message("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `ADMIN_ROLE_IDS`。", ephemeral=True)
-            return
-        admin_role_ids = {int(rid.strip()) for rid in admin_role_ids_str.split(',')}
-        user_roles = {role.id for role in interaction.user.roles}
-        if not user_roles.intersection(admin_role_ids):
-            await interaction.response.send_message("🚫 **权限不足**：只有拥有特定管理员身份组的用户才能执行此操作。", ephemeral=True)
-            return
-
         try:
             dotenv_path = os.path.join(os.getcwd(), '.env')
             await asyncio.to_thread(unset_key, dotenv_path, "DELIVERY_CHANNEL_ID")
@@ -475,19 +605,9 @@ class ForumTools(commands.Cog):
 
     @config_group.command(name="添加监控论坛", description="【重要】添加一个新的论坛频道到监控列表。")
     @app_commands.describe(channel="要添加的论坛频道")
+    @require_roles(ADMIN_ROLES)
     async def add_monitored_forum(self, interaction: discord.Interaction, channel: discord.ForumChannel):
         """处理添加监控论坛的命令。"""
-        # --- 权限检查 ---
-        admin_role_ids_str = os.getenv("ADMIN_ROLE_IDS", "")
-        if not admin_role_ids_str:
-            await interaction.response.send_message("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `ADMIN_ROLE_IDS`。", ephemeral=True)
-            return
-        admin_role_ids = {int(rid.strip()) for rid in admin_role_ids_str.split(',')}
-        user_roles = {role.id for role in interaction.user.roles}
-        if not user_roles.intersection(admin_role_ids):
-            await interaction.response.send_message("🚫 **权限不足**。", ephemeral=True)
-            return
-
         try:
             def _update_env():
                 dotenv_path = os.path.join(os.getcwd(), '.env')
@@ -511,19 +631,9 @@ class ForumTools(commands.Cog):
 
     @config_group.command(name="移除监控论坛", description="【重要】从监控列表中移除一个论坛频道。")
     @app_commands.describe(channel="要移除的论坛频道")
+    @require_roles(ADMIN_ROLES)
     async def remove_monitored_forum(self, interaction: discord.Interaction, channel: discord.ForumChannel):
         """处理移除监控论坛的命令。"""
-        # --- 权限检查 ---
-        admin_role_ids_str = os.getenv("ADMIN_ROLE_IDS", "")
-        if not admin_role_ids_str:
-            await interaction.response.send_message("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `ADMIN_ROLE_IDS`。", ephemeral=True)
-            return
-        admin_role_ids = {int(rid.strip()) for rid in admin_role_ids_str.split(',')}
-        user_roles = {role.id for role in interaction.user.roles}
-        if not user_roles.intersection(admin_role_ids):
-            await interaction.response.send_message("🚫 **权限不足**。", ephemeral=True)
-            return
-
         try:
             def _update_env():
                 dotenv_path = os.path.join(os.getcwd(), '.env')
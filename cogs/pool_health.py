@@ -0,0 +1,96 @@
+# cogs/pool_health.py
+import os
+import time
+import discord
+from discord.ext import commands, tasks
+
+from utils.rate_limit import RequestBudget
+
+
+class PoolHealth(commands.Cog):
+    """
+    低优先级的卡池健康巡检。
+    按“最久未验证”的顺序分批遍历 threads 表：优先用网关缓存判断帖子状态，
+    缓存中没有的帖子才会在请求预算内调用 fetch_channel。
+    已删除、无权访问或被置顶的帖子会交给墓碑队列移出卡池，让抽卡几乎遇不到失效帖子。
+    """
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        # --- 从 .env 读取巡检配置 ---
+        try:
+            interval_minutes = float(os.getenv("POOL_SWEEP_INTERVAL_MINUTES", "10"))
+            self.chunk_size = int(os.getenv("POOL_SWEEP_CHUNK_SIZE", "200"))
+            requests_per_minute = float(os.getenv("POOL_SWEEP_REQUESTS_PER_MINUTE", "20"))
+            self.reverify_seconds = float(os.getenv("POOL_SWEEP_REVERIFY_HOURS", "72")) * 3600
+        except ValueError:
+            print("⚠️ [卡池巡检] .env 中的巡检配置值无效，将使用默认值。")
+            interval_minutes, self.chunk_size, requests_per_minute, self.reverify_seconds = 10.0, 200, 20.0, 72 * 3600
+
+        self.budget = RequestBudget(requests_per_minute)
+        self.sweep_pool.change_interval(minutes=interval_minutes)
+        self.sweep_pool.start()
+
+    def cog_unload(self):
+        self.sweep_pool.cancel()
+
+    async def _check_thread(self, thread_id: int, guild_id: int) -> str:
+        """返回帖子状态: 'alive'、'dead'（已删除/无权访问/不是帖子）或 'pinned'。网络错误会直接抛出。"""
+        guild = self.bot.get_guild(guild_id)
+        thread = guild.get_thread(thread_id) if guild else None
+        if thread is None:
+            # 缓存未命中，消耗一次请求预算
+            await self.budget.acquire()
+            try:
+                thread = await self.bot.fetch_channel(thread_id)
+            except (discord.NotFound, discord.Forbidden):
+                return 'dead'
+        if not isinstance(thread, discord.Thread):
+            return 'dead'
+        if thread.flags.pinned:
+            return 'pinned'
+        return 'alive'
+
+    @tasks.loop()
+    async def sweep_pool(self):
+        """每次巡检一批最久未验证的帖子。"""
+        try:
+            cutoff = time.time() - self.reverify_seconds
+            rows = await self.bot.db.fetchall(
+                "SELECT thread_id, forum_id, guild_id FROM threads "
+                "WHERE last_verified_at IS NULL OR last_verified_at < ? "
+                "ORDER BY last_verified_at LIMIT ?",
+                (cutoff, self.chunk_size)
+            )
+            if not rows:
+                return
+
+            verified = []
+            pruned = {'dead': 0, 'pinned': 0}
+            for thread_id, forum_id, guild_id in rows:
+                try:
+                    status = await self._check_thread(thread_id, guild_id)
+                except discord.HTTPException as e:
+                    # API 暂时不可用，剩下的帖子留到下一轮，避免白白消耗预算
+                    print(f"[卡池巡检] 验证帖子 {thread_id} 时遇到HTTP异常 {e.status}，本轮巡检提前结束。")
+                    break
+                if status == 'alive':
+                    verified.append((time.time(), thread_id))
+                else:
+                    self.bot.tombstones.bury(thread_id, guild_id, forum_id)
+                    pruned[status] += 1
+
+            if verified:
+                await self.bot.db.executemany("UPDATE threads SET last_verified_at = ? WHERE thread_id = ?", verified)
+            if pruned['dead'] or pruned['pinned']:
+                print(f"[卡池巡检] 本轮验证 {len(verified)} 个帖子，移出卡池: 失效 {pruned['dead']} 个，置顶 {pruned['pinned']} 个。")
+        except Exception as e:
+            print(f"[卡池巡检] 本轮巡检失败，将在下一轮重试: {type(e).__name__}: {e}")
+
+    @sweep_pool.before_loop
+    async def before_sweep_pool(self):
+        await self.bot.wait_until_ready()
+
+
+# --- Cog 设置函数 ---
+async def setup(bot: commands.Bot):
+    await bot.add_cog(PoolHealth(bot))
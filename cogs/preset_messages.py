@@ -4,28 +4,49 @@ from discord.ext import commands
 from discord import app_commands
 import sqlite3
 import os
-import json
 import re
-from thefuzz import process, fuzz
-import jieba
 import time
-
-# --- 新增：全局冷却时间 ---
-# 用于存储最后一次使用命令的时间
-LAST_USED_TIME = 0
-COOLDOWN_DURATION = 15  # 冷却时间（秒）
-
-def is_on_cooldown() -> bool:
-    """检查是否在全局冷却期内"""
-    global LAST_USED_TIME
-    if time.time() - LAST_USED_TIME < COOLDOWN_DURATION:
-        return True
-    return False
-
-def update_cooldown():
-    """更新全局冷却时间"""
-    global LAST_USED_TIME
-    LAST_USED_TIME = time.time()
+import heapq
+import math
+import asyncio
+import csv
+import tempfile
+from typing import Optional
+from utils.preset_io import (
+    IMPORT_MODES, IMPORT_EXTENSIONS, MAX_REPORTED_ERRORS, ImportResult, iter_import_items, apply_import,
+    export_presets, parse_since,
+)
+from utils.rate_limit import KeyedTokenBucket
+from utils.permissions import PRESET_CREATOR_ROLES, PRESET_USER_ROLES, require_roles
+from utils.preset_index import PresetSearchIndex, tokenize_query, init_fts, fts_search, start_jieba_warm_up
+
+# --- 发送冷却 ---
+# 按 (服务器, 用户) 计数的令牌桶，默认每人每分钟 4 次（即 15 秒一次），可积攒 PRESET_USER_BURST 次；
+# PRESET_CHANNEL_PER_MINUTE 大于 0 时，还会按 (服务器, 目标频道) 限制，防止多人同时在一个频道刷屏。
+try:
+    PRESET_USER_PER_MINUTE = float(os.getenv("PRESET_USER_PER_MINUTE", "4"))
+    PRESET_USER_BURST = int(os.getenv("PRESET_USER_BURST", "1"))
+    PRESET_CHANNEL_PER_MINUTE = float(os.getenv("PRESET_CHANNEL_PER_MINUTE", "0"))
+    PRESET_CHANNEL_BURST = int(os.getenv("PRESET_CHANNEL_BURST", "3"))
+except ValueError:
+    print("⚠️ 预设消息冷却的 .env 配置值无效，将使用默认值。")
+    PRESET_USER_PER_MINUTE, PRESET_USER_BURST, PRESET_CHANNEL_PER_MINUTE, PRESET_CHANNEL_BURST = 4.0, 1, 0.0, 3
+
+USER_COOLDOWN = KeyedTokenBucket(PRESET_USER_PER_MINUTE, PRESET_USER_BURST)
+CHANNEL_COOLDOWN = KeyedTokenBucket(PRESET_CHANNEL_PER_MINUTE, PRESET_CHANNEL_BURST) if PRESET_CHANNEL_PER_MINUTE > 0 else None
+
+def cooldown_remaining(interaction: discord.Interaction, channel_id: int) -> int:
+    """返回该用户向目标频道发送预设还需等待的秒数（向上取整），0 表示不在冷却中。"""
+    remaining = USER_COOLDOWN.retry_after((interaction.guild.id, interaction.user.id))
+    if CHANNEL_COOLDOWN is not None:
+        remaining = max(remaining, CHANNEL_COOLDOWN.retry_after((interaction.guild.id, channel_id)))
+    return math.ceil(remaining)
+
+def update_cooldown(interaction: discord.Interaction, channel_id: int):
+    """在成功发送后记录一次使用。"""
+    USER_COOLDOWN.consume((interaction.guild.id, interaction.user.id))
+    if CHANNEL_COOLDOWN is not None:
+        CHANNEL_COOLDOWN.consume((interaction.guild.id, channel_id))
 
 # --- 新增：中文停用词列表 ---
 # 这些词在搜索中通常意义不大，会被过滤掉
@@ -34,11 +55,24 @@ STOP_WORDS = {
     '大佬们', '大佬', '们', '啥', '意思', '一个', '那个', '这个', '了','什么'
 }
 
-DB_FILE = 'posts.db'
-
-def init_preset_db():
-    """初始化预设消息的数据库表。"""
-    con = sqlite3.connect(DB_FILE)
+# --- 检索计分模式 ---
+# weighted: 名称命中 +10、内容命中 +1 的固定计分；bm25: 基于词频、文档频率与长度归一化的 BM25 计分
+PRESET_SEARCH_MODE = os.getenv("PRESET_SEARCH_MODE", "weighted").strip().lower()
+if PRESET_SEARCH_MODE not in ("weighted", "bm25"):
+    print(f"⚠️ PRESET_SEARCH_MODE 值 '{PRESET_SEARCH_MODE}' 无效，将使用默认值 weighted。")
+    PRESET_SEARCH_MODE = "weighted"
+
+# --- 名称容错匹配 ---
+# 分数低于 PRESET_FUZZY_MIN_SCORE 的候选不会出现；“发送给”命令中最佳候选不低于 PRESET_FUZZY_AUTO_SCORE 时自动纠正
+try:
+    PRESET_FUZZY_MIN_SCORE = int(os.getenv("PRESET_FUZZY_MIN_SCORE", "60"))
+    PRESET_FUZZY_AUTO_SCORE = int(os.getenv("PRESET_FUZZY_AUTO_SCORE", "90"))
+except ValueError:
+    print("⚠️ 预设名称容错匹配的 .env 配置值无效，将使用默认值。")
+    PRESET_FUZZY_MIN_SCORE, PRESET_FUZZY_AUTO_SCORE = 60, 90
+
+def init_preset_db(con: sqlite3.Connection):
+    """初始化预设消息的数据库表（通过 bot.db.transaction 在写线程中执行）。"""
     cur = con.cursor()
     cur.execute('''
         CREATE TABLE IF NOT EXISTS preset_messages (
@@ -50,11 +84,24 @@ def init_preset_db():
             UNIQUE(guild_id, name)
         )
     ''')
-    con.commit()
-    con.close()
-
-# 在模块加载时立即初始化数据库
-init_preset_db()
+    # 旧数据库迁移：updated_at 记录最后一次新增或修改的时间，用于增量导出
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(preset_messages)")}
+    if 'updated_at' not in columns:
+        cur.execute("ALTER TABLE preset_messages ADD COLUMN updated_at REAL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_preset_messages_updated_at ON preset_messages (updated_at)")
+    # 由触发器维护，所有写入路径（添加、覆盖、导入）都无需关心；UPDATE OF 不包含 updated_at，不会递归触发
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS preset_messages_touch_insert AFTER INSERT ON preset_messages BEGIN
+            UPDATE preset_messages SET updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = new.id;
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS preset_messages_touch_update AFTER UPDATE OF name, content, creator_id ON preset_messages BEGIN
+            UPDATE preset_messages SET updated_at = (julianday('now') - 2440587.5) * 86400.0 WHERE id = new.id;
+        END
+    ''')
+    # 名称与内容的 FTS5 全文索引（由触发器保持同步），用于搜索与自动补全
+    init_fts(con)
 
 class PresetReplySelect(discord.ui.Select):
     def __init__(self, presets: list[str], target_message: discord.Message):
@@ -64,40 +111,32 @@ class PresetReplySelect(discord.ui.Select):
 
     async def callback(self, interaction: discord.Interaction):
         # --- 冷却检查 ---
-        if is_on_cooldown():
-            remaining_time = int(COOLDOWN_DURATION - (time.time() - LAST_USED_TIME))
+        remaining_time = cooldown_remaining(interaction, self.target_message.channel.id)
+        if remaining_time:
             await interaction.response.edit_message(content=f"⏳ **命令冷却中**：请等待 {remaining_time} 秒后再试。", view=None)
             return
         
         preset_name = self.values[0]
         
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("SELECT content FROM preset_messages WHERE guild_id = ? AND name = ?", (interaction.guild.id, preset_name))
-        row = cur.fetchone()
-        con.close()
+        presets = await interaction.client.preset_cache.get(interaction.guild.id)
+        content = presets.get(preset_name)
 
-        if not row:
+        if content is None:
             await interaction.response.edit_message(content=f"❌ **错误**：找不到名为 `{preset_name}` 的预设消息。", view=None)
             return
-
-        content = row[0]
         
         # --- 权限检查 ---
-        user_role_ids_str = os.getenv("PRESET_USER_ROLE_IDS", "")
+        permissions = interaction.client.permissions
         # 如果没有配置，则默认拒绝，并提示服主进行配置
-        if not user_role_ids_str:
+        if not permissions.roles(PRESET_USER_ROLES):
             await interaction.response.edit_message(content="❌ **配置错误**：机器人管理员尚未配置 `PRESET_USER_ROLE_IDS`，无法使用此功能。", view=None)
             return
-            
-        user_role_ids = {int(rid.strip()) for rid in user_role_ids_str.split(',')}
-        user_roles = {role.id for role in interaction.user.roles}
 
         # 如果用户有权限
-        if user_roles.intersection(user_role_ids):
+        if permissions.allows(interaction.user, PRESET_USER_ROLES):
             try:
                 await self.target_message.reply(f"{content}\n\n——由 {interaction.user.display_name} 发送")
-                update_cooldown() # 在成功发送后更新冷却时间
+                update_cooldown(interaction, self.target_message.channel.id) # 在成功发送后更新冷却时间
                 # 确认是否私聊发送
                 await interaction.response.edit_message(content="✅ **回复已发送！**", view=None)
                 await interaction.followup.send(content="是否私聊发送给对方？", view=PrivateFollowUpView(content, target_user=self.target_message.author), ephemeral=True)
@@ -134,8 +173,8 @@ class FuzzySearchReplyView(discord.ui.View):
             await interaction.response.defer() # 先确认交互，防止超时
 
             # --- 冷却检查 ---
-            if is_on_cooldown():
-                remaining_time = int(COOLDOWN_DURATION - (time.time() - LAST_USED_TIME))
+            remaining_time = cooldown_remaining(interaction, self.view.target_message.channel.id)
+            if remaining_time:
                 await interaction.followup.send(f"⏳ **命令冷却中**：请等待 {remaining_time} 秒后再试。", ephemeral=True)
                 # 禁用所有按钮并提示
                 for item in self.view.children:
@@ -146,32 +185,24 @@ class FuzzySearchReplyView(discord.ui.View):
             preset_name = self.label
 
             # --- 权限检查 ---
-            user_role_ids_str = os.getenv("PRESET_USER_ROLE_IDS", "")
-            if not user_role_ids_str:
+            permissions = interaction.client.permissions
+            if not permissions.roles(PRESET_USER_ROLES):
                 await interaction.followup.send("❌ **配置错误**：机器人管理员尚未配置 `PRESET_USER_ROLE_IDS`，无法使用此功能。", ephemeral=True)
                 return
-            
-            user_role_ids = {int(rid.strip()) for rid in user_role_ids_str.split(',')}
-            user_roles = {role.id for role in interaction.user.roles}
 
             # --- 获取预设内容 ---
-            con = sqlite3.connect(DB_FILE)
-            cur = con.cursor()
-            cur.execute("SELECT content FROM preset_messages WHERE guild_id = ? AND name = ?", (interaction.guild.id, preset_name))
-            row = cur.fetchone()
-            con.close()
+            presets = await interaction.client.preset_cache.get(interaction.guild.id)
+            content = presets.get(preset_name)
 
-            if not row:
+            if content is None:
                 await interaction.followup.send(f"❌ **错误**：在数据库中找不到预设 `{preset_name}`，可能已被删除。", ephemeral=True)
                 return
 
-            content = row[0]
-
             # --- 根据权限发送或拒绝 ---
-            if user_roles.intersection(user_role_ids):
+            if permissions.allows(interaction.user, PRESET_USER_ROLES):
                 try:
                     await self.view.target_message.reply(f"{content}\n\n——由 {interaction.user.display_name} 发送")
-                    update_cooldown() # 在成功发送后更新冷却时间
+                    update_cooldown(interaction, self.view.target_message.channel.id) # 在成功发送后更新冷却时间
                     # 确认是否私聊发送
                     await interaction.followup.send(content="是否私聊发送给对方？", view=PrivateFollowUpView(content, target_user=self.view.target_message.author), ephemeral=True)
                     # 成功发送后，编辑原消息，禁用所有按钮
@@ -216,14 +247,8 @@ class PresetSearchModal(discord.ui.Modal, title="搜索预设消息"):
         self.target_message = target_message
 
     async def on_submit(self, interaction: discord.Interaction):
-        search_term = self.keyword.value.lower()
-        
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        # 使用 LIKE 进行模糊搜索
-        cur.execute("SELECT name FROM preset_messages WHERE guild_id = ? AND name LIKE ?", (interaction.guild.id, f'%{search_term}%'))
-        search_results = [row[0] for row in cur.fetchall()]
-        con.close()
+        # 通过 FTS5 全文索引检索名称与内容，最多 25 个结果（下拉菜单的选项上限）
+        search_results = await fts_search(interaction.client.db, interaction.guild.id, self.keyword.value)
 
         if not search_results:
             await interaction.response.send_message(f"找不到包含 `{self.keyword.value}` 的预设消息。", ephemeral=True)
@@ -236,6 +261,8 @@ class PresetSearchModal(discord.ui.Modal, title="搜索预设消息"):
 class PresetMessageCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        # 按服务器缓存的预设倒排索引，检索时只访问命中的倒排表
+        self.search_index = PresetSearchIndex(bot.db)
         # 原有的右键菜单
         self.reply_context_menu = app_commands.ContextMenu(
             name='💬 使用预设消息回复',
@@ -250,6 +277,11 @@ class PresetMessageCog(commands.Cog):
         )
         self.bot.tree.add_command(self.search_context_menu)
 
+    async def cog_load(self):
+        # 在后台线程中预热 jieba 词典，避免首次检索时超过交互的 3 秒期限
+        start_jieba_warm_up()
+        await self.bot.db.transaction(init_preset_db)
+
     async def cog_unload(self):
         self.bot.tree.remove_command(self.reply_context_menu.name, type=self.reply_context_menu.type)
         self.bot.tree.remove_command(self.search_context_menu.name, type=self.search_context_menu.type)
@@ -261,19 +293,9 @@ class PresetMessageCog(commands.Cog):
         name="预设的唯一名称",
         message_link="包含预设内容和图片的消息链接"
     )
+    @require_roles(PRESET_CREATOR_ROLES)
     async def add_preset(self, interaction: discord.Interaction, name: str, message_link: str):
         """通过解析一个消息链接来添加或更新预设消息。"""
-        # --- 权限检查 (复用逻辑) ---
-        creator_role_ids_str = os.getenv("PRESET_CREATOR_ROLE_IDS", "")
-        if not creator_role_ids_str:
-            await interaction.response.send_message("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `PRESET_CREATOR_ROLE_IDS`。", ephemeral=True)
-            return
-        creator_role_ids = {int(rid.strip()) for rid in creator_role_ids_str.split(',')}
-        user_roles = {role.id for role in interaction.user.roles}
-        if not user_roles.intersection(creator_role_ids):
-            await interaction.response.send_message("🚫 **权限不足**：只有拥有特定身份组的用户才能执行此操作。", ephemeral=True)
-            return
-
         await interaction.response.defer(ephemeral=True, thinking=True)
 
         # --- 从链接获取消息 ---
@@ -316,11 +338,9 @@ class PresetMessageCog(commands.Cog):
 
 
         # --- 数据库操作 ---
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
         try:
             # 使用 INSERT OR REPLACE 逻辑，如果存在同名预设则更新它
-            cur.execute(
+            await self.bot.db.execute(
                 """
                 INSERT INTO preset_messages (guild_id, name, content, creator_id) 
                 VALUES (?, ?, ?, ?)
@@ -330,43 +350,27 @@ class PresetMessageCog(commands.Cog):
                 """,
                 (interaction.guild.id, name, final_content, interaction.user.id)
             )
-            con.commit()
+            await self._index_preset(interaction.guild.id, name, final_content)
             await interaction.followup.send(f"✅ 预设消息 `{name}` 已成功创建/更新！", ephemeral=True)
 
         except Exception as e:
             await interaction.followup.send(f"❌ **数据库错误**：无法创建或更新预设消息。\n`{e}`", ephemeral=True)
-        finally:
-            con.close()
 
     @preset_group.command(name="覆盖", description="通过消息链接覆盖一个已有的预设消息。")
     @app_commands.describe(
         name="要覆盖的预设的名称",
         message_link="包含新内容的消息链接"
     )
+    @require_roles(PRESET_CREATOR_ROLES)
     async def override_preset(self, interaction: discord.Interaction, name: str, message_link: str):
         """通过解析一个消息链接来覆盖一个已有的预设消息。"""
-        # --- 权限检查 (复用逻辑) ---
-        creator_role_ids_str = os.getenv("PRESET_CREATOR_ROLE_IDS", "")
-        if not creator_role_ids_str:
-            await interaction.response.send_message("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `PRESET_CREATOR_ROLE_IDS`。", ephemeral=True)
-            return
-        creator_role_ids = {int(rid.strip()) for rid in creator_role_ids_str.split(',')}
-        user_roles = {role.id for role in interaction.user.roles}
-        if not user_roles.intersection(creator_role_ids):
-            await interaction.response.send_message("🚫 **权限不足**：只有拥有特定身份组的用户才能执行此操作。", ephemeral=True)
-            return
-
         await interaction.response.defer(ephemeral=True, thinking=True)
 
         # --- 检查预设是否存在 ---
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("SELECT id FROM preset_messages WHERE guild_id = ? AND name = ?", (interaction.guild.id, name))
-        if not cur.fetchone():
-            con.close()
+        presets = await self.bot.preset_cache.get(interaction.guild.id)
+        if presets.get(name) is None:
             await interaction.followup.send(f"❌ **错误**：找不到名为 `{name}` 的预设消息，无法覆盖。", ephemeral=True)
             return
-        con.close()
 
 
         # --- 从链接获取消息 ---
@@ -409,11 +413,9 @@ class PresetMessageCog(commands.Cog):
 
 
         # --- 数据库操作 ---
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
         try:
             # 使用 INSERT OR REPLACE 逻辑，如果存在同名预设则更新它
-            cur.execute(
+            await self.bot.db.execute(
                 """
                 INSERT INTO preset_messages (guild_id, name, content, creator_id)
                 VALUES (?, ?, ?, ?)
@@ -423,21 +425,15 @@ class PresetMessageCog(commands.Cog):
                 """,
                 (interaction.guild.id, name, final_content, interaction.user.id)
             )
-            con.commit()
+            await self._index_preset(interaction.guild.id, name, final_content)
             await interaction.followup.send(f"✅ 预设消息 `{name}` 已成功被新内容覆盖！", ephemeral=True)
 
         except Exception as e:
             await interaction.followup.send(f"❌ **数据库错误**：无法覆盖预设消息。\n`{e}`", ephemeral=True)
-        finally:
-            con.close()
 
     @override_preset.autocomplete('name')
     async def override_preset_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("SELECT name FROM preset_messages WHERE guild_id = ? AND name LIKE ?", (interaction.guild.id, f'%{current}%'))
-        all_presets = [row[0] for row in cur.fetchall()]
-        con.close()
+        all_presets = await self._complete_names(interaction.guild.id, current)
 
         return [
             app_commands.Choice(name=preset, value=preset)
@@ -446,55 +442,31 @@ class PresetMessageCog(commands.Cog):
 
     @preset_group.command(name="删除", description="删除一个已有的预设消息")
     @app_commands.describe(name="要删除的预设消息的名称")
+    @require_roles(PRESET_CREATOR_ROLES)
     async def remove_preset(self, interaction: discord.Interaction, name: str):
         """处理删除预设消息的命令。"""
-        # --- 从 .env 加载配置 ---
-        creator_role_ids_str = os.getenv("PRESET_CREATOR_ROLE_IDS", "")
-        if not creator_role_ids_str:
-            await interaction.response.send_message("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `PRESET_CREATOR_ROLE_IDS`。", ephemeral=True)
-            return
-
-        creator_role_ids = {int(rid.strip()) for rid in creator_role_ids_str.split(',')}
-        
-        # --- 权限检查 ---
-        user_roles = {role.id for role in interaction.user.roles}
-        if not user_roles.intersection(creator_role_ids):
-            await interaction.response.send_message("🚫 **权限不足**：只有拥有特定身份组的用户才能执行此操作。", ephemeral=True)
-            return
-
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("DELETE FROM preset_messages WHERE guild_id = ? AND name = ?", (interaction.guild.id, name))
+        deleted = await self.bot.db.execute("DELETE FROM preset_messages WHERE guild_id = ? AND name = ?", (interaction.guild.id, name))
         
-        if cur.rowcount > 0:
-            con.commit()
+        if deleted > 0:
+            self.bot.preset_cache.remove(interaction.guild.id, name)
+            self.search_index.remove(interaction.guild.id, name)
             await interaction.response.send_message(f"✅ 预设消息 `{name}` 已成功删除。", ephemeral=True)
         else:
             await interaction.response.send_message(f"❌ **错误**：找不到名为 `{name}` 的预设消息。", ephemeral=True)
-        
-        con.close()
 
     @remove_preset.autocomplete('name')
     async def remove_preset_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("SELECT name FROM preset_messages WHERE guild_id = ?", (interaction.guild.id,))
-        all_presets = [row[0] for row in cur.fetchall()]
-        con.close()
+        all_presets = await self._complete_names(interaction.guild.id, current)
 
         return [
             app_commands.Choice(name=preset, value=preset)
-            for preset in all_presets if current.lower() in preset.lower()
+            for preset in all_presets
         ]
 
     @preset_group.command(name="列表", description="查看所有可用的预设消息")
     async def list_presets(self, interaction: discord.Interaction):
         """处理列出预设消息的命令。"""
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("SELECT name FROM preset_messages WHERE guild_id = ?", (interaction.guild.id,))
-        all_presets = [row[0] for row in cur.fetchall()]
-        con.close()
+        all_presets = (await self.bot.preset_cache.get(interaction.guild.id)).names
 
         if not all_presets:
             await interaction.response.send_message("ℹ️ 当前服务器还没有任何预设消息。", ephemeral=True)
@@ -515,85 +487,160 @@ class PresetMessageCog(commands.Cog):
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
     @preset_group.command(name="导入json", description="上传一个JSON文件来批量导入预设消息 (仅限管理员)")
-    @app_commands.describe(attachment="包含预设消息的JSON文件")
-    async def import_presets(self, interaction: discord.Interaction, attachment: discord.Attachment):
+    @app_commands.describe(attachment="包含预设消息的JSON、JSON Lines或CSV文件（可为 .gz 压缩）", mode="名称已存在时的处理方式（默认跳过）")
+    @app_commands.choices(mode=[
+        app_commands.Choice(name="跳过已存在的名称", value="skip"),
+        app_commands.Choice(name="覆盖已存在的名称", value="overwrite"),
+        app_commands.Choice(name="仅预览差异，不写入", value="dry-run"),
+    ])
+    @require_roles(PRESET_CREATOR_ROLES)
+    async def import_presets(self, interaction: discord.Interaction, attachment: discord.Attachment, mode: str = "skip"):
         """通过上传的JSON文件批量导入预设消息。"""
-        # --- 权限检查 (复用 PRESET_CREATOR_ROLE_IDS) ---
-        creator_role_ids_str = os.getenv("PRESET_CREATOR_ROLE_IDS", "")
-        if not creator_role_ids_str:
-            await interaction.response.send_message("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `PRESET_CREATOR_ROLE_IDS`。", ephemeral=True)
-            return
-        creator_role_ids = {int(rid.strip()) for rid in creator_role_ids_str.split(',')}
-        user_roles = {role.id for role in interaction.user.roles}
-        if not user_roles.intersection(creator_role_ids):
-            await interaction.response.send_message("🚫 **权限不足**：只有拥有特定身份组的用户才能执行此操作。", ephemeral=True)
-            return
-
         await interaction.response.defer(ephemeral=True, thinking=True)
 
         try:
             # 检查文件类型
-            if not attachment.filename.lower().endswith('.json'):
-                await interaction.followup.send("❌ **文件类型错误**：请上传一个 `.json` 文件。", ephemeral=True)
+            if not attachment.filename.lower().endswith(IMPORT_EXTENSIONS):
+                await interaction.followup.send("❌ **文件类型错误**：请上传 `.json`、`.jsonl` 或 `.csv` 文件（可为 `.gz` 压缩）。", ephemeral=True)
                 return
 
-            # 读取附件内容
-            file_content = await attachment.read()
-            data_to_import = json.loads(file_content.decode('utf-8'))
+            started = time.perf_counter()
+            result = ImportResult(mode if mode in IMPORT_MODES else "skip")
 
-            if not isinstance(data_to_import, list):
-                await interaction.followup.send("❌ **格式错误**：JSON 文件的顶层结构必须是一个数组 `[...]`。", ephemeral=True)
+            # 附件本身（受 Discord 上传大小限制）需要完整读入；解压、解码、解析和写入都在写线程中边读边做，
+            # 每 IMPORT_CHUNK_SIZE 个预设用 executemany 写入一次，整个导入仍是单个事务
+            file_content = await attachment.read()
+            try:
+                await self.bot.db.transaction(
+                    apply_import, interaction.guild.id, interaction.user.id, iter_import_items(attachment.filename, file_content), result
+                )
+            except (ValueError, UnicodeDecodeError, OSError, EOFError, csv.Error) as e:
+                # 解析失败时事务已回滚，没有写入任何数据
+                await interaction.followup.send(f"❌ **格式错误**：无法解析文件，请上传 JSON 数组、JSON Lines 或 CSV。\n`{e}`", ephemeral=True)
                 return
 
-            con = sqlite3.connect(DB_FILE)
-            cur = con.cursor()
-            
-            added_count = 0
-            skipped_count = 0
-            error_list = []
-
-            for item in data_to_import:
-                if not isinstance(item, dict) or 'name' not in item or 'value' not in item:
-                    error_list.append(f"无效条目: `{item}` (缺少 name 或 value)")
-                    continue
-                
-                preset_name = item['name']
-                preset_content = item['value']
-
-                try:
-                    cur.execute(
-                        "INSERT INTO preset_messages (guild_id, name, content, creator_id) VALUES (?, ?, ?, ?)",
-                        (interaction.guild.id, preset_name, preset_content, interaction.user.id)
-                    )
-                    added_count += 1
-                except sqlite3.IntegrityError:
-                    skipped_count += 1
-            
-            con.commit()
-            con.close()
-
-            report = [f"✅ **导入成功:** {added_count} 条"]
-            if skipped_count > 0:
-                report.append(f"ℹ️ **跳过 (名称已存在):** {skipped_count} 条")
-            if error_list:
-                report.append(f"❌ **格式错误:**\n" + "\n".join(error_list))
-                
-            await interaction.followup.send("\n".join(report), ephemeral=True)
+            if result.written_truncated:
+                # 写入的预设太多，不逐条更新，让缓存与搜索索引在下次使用时从数据库重新加载
+                self.bot.preset_cache.invalidate(interaction.guild.id)
+                self.search_index.invalidate(interaction.guild.id)
+            else:
+                for preset_id, preset_name, preset_content in result.written:
+                    self.bot.preset_cache.upsert(interaction.guild.id, preset_name, preset_content)
+                await self.search_index.upsert_many(interaction.guild.id, result.written)
+            result.duration = time.perf_counter() - started
+
+            if result.mode == "dry-run":
+                report = [
+                    "🔍 **预览模式（未写入任何数据）**",
+                    f"➕ **将新增:** {result.added} 条",
+                    f"🔄 **内容不同（覆盖模式下将被更新）:** {result.updated} 条",
+                    f"ℹ️ **内容相同:** {result.unchanged} 条",
+                ]
+            else:
+                report = [f"✅ **导入成功:** {result.added} 条"]
+                if result.mode == "overwrite":
+                    report.append(f"🔄 **覆盖更新:** {result.updated} 条")
+                    if result.unchanged > 0:
+                        report.append(f"ℹ️ **内容相同，无需更新:** {result.unchanged} 条")
+                if result.skipped > 0:
+                    report.append(f"ℹ️ **跳过 (名称已存在):** {result.skipped} 条")
+            if result.errors:
+                shown = result.errors[:MAX_REPORTED_ERRORS]
+                more = f"\n……以及另外 {len(result.errors) - len(shown)} 条" if len(result.errors) > len(shown) else ""
+                report.append(f"❌ **格式错误 ({len(result.errors)} 条):**\n" + "\n".join(shown) + more)
+            report.append(f"⏱️ 用时 {result.duration:.2f} 秒")
+
+            await interaction.followup.send("\n".join(report)[:2000], ephemeral=True)
 
         except Exception as e:
             # 捕获所有其他潜在错误，防止命令卡住
             print(f"[导入错误] {type(e).__name__}: {e}")
             await interaction.followup.send(f"❌ **发生未知错误**：导入过程中断。\n请检查控制台日志以获取详细信息。\n`{e}`", ephemeral=True)
 
+    @preset_group.command(name="导出", description="导出本服务器的预设消息，可直接用“导入json”导回 (仅限管理员)")
+    @app_commands.describe(
+        format="文件格式（默认 JSON）",
+        compress="是否用 gzip 压缩",
+        since_id="只导出ID大于此值的预设（增量导出）",
+        since="只导出在此之后新增或修改的预设：Unix 时间戳或日期，如 2024-05-01"
+    )
+    @app_commands.choices(format=[
+        app_commands.Choice(name="JSON", value="json"),
+        app_commands.Choice(name="JSON Lines", value="jsonl"),
+        app_commands.Choice(name="CSV", value="csv"),
+    ])
+    @require_roles(PRESET_CREATOR_ROLES)
+    async def export_presets_command(self, interaction: discord.Interaction, format: str = "json", compress: bool = False,
+                                     since_id: Optional[int] = None, since: Optional[str] = None):
+        """流式导出预设消息到临时文件并作为附件发送。"""
+
+        try:
+            since_ts = parse_since(since) if since else None
+        except ValueError:
+            await interaction.response.send_message("❌ **时间格式错误**：请填写 Unix 时间戳或 `2024-05-01` 这样的日期。", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+
+        filename = f"presets_{interaction.guild.id}.{format}" + (".gz" if compress else "")
+        fd, path = tempfile.mkstemp(suffix=".gz" if compress else f".{format}")
+        os.close(fd)
+        try:
+            # 在数据库的读线程中用游标逐批写入文件，内存占用与预设数量无关
+            count = await self.bot.db.read(
+                lambda con: export_presets(con, path, format, compress, guild_id=interaction.guild.id, since_id=since_id, since_ts=since_ts)
+            )
+            if count == 0:
+                await interaction.followup.send("ℹ️ 没有符合条件的预设消息。", ephemeral=True)
+                return
+            limit = interaction.guild.filesize_limit
+            size = os.path.getsize(path)
+            if size > limit:
+                await interaction.followup.send(
+                    f"❌ **文件过大**：导出文件为 {size / 1024 / 1024:.1f} MB，超过了本服务器的上传上限。"
+                    "请开启压缩，或用 since_id / since 分批导出。", ephemeral=True
+                )
+                return
+            await interaction.followup.send(f"✅ 已导出 **{count}** 条预设消息。", file=discord.File(path, filename=filename), ephemeral=True)
+        except Exception as e:
+            print(f"[导出错误] {type(e).__name__}: {e}")
+            await interaction.followup.send(f"❌ **发生未知错误**：导出失败。\n`{e}`", ephemeral=True)
+        finally:
+            os.remove(path)
+
+
+    async def _complete_names(self, guild_id: int, current: str) -> list[str]:
+        """
+        名称自动补全：先在内存缓存中做前缀检索；不足 25 个时依次用 FTS5 检索、
+        容错匹配（可匹配拼错的名称）补充。
+        """
+        names = (await self.bot.preset_cache.get(guild_id)).prefix(current, limit=25)
+        if len(names) >= 25 or not current.strip():
+            return names
+        seen = set(names)
+        for name in await fts_search(self.bot.db, guild_id, current, names_only=True):
+            if name not in seen:
+                names.append(name)
+                seen.add(name)
+        if len(names) < 25:
+            index = await self.search_index.get(guild_id)
+            for name, _ in index.fuzzy_names(current, limit=25, score_cutoff=PRESET_FUZZY_MIN_SCORE):
+                if name not in seen:
+                    names.append(name)
+                    seen.add(name)
+        return names[:25]
+
+    async def _index_preset(self, guild_id: int, name: str, content: str):
+        """预设写入数据库后，同步更新内存缓存与倒排索引。"""
+        self.bot.preset_cache.upsert(guild_id, name, content)
+        row = await self.bot.db.fetchone("SELECT id FROM preset_messages WHERE guild_id = ? AND name = ?", (guild_id, name))
+        if row:
+            await self.search_index.upsert(guild_id, row[0], name, content)
 
     async def reply_with_preset_context_menu(self, interaction: discord.Interaction, message: discord.Message):
         """右键菜单命令的回调函数，现在弹出搜索模态框。"""
         # 检查服务器是否有任何预设消息
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("SELECT 1 FROM preset_messages WHERE guild_id = ? LIMIT 1", (interaction.guild.id,))
-        has_presets = cur.fetchone()
-        con.close()
+        has_presets = len(await self.bot.preset_cache.get(interaction.guild.id)) > 0
 
         if not has_presets:
             await interaction.response.send_message("ℹ️ 当前服务器还没有任何预设消息，无法进行回复。", ephemeral=True)
@@ -612,42 +659,42 @@ class PresetMessageCog(commands.Cog):
     )
     async def reply_with_preset_slash(self, interaction: discord.Interaction, user: discord.Member, name: str, send_to_user: bool = False):
         """通过@用户并发送预设消息，模拟回复效果。"""
-        # 检查是否在全局冷却期内
-        if is_on_cooldown():
-            remaining_time = int(COOLDOWN_DURATION - (time.time() - LAST_USED_TIME))
+        # 检查该用户（及目标频道）是否在冷却期内
+        remaining_time = cooldown_remaining(interaction, interaction.channel.id)
+        if remaining_time:
             await interaction.response.send_message(f"⏳ **命令冷却中**：请等待 {remaining_time} 秒后再试。", ephemeral=True)
             return
         
-        # 更新全局冷却时间
-        update_cooldown()
-        
-        # 1. 从数据库获取预设内容
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("SELECT content FROM preset_messages WHERE guild_id = ? AND name = ?", (interaction.guild.id, name))
-        row = cur.fetchone()
-        con.close()
-
-        if not row:
-            await interaction.response.send_message(f"❌ **错误**：找不到名为 `{name}` 的预设消息。请检查您的输入。", ephemeral=True)
+        # 1. 从缓存获取预设内容
+        presets = await self.bot.preset_cache.get(interaction.guild.id)
+        content = presets.get(name)
+
+        suggestions = []
+        if content is None:
+            # 名称可能拼错了：用容错匹配纠正或给出建议
+            index = await self.search_index.get(interaction.guild.id)
+            suggestions = index.fuzzy_names(name, limit=5, score_cutoff=PRESET_FUZZY_MIN_SCORE)
+            if suggestions and suggestions[0][1] >= PRESET_FUZZY_AUTO_SCORE:
+                name = suggestions[0][0]
+                content = presets.get(name)
+        if content is None:
+            hint = ""
+            if suggestions:
+                hint = "\n你是不是要找：" + "、".join(f"`{suggestion}`" for suggestion, _ in suggestions)
+            await interaction.response.send_message(f"❌ **错误**：找不到名为 `{name}` 的预设消息。请检查您的输入。{hint}", ephemeral=True)
             return
-        
-        content = row[0]
 
         # --- 权限检查 ---
-        user_role_ids_str = os.getenv("PRESET_USER_ROLE_IDS", "")
-        if not user_role_ids_str:
+        if not self.bot.permissions.roles(PRESET_USER_ROLES):
             await interaction.response.send_message("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `PRESET_USER_ROLE_IDS`，无法使用此功能。", ephemeral=True)
             return
 
-        user_role_ids = {int(rid.strip()) for rid in user_role_ids_str.split(',')}
-        user_roles = {role.id for role in interaction.user.roles}
-
         # 如果用户有权限
-        if user_roles.intersection(user_role_ids):
+        if self.bot.permissions.allows(interaction.user, PRESET_USER_ROLES):
             message_to_send = f"{user.mention}\n{content}\n\n——由 {interaction.user.display_name} 发送"
             try:
                 await interaction.channel.send(message_to_send)
+                update_cooldown(interaction, interaction.channel.id) # 在成功发送后更新冷却时间
                 # 私聊同步发送
                 if send_to_user:
                     await user.send(message_to_send)
@@ -663,11 +710,7 @@ class PresetMessageCog(commands.Cog):
     @reply_with_preset_slash.autocomplete('name')
     async def reply_with_preset_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
         """为 /preset_reply 命令的 name 参数提供自动补全。"""
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("SELECT name FROM preset_messages WHERE guild_id = ? AND name LIKE ?", (interaction.guild.id, f'%{current}%'))
-        all_presets = [row[0] for row in cur.fetchall()]
-        con.close()
+        all_presets = await self._complete_names(interaction.guild.id, current)
 
         return [
             app_commands.Choice(name=preset, value=preset)
@@ -684,50 +727,42 @@ class PresetMessageCog(commands.Cog):
 
         raw_query = message.content
         
-        # 从数据库获取所有预设
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        cur.execute("SELECT name, content FROM preset_messages WHERE guild_id = ?", (interaction.guild.id,))
-        all_presets = cur.fetchall() # [(name, content), ...]
-        con.close()
+        # 获取本服务器的倒排索引（首次使用时从数据库构建）
+        index = await self.search_index.get(interaction.guild.id)
 
-        if not all_presets:
+        if not len(index):
             await interaction.followup.send("ℹ️ 当前服务器还没有任何预设消息。", ephemeral=True)
             return
 
         # --- 最终版 Pro Max：动态相关性过滤策略 ---
         
         # 1. 分词并过滤停用词
-        raw_keywords = jieba.cut_for_search(raw_query)
-        query_keywords = {k.lower() for k in raw_keywords if k not in STOP_WORDS and k.strip()}
+        raw_keywords = await tokenize_query(raw_query)
+        query_keywords = raw_keywords - STOP_WORDS
         if not query_keywords:
-            query_keywords = {k.lower() for k in raw_keywords if k.strip()}
-        # 2. 超级加权计分
-        scores = {}
-        for name, content in all_presets:
-            current_score = 0
-            for keyword in query_keywords:
-                if keyword in name.lower():
-                    current_score += 10  # 名称中匹配，权重极高
-                if keyword in content.lower():
-                    current_score += 1   # 内容中匹配，权重较低
-            if current_score > 0:
-                scores[name] = current_score
+            query_keywords = raw_keywords
+        # 2. 计分：只访问查询词对应的倒排表
+        if PRESET_SEARCH_MODE == "bm25":
+            scores = dict(index.bm25(query_keywords, k=25))
+            min_score = 0
+        else:
+            scores = index.score(query_keywords)  # 超级加权计分
+            min_score = 2
 
         # 3. 动态阈值过滤
         if not scores:
             final_matches = []
         else:
             max_score = max(scores.values())
-            # 及格线设为最高分的40%，但最低不能低于2分
-            score_threshold = max(max_score * 0.4, 2)
+            # 及格线设为最高分的40%（加权模式下最低不能低于2分）
+            score_threshold = max(max_score * 0.4, min_score)
             
             # 筛选出所有高于及格线的
             passed_matches = {name: score for name, score in scores.items() if score >= score_threshold}
             
-            # 按分数排序
-            sorted_matches = sorted(passed_matches.items(), key=lambda item: item[1], reverse=True)
-            final_matches = [name for name, score in sorted_matches]
+            # 用堆取出分数最高的 25 个（按钮数量上限），无需对所有结果排序
+            top_matches = heapq.nlargest(25, passed_matches.items(), key=lambda item: item[1])
+            final_matches = [name for name, score in top_matches]
 
         if not final_matches:
             await interaction.followup.send(f"ℹ️ 未能从预设消息的 **名称** 或 **内容** 中找到与 `{message.content}` 高度相关的结果。", ephemeral=True)
@@ -1,30 +1,45 @@
 # cogs/random_post.py
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 import json
 import os
-import random
 import sqlite3
 import logging
 import asyncio
-
-# --- 数据库文件路径 ---
-DB_FILE = 'posts.db'
+import time
+from utils.thread_cards import ThreadCard
+from utils.card_embeds import card_embed
+from utils.permissions import ADMIN_ROLES, require_roles
+
+# --- 抽卡并发解析配置 ---
+try:
+    DRAW_RESOLVE_CONCURRENCY = max(1, int(os.getenv("DRAW_RESOLVE_CONCURRENCY", "5")))  # 同时解析的帖子数
+    DRAW_DEADLINE_SECONDS = float(os.getenv("DRAW_DEADLINE_SECONDS", "8.0"))  # 单次抽卡的总截止时间
+    DRAW_MAX_BACKFILL_ROUNDS = max(0, int(os.getenv("DRAW_MAX_BACKFILL_ROUNDS", "2")))  # 每张卡最多补抽次数
+except ValueError:
+    print("⚠️ 抽卡并发解析的 .env 配置值无效，将使用默认值。")
+    DRAW_RESOLVE_CONCURRENCY, DRAW_DEADLINE_SECONDS, DRAW_MAX_BACKFILL_ROUNDS = 5, 8.0, 2
 
 # --- 数据库初始化 ---
-def init_db():
-    """初始化数据库并创建表。"""
-    con = sqlite3.connect(DB_FILE, timeout=10)
+def init_db(con: sqlite3.Connection):
+    """初始化数据库并创建表（通过 bot.db.transaction 在写线程中执行）。"""
     cur = con.cursor()
     # 创建帖子表
     cur.execute('''
         CREATE TABLE IF NOT EXISTS threads (
             thread_id INTEGER PRIMARY KEY,
             forum_id INTEGER NOT NULL,
-            guild_id INTEGER NOT NULL
+            guild_id INTEGER NOT NULL,
+            last_verified_at REAL
         )
     ''')
+    # 迁移：旧数据库的帖子表没有 last_verified_at 列
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(threads)")}
+    if 'last_verified_at' not in columns:
+        cur.execute("ALTER TABLE threads ADD COLUMN last_verified_at REAL")
+    # 健康巡检按“最久未验证”顺序分批读取帖子
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_threads_last_verified_at ON threads (last_verified_at)")
     # 创建用户偏好表
     cur.execute('''
         CREATE TABLE IF NOT EXISTS user_preferences (
@@ -33,12 +48,68 @@ def init_db():
             selected_pools TEXT NOT NULL
         )
     ''')
-    con.commit()
-    con.close()
+    # 创建帖子卡片缓存表，保存渲染 Embed 所需的信息
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS thread_cards (
+            thread_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            forum_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            owner_name TEXT,
+            content TEXT,
+            image_url TEXT,
+            tags TEXT NOT NULL,
+            forum_name TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    # 创建用户最近抽卡记录表，recent 为 array('q') 序列化后的帖子ID
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS user_draw_history (
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            recent BLOB NOT NULL,
+            PRIMARY KEY (user_id, guild_id)
+        )
+    ''')
+    # 创建增量同步游标表：每个论坛上次同步到的最新归档时间，以及最近一次同步的统计
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS sync_cursors (
+            forum_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            last_archive_ts REAL,
+            last_run_at REAL NOT NULL,
+            last_duration REAL NOT NULL,
+            last_scanned INTEGER NOT NULL,
+            last_added INTEGER NOT NULL
+        )
+    ''')
+    # 创建全量同步断点表：每个论坛已写入到的归档时间位置，重启后可从断点继续
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS full_sync_checkpoints (
+            forum_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            before_ts REAL,
+            newest_archive_ts REAL,
+            scanned INTEGER NOT NULL DEFAULT 0,
+            added INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            started_at REAL NOT NULL
+        )
+    ''')
+    # 创建抽卡面板表：每个频道当前面板的消息ID，重建面板时直接删除该消息，无需扫描历史消息
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS gacha_panels (
+            channel_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
 
 # --- 格式化帖子为 Embed 的辅助函数 ---
 async def format_post_embed(interaction: discord.Interaction, thread: discord.Thread, title_prefix: str = "✨ 新卡速递") -> discord.Embed:
-    """将一个帖子对象格式化为类似于新帖速递的嵌入式消息。"""
+    """将一个帖子对象格式化为类似于新帖速递的嵌入式消息，并把生成的卡片写入缓存。"""
     try:
         starter_message = thread.starter_message
         if not starter_message:
@@ -56,34 +127,9 @@ async def format_post_embed(interaction: discord.Interaction, thread: discord.Th
                         print(f"[抽卡模块] 获取帖子 {thread.id} 失败，已达到最大重试次数。")
                         raise e  # 重试耗尽，将最终错误抛出，由外层except处理
         
-        author_mention = f"**👤 作者:** {thread.owner.name}" if thread.owner else f"**👤 作者:** 未知"
-        header_line = f"**{thread.name}** | {author_mention}"
-        
-        post_content = starter_message.content
-        if len(post_content) > 400:
-            post_content = post_content[:400] + "..."
-        content_section = f"**📝 内容速览:**\n{post_content}"
-        full_description = f"{header_line}\n\n{content_section}"
-
-        embed = discord.Embed(
-            title=title_prefix,
-            description=full_description,
-            color=discord.Color.blue()
-        )
-        embed.add_field(name="🚪 传送门", value=f"[点击查看原帖]({thread.jump_url})", inline=False)
-
-        if starter_message.attachments:
-            for attachment in starter_message.attachments:
-                if attachment.content_type and attachment.content_type.startswith('image/'):
-                    embed.set_thumbnail(url=attachment.url)
-                    break
-
-        if thread.applied_tags:
-            tags_str = ", ".join(tag.name for tag in thread.applied_tags)
-            embed.add_field(name="🏷️ 标签", value=tags_str, inline=False)
-            
-        embed.set_footer(text=f"来自论坛: {thread.parent.name}")
-        return embed
+        card = ThreadCard.from_thread(thread, starter_message)
+        await interaction.client.thread_cards.put(interaction.client.db, card)
+        return card_embed(card, title_prefix)
     except Exception as e:
         log_message = (
             f"Error formatting embed for thread ID {thread.id} ('{thread.name}') "
@@ -132,14 +178,10 @@ class PoolSelectView(discord.ui.View):
         # 将选择的列表转换为 JSON 字符串
         pools_json = json.dumps(selected_values)
         
-        con = sqlite3.connect(DB_FILE, timeout=10)
-        cur = con.cursor()
-        cur.execute(
+        await self.bot.db.execute(
             "INSERT OR REPLACE INTO user_preferences (user_id, guild_id, selected_pools) VALUES (?, ?, ?)",
             (interaction.user.id, interaction.guild.id, pools_json)
         )
-        con.commit()
-        con.close()
 
         # 生成反馈信息
         if "all" in selected_values:
@@ -184,115 +226,115 @@ class RandomPostView(discord.ui.View):
         self.bot = bot
 
     async def _draw_posts(self, interaction: discord.Interaction, count: int):
-        """核心抽卡逻辑（数据库版），数据库操作已异步化。"""
+        """核心抽卡逻辑：从内存卡池索引中采样，并发解析抽中的帖子，失效帖子会被清理并自动补抽。"""
         await interaction.response.defer(ephemeral=True, thinking=True)
 
-        # 自定义异常，用于在同步函数中传递错误信息
+        # 自定义异常，用于传递面向用户的错误信息
         class DrawError(Exception):
             def __init__(self, message):
                 self.message = message
                 super().__init__(self.message)
 
-        def _fetch_ids_from_db():
-            """在同步函数中执行所有阻塞的数据库操作。"""
+        async def _resolve_target_forums():
+            """读取用户的卡池偏好，并解析出本次抽卡的目标论坛列表。"""
             guild_id = interaction.guild.id
-            con = None
-            try:
-                con = sqlite3.connect(DB_FILE, timeout=10)
-                cur = con.cursor()
 
-                # 1. 获取用户偏好
-                cur.execute("SELECT selected_pools FROM user_preferences WHERE user_id = ? AND guild_id = ?", (interaction.user.id, guild_id))
-                user_pref_row = cur.fetchone()
-                
-                target_forum_ids = []
-                if user_pref_row:
-                    try:
-                        user_pools = json.loads(user_pref_row[0])
-                        if "all" not in user_pools:
-                            target_forum_ids = [int(p) for p in user_pools]
-                    except (json.JSONDecodeError, TypeError):
-                        raise DrawError("⚠️ 你的卡池设置似乎已损坏，请使用 `设置卡池` 功能重新设置。")
-
-                if not target_forum_ids:
-                    all_allowed_ids = self.bot.allowed_forum_ids
-                    exclusions = self.bot.default_pool_exclusions
-                    guild_channels = []
-                    for channel_id in all_allowed_ids:
-                        if channel_id in exclusions:
-                            continue
-                        channel = self.bot.get_channel(channel_id)
-                        if channel and channel.guild.id == guild_id:
-                            guild_channels.append(channel_id)
-                    target_forum_ids = guild_channels
-
-                if not target_forum_ids:
-                    raise DrawError("🤔 无法抽卡：管理员尚未配置任何监控论坛，或者您选择的卡池为空。")
-
-                # 2. 从数据库中根据偏好抽取帖子ID
-                placeholders = ','.join('?' for _ in target_forum_ids)
-                cur.execute(f"SELECT thread_id FROM threads WHERE guild_id = ? AND forum_id IN ({placeholders})", [guild_id] + target_forum_ids)
-                all_thread_ids = [row[0] for row in cur.fetchall()]
-                
-                if not all_thread_ids:
-                    raise DrawError("🏜️ 所选卡池中空空如也，像你的钱包一样。等待管理员同步帖子或发布新帖吧！")
-                
-                return all_thread_ids
+            # 1. 获取用户偏好
+            user_pref_row = await self.bot.db.fetchone(
+                "SELECT selected_pools FROM user_preferences WHERE user_id = ? AND guild_id = ?",
+                (interaction.user.id, guild_id)
+            )
+
+            target_forum_ids = []
+            if user_pref_row:
+                try:
+                    user_pools = json.loads(user_pref_row[0])
+                    if "all" not in user_pools:
+                        target_forum_ids = [int(p) for p in user_pools]
+                except (json.JSONDecodeError, TypeError):
+                    raise DrawError("⚠️ 你的卡池设置似乎已损坏，请使用 `设置卡池` 功能重新设置。")
+
+            if not target_forum_ids:
+                all_allowed_ids = self.bot.allowed_forum_ids
+                exclusions = self.bot.default_pool_exclusions
+                guild_channels = []
+                for channel_id in all_allowed_ids:
+                    if channel_id in exclusions:
+                        continue
+                    channel = self.bot.get_channel(channel_id)
+                    if channel and channel.guild.id == guild_id:
+                        guild_channels.append(channel_id)
+                target_forum_ids = guild_channels
+
+            if not target_forum_ids:
+                raise DrawError("🤔 无法抽卡：管理员尚未配置任何监控论坛，或者您选择的卡池为空。")
 
-            finally:
-                if con:
-                    con.close()
+            return target_forum_ids
 
         try:
-            # --- 异步执行数据库查询 ---
-            all_thread_ids = await asyncio.to_thread(_fetch_ids_from_db)
-            
-            # --- 帖子抽取和处理 (这部分包含异步API调用，必须在主线程) ---
-            draw_count = min(count, len(all_thread_ids))
-            chosen_thread_ids = random.sample(all_thread_ids, k=draw_count)
+            target_forum_ids = await _resolve_target_forums()
+            guild_id = interaction.guild.id
             
+            # --- 2. 由抽卡引擎从内存卡池中抽取帖子ID（加权 + 排除最近抽过的帖子） ---
+            engine = self.bot.draw_engine
+            chosen_thread_ids = await engine.draw(self.bot.db, guild_id, interaction.user.id, target_forum_ids, count)
+            if not chosen_thread_ids:
+                raise DrawError("🏜️ 所选卡池中空空如也，像你的钱包一样。等待管理员同步帖子或发布新帖吧！")
+
+            # --- 3. 并发解析帖子：限制并发数，整次抽卡共享一个截止时间，失效的帖子立即从卡池补抽 ---
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + DRAW_DEADLINE_SECONDS
+            semaphore = asyncio.Semaphore(DRAW_RESOLVE_CONCURRENCY)
+            attempted = set(chosen_thread_ids)
+            backfills_left = count * DRAW_MAX_BACKFILL_ROUNDS
             embeds = []
-            not_found_count = 0
-            
-            # 注意：为了简化，此处的清理数据库操作仍为同步，但它们在循环内部，
-            # 此时 defer() 已成功，所以即使有短暂阻塞也不会导致交互超时。
-            con = sqlite3.connect(DB_FILE, timeout=10)
-            cur = con.cursor()
-            try:
-                for i, thread_id in enumerate(chosen_thread_ids):
-                    try:
-                        thread = self.bot.get_channel(thread_id) or await self.bot.fetch_channel(thread_id)
-                        if not isinstance(thread, discord.Thread) or thread.flags.pinned:
-                            not_found_count += 1
-                            if isinstance(thread, discord.Thread) and thread.flags.pinned:
-                                print(f"跳过置顶帖: {thread.name} ({thread.id})")
-                            continue
-
-                        title = f"✨ ({i+1-not_found_count}/{draw_count})" if count > 1 else "✨ 你的天选之帖"
-                        embed = await format_post_embed(interaction, thread, title_prefix=title)
-                        
-                        if embed.title == "错误":
-                            not_found_count += 1
-                            cur.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
-                            con.commit()
-                            print(f"[抽卡模块] 清理数据库: 移除了一个帖子 (ID: {thread_id})，原因: 帖子内容(起始消息)无法加载。")
-                            continue
-                        embeds.append(embed)
-
-                    except (discord.NotFound, discord.Forbidden) as e:
-                        not_found_count += 1
-                        cur.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
-                        con.commit()
-                        reason = "帖子本身已被删除" if isinstance(e, discord.NotFound) else "机器人无权访问该帖子"
-                        print(f"[抽卡模块] 清理数据库: 用户 {interaction.user} (ID: {interaction.user.id}) 抽中了无法访问的帖子 (ID: {thread_id})，已自动移除。原因: {reason}")
+            timed_out = False
+
+            pending_ids = chosen_thread_ids
+            while pending_ids:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                tasks_by_id = {
+                    thread_id: asyncio.create_task(self._resolve_thread(interaction, thread_id, semaphore))
+                    for thread_id in pending_ids
+                }
+                done, not_done = await asyncio.wait(tasks_by_id.values(), timeout=remaining)
+                for task in not_done:
+                    task.cancel()
+                if not_done:
+                    timed_out = True
+
+                # 按抽取顺序收集结果，保证展示顺序稳定
+                for task in tasks_by_id.values():
+                    if task not in done or task.cancelled():
                         continue
-            finally:
-                con.close()
+                    if task.exception() is not None:
+                        logging.error("抽卡时解析帖子失败", exc_info=task.exception())
+                        continue
+                    if task.result() is not None:
+                        embeds.append(task.result())
+
+                missing = count - len(embeds)
+                if timed_out or missing <= 0 or backfills_left <= 0:
+                    break
+                backfill = min(missing, backfills_left)
+                backfills_left -= backfill
+                pending_ids = await engine.draw(self.bot.db, guild_id, interaction.user.id, target_forum_ids, backfill, exclude=attempted)
+                attempted.update(pending_ids)
 
             if not embeds:
-                await interaction.followup.send("👻 很抱歉，抽中的帖子似乎都已消失在时空中...", ephemeral=True)
+                if timed_out:
+                    await interaction.followup.send("⏳ 抽中的帖子加载超时了，请稍后再试一次。", ephemeral=True)
+                else:
+                    await interaction.followup.send("👻 很抱歉，抽中的帖子似乎都已消失在时空中...", ephemeral=True)
                 return
 
+            # --- 4. 统一编号标题 ---
+            for i, embed in enumerate(embeds):
+                embed.title = f"✨ ({i+1}/{len(embeds)})" if count > 1 else "✨ 你的天选之帖"
+
             redraw_view = RedrawView(self, count)
             await interaction.followup.send(embeds=embeds, view=redraw_view, ephemeral=True)
 
@@ -302,6 +344,47 @@ class RandomPostView(discord.ui.View):
             logging.exception("抽卡时发生意外错误")
             await interaction.followup.send("🤯 糟糕！抽卡途中似乎遇到了一个意料之外的错误，请稍后再试或联系管理员。", ephemeral=True)
 
+    async def _resolve_thread(self, interaction: discord.Interaction, thread_id: int, semaphore: asyncio.Semaphore):
+        """
+        解析单个帖子并生成 Embed。帖子失效（已删除、无权访问、起始消息无法加载）时会被放入墓碑队列，
+        立即移出卡池、稍后批量从数据库删除；置顶帖或非帖子频道会被跳过。无法展示时返回 None，由调用方补抽。
+        """
+        tombstones = self.bot.tombstones
+        async with semaphore:
+            # 命中卡片缓存时直接渲染，不发起任何 REST 请求。先用网关缓存（无需请求）确认帖子仍然有效：
+            # 网关缓存中有该帖子且未置顶时可以直接使用卡片；不在网关缓存中时（通常是归档帖子），
+            # 只信任本次运行期间生成的卡片，更早的卡片走下面的 REST 路径重新验证并刷新
+            card = await self.bot.thread_cards.get(self.bot.db, thread_id)
+            if card is not None:
+                cached_thread = self.bot.get_channel(thread_id)
+                if isinstance(cached_thread, discord.Thread):
+                    usable = not cached_thread.flags.pinned
+                else:
+                    usable = cached_thread is None and self.bot.thread_cards.verified_this_run(card)
+                if usable:
+                    return card_embed(card)
+
+            try:
+                thread = self.bot.get_channel(thread_id) or await self.bot.fetch_channel(thread_id)
+                if not isinstance(thread, discord.Thread) or thread.flags.pinned:
+                    if isinstance(thread, discord.Thread) and thread.flags.pinned:
+                        print(f"跳过置顶帖: {thread.name} ({thread.id})")
+                    return None
+
+                embed = await format_post_embed(interaction, thread)
+                
+                if embed.title == "错误":
+                    tombstones.bury(thread_id, interaction.guild.id, thread.parent_id)
+                    print(f"[抽卡模块] 清理卡池: 移除了一个帖子 (ID: {thread_id})，原因: 帖子内容(起始消息)无法加载。")
+                    return None
+                return embed
+
+            except (discord.NotFound, discord.Forbidden) as e:
+                tombstones.bury(thread_id)
+                reason = "帖子本身已被删除" if isinstance(e, discord.NotFound) else "机器人无权访问该帖子"
+                print(f"[抽卡模块] 清理卡池: 用户 {interaction.user} (ID: {interaction.user.id}) 抽中了无法访问的帖子 (ID: {thread_id})，已自动移除。原因: {reason}")
+                return None
+
     @discord.ui.button(label="抽一张", style=discord.ButtonStyle.primary, custom_id="draw_one_button", emoji="✨")
     async def draw_one_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         await self._draw_posts(interaction, 1)
@@ -318,10 +401,13 @@ class RandomPostView(discord.ui.View):
 
 
 # --- 辅助函数：创建抽卡面板 ---
-async def create_gacha_panel(bot: commands.Bot, channel: discord.TextChannel):
+GACHA_PANEL_TITLE = "🎉 类脑抽抽乐 🎉"
+_panel_locks: dict[int, asyncio.Lock] = {}
+
+async def create_gacha_panel(bot: commands.Bot, channel: discord.TextChannel) -> discord.Message:
     """创建并发送抽卡面板到指定频道。"""
     embed = discord.Embed(
-        title="🎉 类脑抽抽乐 🎉",
+        title=GACHA_PANEL_TITLE,
         description="欢迎来到类脑抽卡机！准备好迎接命运的安排了吗？!\n\n"
                     "**玩法介绍:**\n"
                     "- **抽一张 ✨**: 试试手气，看看今天的天选之卡是什么！\n"
@@ -329,48 +415,102 @@ async def create_gacha_panel(bot: commands.Bot, channel: discord.TextChannel):
                     "- **设置卡池 🔧**: 定制您的专属卡池，只抽你最感兴趣的内容！\n\n",
         color=discord.Color.gold()
     )
-    await channel.send(embed=embed, view=RandomPostView(bot))
+    return await channel.send(embed=embed, view=RandomPostView(bot))
+
+
+async def replace_gacha_panel(bot: commands.Bot, channel: discord.TextChannel) -> discord.Message:
+    """
+    删除频道中的旧抽卡面板并发送新面板，让面板始终位于频道底部。
+    旧面板的消息ID保存在 gacha_panels 表中，删除只需一次请求；
+    只有在没有记录时（例如升级前发送的面板）才扫描最近的历史消息。同一频道的重建按顺序执行。
+    """
+    async with _panel_locks.setdefault(channel.id, asyncio.Lock()):
+        row = await bot.db.fetchone("SELECT message_id FROM gacha_panels WHERE channel_id = ?", (channel.id,))
+        if row:
+            try:
+                await channel.get_partial_message(row[0]).delete()
+            except discord.NotFound:
+                pass  # 面板已被手动删除
+            except discord.HTTPException as e:
+                # 删除失败（如权限不足）也照常发送新面板
+                print(f"删除旧面板时出错: {e}")
+        else:
+            async for message in channel.history(limit=100):
+                if message.author == bot.user and message.embeds and message.embeds[0].title == GACHA_PANEL_TITLE:
+                    try:
+                        await message.delete()
+                    except discord.HTTPException as e:
+                        print(f"删除旧面板时出错 (可能已被删除): {e}")
+
+        panel = await create_gacha_panel(bot, channel)
+        await bot.db.execute(
+            "INSERT INTO gacha_panels (channel_id, guild_id, message_id, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(channel_id) DO UPDATE SET message_id = excluded.message_id, updated_at = excluded.updated_at",
+            (channel.id, channel.guild.id, panel.id, time.time())
+        )
+        return panel
 
 
 # --- Cog 类 ---
 class RandomPost(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        # 初始化数据库
-        init_db()
         # 为了让主面板持久化，在 bot 启动时添加
         self.bot.add_view(RandomPostView(self.bot))
 
+    async def cog_load(self):
+        """初始化数据库，并从数据库构建内存卡池索引，之后由各处写入点增量维护。"""
+        await self.bot.db.transaction(init_db)
+        loaded = await self.bot.db.read(self.bot.thread_pool.load_from_db)
+        print(f"[抽卡模块] 卡池索引已载入 {loaded} 个帖子。")
+        self.flush_recent_draws.start()
+        self.prune_thread_cards.start()
+        self.flush_tombstones.start()
+
+    async def cog_unload(self):
+        self.flush_recent_draws.cancel()
+        self.prune_thread_cards.cancel()
+        self.flush_tombstones.cancel()
+        # 卸载前把尚未写回的最近抽卡记录和待删除的失效帖子落盘
+        await self.bot.draw_engine.recent.flush(self.bot.db)
+        await self.bot.tombstones.flush(self.bot.db)
+
+    @tasks.loop(seconds=30)
+    async def flush_tombstones(self):
+        """把抽卡时发现的失效帖子批量从数据库中删除。"""
+        try:
+            deleted = await self.bot.tombstones.flush(self.bot.db)
+            if deleted:
+                print(f"[抽卡模块] 已从数据库批量清理 {deleted} 个失效帖子（本小时累计 {self.bot.tombstones.purged_this_hour()} 个）。")
+        except Exception as e:
+            print(f"[抽卡模块] 批量清理失效帖子失败，将在下次重试: {e}")
+
+    @tasks.loop(minutes=1)
+    async def flush_recent_draws(self):
+        """定期把用户最近抽卡记录批量写回数据库，重启后仍能排除最近抽过的帖子。"""
+        try:
+            await self.bot.draw_engine.recent.flush(self.bot.db)
+        except Exception as e:
+            print(f"[抽卡模块] 写回最近抽卡记录失败，将在下次重试: {e}")
+
+    @tasks.loop(hours=1)
+    async def prune_thread_cards(self):
+        """每小时清理一次数据库中已过期的帖子卡片。"""
+        try:
+            pruned = await self.bot.thread_cards.prune_expired(self.bot.db)
+            if pruned:
+                print(f"[抽卡模块] 已清理 {pruned} 张过期的帖子卡片缓存。")
+        except Exception as e:
+            print(f"[抽卡模块] 清理帖子卡片缓存失败: {e}")
+
     @app_commands.command(name="建立随机抽取面板", description="发送一个持久化的面板，用于随机抽取帖子。")
+    @require_roles(ADMIN_ROLES)
     async def random_post_panel(self, interaction: discord.Interaction):
         """发送或重建随机帖子抽取面板。"""
-        # --- 从 .env 加载配置 ---
-        admin_role_ids_str = os.getenv("ADMIN_ROLE_IDS", "")
-        if not admin_role_ids_str:
-            await interaction.response.send_message("❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `ADMIN_ROLE_IDS`。", ephemeral=True)
-            return
-
-        admin_role_ids = {int(rid.strip()) for rid in admin_role_ids_str.split(',')}
-        
-        # --- 权限检查 ---
-        user_roles = {role.id for role in interaction.user.roles}
-        if not user_roles.intersection(admin_role_ids):
-            await interaction.response.send_message("🚫 **权限不足**：只有拥有特定管理员身份组的用户才能执行此操作。", ephemeral=True)
-            return
-
         await interaction.response.defer(ephemeral=True, thinking=True)
 
-        # 查找并删除此频道中任何现有的抽卡面板
-        async for message in interaction.channel.history(limit=100):
-            if message.author == self.bot.user and message.embeds:
-                if message.embeds[0].title == "🎉 类脑抽抽乐 🎉":
-                    try:
-                        await message.delete()
-                    except discord.HTTPException as e:
-                        print(f"删除旧面板时出错 (可能已被删除): {e}")
-        
-        # 创建新的面板
-        await create_gacha_panel(self.bot, interaction.channel)
+        # 删除此频道中现有的抽卡面板并创建新的面板
+        await replace_gacha_panel(self.bot, interaction.channel)
         
         await interaction.followup.send("✅ 抽卡面板已成功建立在本频道。", ephemeral=True)
 
@@ -1,13 +1,17 @@
+import argparse
 import sqlite3
-import json
 import os
 
+from utils.preset_io import EXPORT_FORMATS, export_presets, parse_since
+
 DB_FILE = 'posts.db'
 OUTPUT_FILE = 'exported_preset_messages.json'
 
-def export_preset_messages():
+def export_preset_messages(output: str = OUTPUT_FILE, fmt: str = "json", compress: bool = False,
+                           guild_id: int = None, since_id: int = None, since_ts: float = None):
     """
-    从 SQLite 数据库中导出所有预设消息到 JSON 文件。
+    从 SQLite 数据库中流式导出预设消息（逐批读取，内存占用与预设数量无关）。
+    导出的文件可以直接通过机器人的“导入json”命令导回。
     """
     if not os.path.exists(DB_FILE):
         print(f"错误: 数据库文件 '{DB_FILE}' 不存在。")
@@ -15,32 +19,16 @@ def export_preset_messages():
 
     con = None
     try:
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        
-        # 查询所有预设消息
-        cur.execute("SELECT guild_id, name, content, creator_id FROM preset_messages")
-        rows = cur.fetchall()
-
-        if not rows:
-            print("数据库中没有找到预设消息。")
+        # 只读打开，不影响正在运行的机器人
+        con = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True)
+        count = export_presets(con, output, fmt, compress, guild_id=guild_id, since_id=since_id, since_ts=since_ts)
+
+        if not count:
+            print("数据库中没有找到符合条件的预设消息。")
+            os.remove(output)
             return
 
-        # 将数据转换为字典列表
-        exported_data = []
-        for row in rows:
-            exported_data.append({
-                "guild_id": row[0],
-                "name": row[1],
-                "content": row[2],
-                "creator_id": row[3]
-            })
-
-        # 将数据写入 JSON 文件
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(exported_data, f, ensure_ascii=False, indent=4)
-        
-        print(f"成功导出 {len(exported_data)} 条预设消息到 '{OUTPUT_FILE}'。")
+        print(f"成功导出 {count} 条预设消息到 '{output}'。")
 
     except sqlite3.Error as e:
         print(f"数据库操作错误: {e}")
@@ -53,4 +41,19 @@ def export_preset_messages():
             con.close()
 
 if __name__ == "__main__":
-    export_preset_messages()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="导出预设消息")
+    parser.add_argument("-f", "--format", choices=EXPORT_FORMATS, default="json", help="文件格式（默认 json）")
+    parser.add_argument("-z", "--gzip", action="store_true", help="用 gzip 压缩输出")
+    parser.add_argument("-g", "--guild", type=int, help="只导出指定服务器的预设")
+    parser.add_argument("--since-id", type=int, help="只导出ID大于此值的预设")
+    parser.add_argument("--since", help="只导出在此之后新增或修改的预设（Unix 时间戳或 ISO 日期）")
+    parser.add_argument("-o", "--output", help="输出文件路径")
+    args = parser.parse_args()
+
+    output = args.output
+    if output is None:
+        output = OUTPUT_FILE if args.format == "json" else f"exported_preset_messages.{args.format}"
+        if args.gzip:
+            output += ".gz"
+    since_ts = parse_since(args.since) if args.since else None
+    export_preset_messages(output, args.format, args.gzip, args.guild, args.since_id, since_ts)
@@ -0,0 +1,2 @@
+# utils/__init__.py
+# 这个包存放供多个 Cog 共享的基础设施（卡池索引、数据库访问等），它们不是 Cog，不会被自动加载。
\ No newline at end of file
@@ -0,0 +1,40 @@
+# utils/card_embeds.py
+from typing import Any
+
+import discord
+
+from .thread_cards import ThreadCard
+
+DEFAULT_TITLE_PREFIX = "✨ 新卡速递"
+TITLE_MAX_LENGTH = 100
+FIELD_MAX_LENGTH = 1024
+
+
+def _truncate(text: str, limit: int) -> str:
+    return text[:limit - 3] + "..." if len(text) > limit else text
+
+
+def card_embed(card: ThreadCard, title_prefix: str = DEFAULT_TITLE_PREFIX) -> discord.Embed:
+    """抽卡结果与新帖速递共用的帖子卡片 Embed，不需要任何 API 请求。每次返回新的对象，调用方可以修改标题等。"""
+    author_mention = f"**👤 作者:** {card.owner_name}" if card.owner_name else "**👤 作者:** 未知"
+    header_line = f"**{_truncate(card.title, TITLE_MAX_LENGTH)}** | {author_mention}"
+    if not card.content:
+        # 起始消息无法获取或没有文字（如纯图片帖）时显示占位说明，与原先的新帖速递一致
+        content_section = "**📝 内容速览:**\n*(无法加载起始消息，可能已被删除或帖子格式特殊)*"
+    else:
+        content_section = f"**📝 内容速览:**\n{card.content}"
+
+    embed = discord.Embed(title=title_prefix, description=f"{header_line}\n\n{content_section}", color=discord.Color.blue())
+    embed.add_field(name="🚪 传送门", value=f"[点击查看原帖]({card.jump_url})", inline=False)
+    if card.image_url:
+        embed.set_thumbnail(url=card.image_url)
+    if card.tags:
+        embed.add_field(name="🏷️ 标签", value=_truncate(card.tags, FIELD_MAX_LENGTH), inline=False)
+    if card.forum_name:
+        embed.set_footer(text=f"来自论坛: {card.forum_name}")
+    return embed
+
+
+def render_card(card: ThreadCard, title_prefix: str = DEFAULT_TITLE_PREFIX) -> dict[str, Any]:
+    """把帖子卡片渲染为 Embed 字典。"""
+    return card_embed(card, title_prefix).to_dict()
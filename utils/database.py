@@ -0,0 +1,100 @@
+# utils/database.py
+import asyncio
+import functools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional, Sequence, TypeVar
+
+T = TypeVar('T')
+
+
+class Database:
+    """
+    所有 Cog 共享的 SQLite 访问层。
+    - 每个工作线程持有一条长连接（WAL 模式），连接内部会缓存编译好的语句，避免反复 connect/close。
+    - 所有写操作都经过唯一的写线程串行执行；读操作走一个小型读线程池，WAL 下读写互不阻塞。
+    - 对外只暴露 async 方法，事件循环线程永远不会直接碰到 sqlite3。
+    """
+    def __init__(self, path: str, *, read_workers: int = 2, cached_statements: int = 256):
+        self.path = path
+        self._cached_statements = cached_statements
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-reader")
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._connection_hooks: list[Callable[[sqlite3.Connection], None]] = []
+
+    # --- 连接管理（只在工作线程中调用） ---
+    def add_connection_hook(self, hook: Callable[[sqlite3.Connection], None]):
+        """注册一个在每条新连接建立后执行的回调（例如注册自定义 SQL 函数）。应在首次访问数据库前调用。"""
+        self._connection_hooks.append(hook)
+
+    def _connect(self) -> sqlite3.Connection:
+        # 连接只会被创建它的工作线程使用；关闭 same-thread 检查是为了能在关闭时统一回收
+        con = sqlite3.connect(self.path, timeout=10, check_same_thread=False, cached_statements=self._cached_statements)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA busy_timeout=10000")
+        for hook in self._connection_hooks:
+            hook(con)
+        with self._connections_lock:
+            self._connections.append(con)
+        return con
+
+    def _connection(self) -> sqlite3.Connection:
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = self._local.con = self._connect()
+        return con
+
+    def _call(self, fn: Callable[..., T], *args) -> T:
+        return fn(self._connection(), *args)
+
+    def _call_in_transaction(self, fn: Callable[..., T], *args) -> T:
+        con = self._connection()
+        # with 语句成功时提交，抛出异常时回滚
+        with con:
+            return fn(con, *args)
+
+    async def _submit(self, executor: ThreadPoolExecutor, fn: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(fn, *args))
+
+    # --- 读操作 ---
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+        return await self._submit(self._readers, self._call, lambda con: con.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> list[tuple]:
+        return await self._submit(self._readers, self._call, lambda con: con.execute(sql, params).fetchall())
+
+    async def read(self, fn: Callable[..., T], *args) -> T:
+        """在读线程中执行 fn(con, *args)，用于需要多条查询或流式遍历游标的场景。"""
+        return await self._submit(self._readers, self._call, fn, *args)
+
+    # --- 写操作 ---
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """执行一条写语句并提交，返回受影响的行数。"""
+        return await self._submit(self._writer, self._call_in_transaction, lambda con: con.execute(sql, params).rowcount)
+
+    async def executemany(self, sql: str, seq_of_params: Iterable[Sequence[Any]]) -> int:
+        """在同一个事务中批量执行写语句，返回受影响的总行数。"""
+        return await self._submit(self._writer, self._call_in_transaction, lambda con: con.executemany(sql, seq_of_params).rowcount)
+
+    async def transaction(self, fn: Callable[..., T], *args) -> T:
+        """在写线程的单个事务中执行 fn(con, *args)，成功提交、失败回滚。"""
+        return await self._submit(self._writer, self._call_in_transaction, fn, *args)
+
+    # --- 生命周期 ---
+    def close(self):
+        """等待排队中的操作完成后关闭所有连接。"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for con in self._connections:
+                try:
+                    con.close()
+                except sqlite3.Error:
+                    pass
+            self._connections.clear()
@@ -0,0 +1,57 @@
+# utils/debounce.py
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable
+
+
+class KeyedDebouncer:
+    """
+    按键合并短时间内的重复请求：同一个键在 delay 秒内没有新的请求时才执行一次，
+    持续有请求时最多推迟 max_wait 秒。执行时使用最后一次请求传入的函数。
+    执行期间到来的新请求会在本次执行结束后再触发一次，不会丢失。
+    """
+    def __init__(self, delay: float = 10.0, max_wait: float = 60.0):
+        self.delay = max(0.0, delay)
+        self.max_wait = max(self.delay, max_wait)
+        self._pending: dict[Hashable, list] = {}  # 键 -> [首次请求时间, 最后请求时间, 函数]
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+
+    def schedule(self, key: Hashable, fn: Callable[[], Awaitable[None]]):
+        now = time.monotonic()
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = [now, now, fn]
+        else:
+            pending[1], pending[2] = now, fn
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def _run(self, key: Hashable):
+        try:
+            while True:
+                first, last, _ = self._pending[key]
+                wait = min(last + self.delay, first + self.max_wait) - time.monotonic()
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            self._tasks.pop(key, None)
+            raise
+        # 先移除记录，执行期间的新请求会开始新一轮等待
+        _, _, fn = self._pending.pop(key)
+        self._tasks.pop(key, None)
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            try:
+                await fn()
+            except Exception as e:
+                print(f"[防抖] 执行 {key} 的合并任务失败: {type(e).__name__}: {e}")
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def cancel_all(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._pending.clear()
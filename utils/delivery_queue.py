@@ -0,0 +1,294 @@
+# utils/delivery_queue.py
+import asyncio
+import os
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+
+class PermanentDeliveryError(Exception):
+    """重试也无法解决的失败（帖子已删除、权限不足等），任务直接出队，不再重试。"""
+
+
+@dataclass(slots=True)
+class DeliveryJob:
+    thread_id: int
+    guild_id: int
+    forum_id: int
+    enqueued_at: float
+    attempts: int  # 已经失败的次数
+
+
+@dataclass(slots=True)
+class DeliveryQueueStats:
+    depth: int = 0  # 队列中的任务数（含正在执行的）
+    due: int = 0  # 已到执行时间、等待空闲工作协程的任务数
+    in_flight: int = 0
+    oldest_age: float = 0.0  # 最早入队的任务已等待的秒数
+    delivered: int = 0  # 本次启动以来成功的任务数
+    failed: int = 0  # 本次启动以来放弃的任务数
+
+
+# 处理一批任务，返回 {帖子ID: 异常}，不在其中的任务视为成功
+DeliveryHandler = Callable[[list[DeliveryJob]], Awaitable[dict[int, Exception]]]
+
+# Discord 单条消息最多 10 个 Embed，摘要模式下每批最多合并这么多个帖子
+DIGEST_MAX_EMBEDS = 10
+
+
+def init_delivery_db(con: sqlite3.Connection):
+    """创建速递队列表与已发送消息表（通过 bot.db.transaction 在写线程中执行）。"""
+    con.execute('''
+        CREATE TABLE IF NOT EXISTS delivery_queue (
+            thread_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            forum_id INTEGER NOT NULL,
+            enqueued_at REAL NOT NULL,
+            next_attempt_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            leased INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT
+        )
+    ''')
+    con.execute("CREATE INDEX IF NOT EXISTS idx_delivery_queue_next_attempt ON delivery_queue (leased, next_attempt_at)")
+    # 已发送的速递消息索引，过期清理直接按此表批量删除，无需扫描频道历史
+    con.execute('''
+        CREATE TABLE IF NOT EXISTS delivery_messages (
+            message_id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            thread_id INTEGER,
+            sent_at REAL NOT NULL
+        )
+    ''')
+    con.execute("CREATE INDEX IF NOT EXISTS idx_delivery_messages_sent_at ON delivery_messages (sent_at)")
+
+
+class DeliveryQueue:
+    """
+    持久化的新帖速递队列。
+    - 任务保存在 delivery_queue 表中，带有下一次尝试的时间；重启后从表中继续，不会丢失。
+    - 一个调度协程按 next_attempt_at 取出到期的任务，最多同时执行 workers 个，不会因为突发的新帖创建大量休眠的任务。
+    - 失败后按指数退避加随机抖动重新排期，达到 max_attempts 次或遇到 PermanentDeliveryError 时放弃。
+    - 摘要模式（window > 0）：到期的任务最多再等待 window 秒，凑满 batch_size 个立即发送，否则等待期满后把已到期的一起发送。
+    执行中的任务在表中标记为 leased；进程在执行中途退出时，下次启动会立即重新执行这些任务。
+    成功后删除任务的写入若失败，会在调度协程中重试，不会把已送达的任务当作失败重新发送。
+    """
+    def __init__(self, db, handler: DeliveryHandler, workers: int = 2, max_attempts: int = 5,
+                 base_delay: float = 60.0, max_delay: float = 900.0, initial_delay: float = 15.0,
+                 batch_size: int = 1, window: float = 0.0):
+        self.db = db
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = max(1.0, base_delay)
+        self.max_delay = max(self.base_delay, max_delay)
+        self.initial_delay = max(0.0, initial_delay)
+        self.batch_size = max(1, batch_size)
+        self.window = max(0.0, window)
+        self.delivered = 0
+        self.failed = 0
+        self._batches: set[asyncio.Task] = set()
+        self._in_flight: set[int] = set()
+        self._wake = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._recovered = False  # 是否已经回收过上次运行遗留的 leased 任务
+        self._unacked: set[int] = set()  # 已送达、但从表中删除失败的任务
+
+    @classmethod
+    def from_env(cls, db, handler: DeliveryHandler) -> "DeliveryQueue":
+        """
+        读取以下配置（均可选）：
+        - FETCH_STARTER_MESSAGE_DELAY_SECONDS: 新帖入队后首次尝试前的等待，确保 CDN 资源就绪，默认 15。
+        - DELIVERY_MAX_RETRIES: 每个帖子最多尝试的次数，默认 5。
+        - DELIVERY_RETRY_DELAY_SECONDS: 第一次重试的基础等待时间，之后每次翻倍，默认 60。
+        - DELIVERY_RETRY_MAX_DELAY_SECONDS: 单次重试等待的上限，默认 900。
+        - DELIVERY_WORKERS: 同时执行的速递任务（批次）数，默认 2。
+        - DELIVERY_DIGEST_WINDOW_SECONDS: 大于 0 时启用摘要模式，把该时间窗口内到期的帖子合并为一条消息（最多 10 个 Embed），默认 0。
+        """
+        try:
+            initial_delay = float(os.getenv("FETCH_STARTER_MESSAGE_DELAY_SECONDS", "15.0"))
+            max_attempts = int(os.getenv("DELIVERY_MAX_RETRIES", "5"))
+            base_delay = float(os.getenv("DELIVERY_RETRY_DELAY_SECONDS", "60.0"))
+            max_delay = float(os.getenv("DELIVERY_RETRY_MAX_DELAY_SECONDS", "900.0"))
+            workers = int(os.getenv("DELIVERY_WORKERS", "2"))
+            window = float(os.getenv("DELIVERY_DIGEST_WINDOW_SECONDS", "0"))
+        except ValueError:
+            print("⚠️ 新帖速递队列的 .env 配置值无效，将使用默认值。")
+            initial_delay, max_attempts, base_delay, max_delay, workers, window = 15.0, 5, 60.0, 900.0, 2, 0.0
+        batch_size = DIGEST_MAX_EMBEDS if window > 0 else 1
+        return cls(db, handler, workers, max_attempts, base_delay, max_delay, initial_delay, batch_size, window)
+
+    # --- 生命周期 ---
+    async def start(self):
+        """
+        启动调度协程（可重复调用，例如重新连接时）。
+        只有第一次启动（或 stop 之后）才会回收上次运行时中断的任务，避免把仍在执行的批次重新发送一遍。
+        """
+        if self._dispatcher is not None and not self._dispatcher.done():
+            return
+        if not self._recovered:
+            await self.db.execute("UPDATE delivery_queue SET leased = 0, next_attempt_at = ? WHERE leased = 1", (time.time(),))
+            self._recovered = True
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def stop(self):
+        """停止调度与正在执行的任务（未完成的任务保留在表中，下次启动时继续）。"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for task in self._batches:
+            task.cancel()
+        self._batches.clear()
+        self._in_flight.clear()
+        # 执行中的批次已被取消，下次启动时需要回收它们
+        self._recovered = False
+
+    # --- 入队 ---
+    async def enqueue(self, thread_id: int, guild_id: int, forum_id: int, delay: Optional[float] = None):
+        """加入一个速递任务（同一个帖子只会排队一次），delay 省略时使用 initial_delay。"""
+        now = time.time()
+        await self.db.execute(
+            "INSERT OR IGNORE INTO delivery_queue (thread_id, guild_id, forum_id, enqueued_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+            (thread_id, guild_id, forum_id, now, now + (self.initial_delay if delay is None else delay))
+        )
+        self._wake.set()
+
+    # --- 调度 ---
+    def backoff(self, attempts: int) -> float:
+        """第 attempts 次失败后的等待时间：指数增长并封顶，再取其一半加上随机抖动，避免同一批失败的任务同时重试。"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _claim(self, con: sqlite3.Connection, now: float, max_batches: int) -> list[list[DeliveryJob]]:
+        rows = con.execute(
+            "SELECT thread_id, guild_id, forum_id, enqueued_at, attempts, next_attempt_at FROM delivery_queue "
+            "WHERE leased = 0 AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+            (now, max_batches * self.batch_size)
+        ).fetchall()
+        batches = []
+        for i in range(0, len(rows), self.batch_size):
+            chunk = rows[i:i + self.batch_size]
+            # 不满一批时，等最早到期的任务等满 window 秒再发送
+            if len(chunk) < self.batch_size and chunk[0][5] + self.window > now:
+                break
+            batches.append([DeliveryJob(*row[:5]) for row in chunk])
+        con.executemany("UPDATE delivery_queue SET leased = 1 WHERE thread_id = ?", [(job.thread_id,) for batch in batches for job in batch])
+        return batches
+
+    async def _dispatch(self):
+        while True:
+            try:
+                timeout = await self._dispatch_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 数据库暂时不可用时不能让调度协程退出，稍后重试
+                print(f"[速递队列] 调度失败，5 秒后重试: {type(e).__name__}: {e}")
+                timeout = 5.0
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch_once(self) -> float:
+        """取出到期的任务交给工作协程，返回距离下一次调度的等待秒数。"""
+        self._wake.clear()
+        if self._unacked:
+            await self._ack(list(self._unacked))
+
+        free = self.workers - len(self._batches)
+        if free > 0:
+            batches = await self.db.transaction(self._claim, time.time(), free)
+            for jobs in batches:
+                self._in_flight.update(job.thread_id for job in jobs)
+                task = asyncio.create_task(self._run(jobs))
+                self._batches.add(task)
+
+        # 没有空闲工作协程时等待任务完成；否则睡到下一个任务到期（摘要模式下为到期后再等 window 秒，最多 60 秒），有新任务入队时提前唤醒
+        timeout = 60.0
+        if self._unacked:
+            timeout = 5.0
+        if len(self._batches) < self.workers:
+            row = await self.db.fetchone("SELECT MIN(next_attempt_at) FROM delivery_queue WHERE leased = 0")
+            if row and row[0] is not None:
+                now = time.time()
+                ready_at = row[0] + self.window if row[0] <= now else row[0]
+                timeout = min(timeout, max(0.0, ready_at - now))
+        return timeout
+
+    async def _ack(self, thread_ids: list[int]):
+        """从表中删除已送达的任务；失败时记下来由调度协程重试，而不是当作发送失败。"""
+        try:
+            await self.db.executemany("DELETE FROM delivery_queue WHERE thread_id = ?", [(thread_id,) for thread_id in thread_ids])
+        except Exception as e:
+            if not self._unacked.issuperset(thread_ids):
+                print(f"[速递队列] 删除 {len(thread_ids)} 个已送达的任务失败，稍后重试: {type(e).__name__}: {e}")
+            self._unacked.update(thread_ids)
+        else:
+            self._unacked.difference_update(thread_ids)
+
+    async def _run(self, jobs: list[DeliveryJob]):
+        try:
+            try:
+                errors = await self.handler(jobs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                errors = {job.thread_id: e for job in jobs}
+
+            done = [job.thread_id for job in jobs if job.thread_id not in errors]
+            if done:
+                self.delivered += len(done)
+                await self._ack(done)
+            for job in jobs:
+                error = errors.get(job.thread_id)
+                if error is not None:
+                    try:
+                        await self._retry_or_drop(job, error)
+                    except Exception as e:
+                        # 任务保持 leased，下次启动时重新执行
+                        print(f"[速递队列] 更新帖子 {job.thread_id} 的重试信息失败: {type(e).__name__}: {e}")
+        finally:
+            self._batches.discard(asyncio.current_task())
+            self._in_flight.difference_update(job.thread_id for job in jobs)
+            self._wake.set()
+
+    async def _retry_or_drop(self, job: DeliveryJob, exc: Exception):
+        if isinstance(exc, PermanentDeliveryError):
+            await self._drop(job, f"放弃: {exc}")
+            return
+        job.attempts += 1
+        error = f"{type(exc).__name__}: {exc}"
+        if job.attempts >= self.max_attempts:
+            await self._drop(job, f"已尝试 {job.attempts} 次，最后一次错误: {error}")
+            return
+        delay = self.backoff(job.attempts)
+        print(f"[速递队列] 帖子 {job.thread_id} 第 {job.attempts}/{self.max_attempts} 次尝试失败 ({error})，{delay:.0f} 秒后重试。")
+        await self.db.execute(
+            "UPDATE delivery_queue SET leased = 0, attempts = ?, next_attempt_at = ?, last_error = ? WHERE thread_id = ?",
+            (job.attempts, time.time() + delay, error[:500], job.thread_id)
+        )
+
+    async def _drop(self, job: DeliveryJob, reason: str):
+        self.failed += 1
+        print(f"[速递队列] ❌ 帖子 {job.thread_id} 的速递最终失败，{reason}")
+        await self.db.execute("DELETE FROM delivery_queue WHERE thread_id = ?", (job.thread_id,))
+
+    # --- 统计 ---
+    async def stats(self) -> DeliveryQueueStats:
+        now = time.time()
+        row = await self.db.fetchone(
+            "SELECT COUNT(*), SUM(leased = 0 AND next_attempt_at <= ?), MIN(enqueued_at) FROM delivery_queue", (now,)
+        )
+        depth, due, oldest = row if row else (0, 0, None)
+        return DeliveryQueueStats(
+            depth=depth or 0,
+            due=due or 0,
+            in_flight=len(self._in_flight),
+            oldest_age=now - oldest if oldest is not None else 0.0,
+            delivered=self.delivered,
+            failed=self.failed,
+        )
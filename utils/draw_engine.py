@@ -0,0 +1,173 @@
+# utils/draw_engine.py
+import os
+import sqlite3
+import time
+from array import array
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from .thread_pool import ThreadPool, WeightFn
+
+DISCORD_EPOCH_MS = 1420070400000
+
+UserKey = tuple[int, int]  # (guild_id, user_id)
+
+
+def recency_weight_fn(half_life_days: float, reference_ms: Optional[int] = None) -> WeightFn:
+    """
+    根据帖子ID（雪花ID中包含创建时间）计算“越新越重”的指数衰减权重。
+    权重以固定参考时间为基准，因此不同帖子之间的相对权重不随时间变化，无需定期重建。
+    """
+    reference_ms = reference_ms if reference_ms is not None else int(time.time() * 1000)
+    half_life_ms = half_life_days * 86_400_000
+
+    def weight(thread_id: int) -> float:
+        created_ms = (thread_id >> 22) + DISCORD_EPOCH_MS
+        exponent = (created_ms - reference_ms) / half_life_ms
+        # 限制指数范围，防止导入的异常ID导致浮点溢出
+        return 2.0 ** max(-1000.0, min(1000.0, exponent))
+
+    return weight
+
+
+class RecentDraws:
+    """
+    记录每个用户最近抽到的帖子ID（每个用户一个定长的 array('q') 环形窗口）。
+    - 按需从数据库加载，内存中最多保留 max_users 个用户（LRU）。
+    - 变更先标记为脏数据，由 flush 批量写回 user_draw_history 表。
+    """
+    def __init__(self, size: int, max_users: int = 10000):
+        self.size = size
+        self.max_users = max_users
+        self._entries: OrderedDict[UserKey, array] = OrderedDict()
+        self._dirty: dict[UserKey, array] = {}
+
+    @staticmethod
+    def _load_row(con: sqlite3.Connection, key: UserKey) -> array:
+        row = con.execute(
+            "SELECT recent FROM user_draw_history WHERE guild_id = ? AND user_id = ?", key
+        ).fetchone()
+        recent = array('q')
+        if row and row[0]:
+            recent.frombytes(row[0])
+        return recent
+
+    async def ensure_loaded(self, db, key: UserKey):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        # 已被 LRU 淘汰但尚未写回的记录比数据库中的更新
+        recent = self._dirty.get(key)
+        if recent is None:
+            recent = await db.read(self._load_row, key)
+        self._remember(key, recent[-self.size:] if self.size else array('q'))
+
+    def _remember(self, key: UserKey, recent: array):
+        self._entries[key] = recent
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_users:
+            # 被淘汰的脏数据保留在 _dirty 中，下一次 flush 时仍会写回
+            self._entries.popitem(last=False)
+
+    def get(self, key: UserKey) -> array:
+        return self._entries.get(key, array('q'))
+
+    def record(self, key: UserKey, thread_ids: Iterable[int]):
+        if self.size <= 0:
+            return
+        recent = self._entries.get(key)
+        if recent is None:
+            recent = array('q')
+            self._remember(key, recent)
+        recent.extend(thread_ids)
+        overflow = len(recent) - self.size
+        if overflow > 0:
+            del recent[:overflow]
+        self._dirty[key] = recent
+
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    async def flush(self, db) -> int:
+        """把脏数据批量写回数据库，返回写入的用户数。"""
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, {}
+        rows = [(user_id, guild_id, recent.tobytes()) for (guild_id, user_id), recent in dirty.items()]
+        try:
+            await db.executemany(
+                "INSERT OR REPLACE INTO user_draw_history (user_id, guild_id, recent) VALUES (?, ?, ?)", rows
+            )
+        except Exception:
+            # 写入失败时把数据放回，等待下次重试（期间产生的新记录优先）
+            for key, recent in dirty.items():
+                self._dirty.setdefault(key, recent)
+            raise
+        return len(rows)
+
+
+class DrawEngine:
+    """
+    抽卡引擎：在内存卡池上做带权重的抽样，并排除用户最近抽到过的帖子。
+    配置全部来自 .env，默认行为与纯随机抽样一致（仅多了“最近抽过”的排除）。
+    """
+    def __init__(self, pool: ThreadPool, *, recent_size: int = 50,
+                 forum_weights: Optional[dict[int, float]] = None,
+                 recency_bias: float = 0.0, recency_half_life_days: float = 30.0):
+        self.pool = pool
+        self.recent = RecentDraws(recent_size)
+        self.forum_weights = forum_weights or {}
+        self.recency_bias = recency_bias
+        if recency_bias > 0:
+            pool.set_weight_fn(recency_weight_fn(recency_half_life_days))
+
+    @classmethod
+    def from_env(cls, pool: ThreadPool) -> "DrawEngine":
+        """
+        读取以下配置（均可选）：
+        - DRAW_RECENT_EXCLUSION_SIZE: 每个用户排除最近抽过的帖子数量，默认 50，0 表示关闭。
+        - DRAW_FORUM_WEIGHTS: 论坛权重，格式 `论坛ID:权重,论坛ID:权重`，未列出的论坛权重为 1。
+        - DRAW_RECENCY_BIAS: 0~1，按“新帖优先”权重抽取的概率，默认 0（纯随机）。
+        - DRAW_RECENCY_HALF_LIFE_DAYS: 新帖权重的半衰期（天），默认 30。
+        """
+        try:
+            recent_size = int(os.getenv("DRAW_RECENT_EXCLUSION_SIZE", "50"))
+            recency_bias = min(1.0, max(0.0, float(os.getenv("DRAW_RECENCY_BIAS", "0"))))
+            half_life = float(os.getenv("DRAW_RECENCY_HALF_LIFE_DAYS", "30"))
+        except ValueError:
+            print("⚠️ 抽卡引擎的 .env 配置值无效，将使用默认值。")
+            recent_size, recency_bias, half_life = 50, 0.0, 30.0
+
+        forum_weights = {}
+        for item in os.getenv("DRAW_FORUM_WEIGHTS", "").split(','):
+            if not item.strip():
+                continue
+            try:
+                forum_id, weight = item.split(':')
+                forum_weights[int(forum_id.strip())] = float(weight.strip())
+            except ValueError:
+                print(f"⚠️ 无法解析 DRAW_FORUM_WEIGHTS 中的条目 '{item}'，已跳过。")
+
+        return cls(pool, recent_size=max(0, recent_size), forum_weights=forum_weights,
+                   recency_bias=recency_bias, recency_half_life_days=max(0.1, half_life))
+
+    async def draw(self, db, guild_id: int, user_id: int, forum_ids: list[int], k: int,
+                   exclude: Iterable[int] = ()) -> list[int]:
+        """
+        为用户抽取最多 k 个帖子，并记入其最近抽取记录。
+        exclude 为本次抽卡中已经尝试过的帖子（用于补抽），它们无论如何都不会被再次抽中。
+        """
+        key = (guild_id, user_id)
+        if self.recent.size > 0:
+            await self.recent.ensure_loaded(db, key)
+        recent = self.recent.get(key)
+        exclude = set(exclude)
+
+        chosen = self.pool.draw(guild_id, forum_ids, k, exclude=exclude.union(recent),
+                                forum_weights=self.forum_weights, recency_bias=self.recency_bias)
+        if len(chosen) < k and recent:
+            # 卡池太小，排除最近记录后不够抽：允许重复抽到最近看过的帖子
+            chosen += self.pool.draw(guild_id, forum_ids, k - len(chosen), exclude=exclude.union(chosen),
+                                     forum_weights=self.forum_weights, recency_bias=self.recency_bias)
+        self.recent.record(key, chosen)
+        return chosen
@@ -0,0 +1,288 @@
+# utils/forum_sync.py
+import asyncio
+import datetime
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import discord
+
+from .rate_limit import RequestBudget
+from .thread_pool import ThreadPool
+
+# Discord 单次请求最多返回 100 个归档帖子
+ARCHIVE_PAGE_SIZE = 100
+
+
+@dataclass(slots=True)
+class ForumSyncResult:
+    """单个论坛一次同步的统计。"""
+    forum_id: int
+    forum_name: str
+    scanned: int = 0
+    added: int = 0
+    duration: float = 0.0
+    skipped: bool = False  # 论坛在数据库中为空，等待手动全量同步
+    error: Optional[str] = None
+    done: bool = False
+
+
+ProgressFn = Callable[[ForumSyncResult], Awaitable[None]]
+
+
+class ForumSync:
+    """
+    论坛同步引擎。
+    - 多个论坛并发同步，所有论坛共享同一个 REST 请求预算（增量与全量同步都是如此）。
+    - 每个论坛在 sync_cursors 表中保存上次同步到的最新归档时间；
+      归档帖子按归档时间从新到旧分页返回，遇到游标之前的帖子即停止翻页。
+    - 每次同步的耗时、扫描数和新增数也写入 sync_cursors。
+    全量同步则按块写入（默认每 500 个帖子），并在同一个事务里更新 full_sync_checkpoints 断点，
+    中途崩溃或重启后从断点继续，内存中最多只保留一块数据。
+    """
+    def __init__(self, db, pool: ThreadPool, budget: RequestBudget, concurrency: int = 3, chunk_size: int = 500):
+        self.db = db
+        self.pool = pool
+        self.budget = budget
+        self.concurrency = max(1, concurrency)
+        self.chunk_size = max(1, chunk_size)
+
+    @classmethod
+    def from_env(cls, db, pool: ThreadPool) -> "ForumSync":
+        """
+        读取以下配置（均可选）：
+        - SYNC_REQUESTS_PER_MINUTE: 所有论坛共享的请求预算，默认 60。
+        - SYNC_FORUM_CONCURRENCY: 同时同步的论坛数，默认 3。
+        - FULL_SYNC_CHUNK_SIZE: 全量同步每写入多少个帖子保存一次断点，默认 500。
+        """
+        try:
+            requests_per_minute = float(os.getenv("SYNC_REQUESTS_PER_MINUTE", "60"))
+            concurrency = int(os.getenv("SYNC_FORUM_CONCURRENCY", "3"))
+            chunk_size = int(os.getenv("FULL_SYNC_CHUNK_SIZE", "500"))
+        except ValueError:
+            print("⚠️ 论坛同步的 .env 配置值无效，将使用默认值。")
+            requests_per_minute, concurrency, chunk_size = 60.0, 3, 500
+        return cls(db, pool, RequestBudget(requests_per_minute), concurrency, chunk_size)
+
+    async def archived_pages(self, forum: discord.ForumChannel, before=None) -> AsyncIterator[list[discord.Thread]]:
+        """
+        按归档时间从新到旧逐页获取归档帖子。翻页交给 discord.py 的迭代器（按 API 返回的 has_more 判断是否还有下一页），
+        这里只按 100 个一组取出，每组消耗一次请求预算（与迭代器每次请求的数量一致）。
+        """
+        page: list[discord.Thread] = []
+        await self.budget.acquire()
+        async for thread in forum.archived_threads(limit=None, before=before):
+            page.append(thread)
+            if len(page) >= ARCHIVE_PAGE_SIZE:
+                yield page
+                page = []
+                # 迭代器取下一个帖子时才会发起下一次请求
+                await self.budget.acquire()
+        if page:
+            yield page
+
+    async def store(self, rows: list[tuple[int, int, int]]) -> int:
+        """写入 threads 表并加入内存卡池，返回数据库中实际新增的行数。"""
+        if not rows:
+            return 0
+        added = await self.db.executemany("INSERT OR IGNORE INTO threads (thread_id, forum_id, guild_id) VALUES (?, ?, ?)", rows)
+        self.pool.add_rows(rows)
+        return added
+
+    async def save_cursor(self, forum: discord.ForumChannel, archive_ts: Optional[float], result: ForumSyncResult):
+        await self.db.execute(
+            "INSERT INTO sync_cursors (forum_id, guild_id, last_archive_ts, last_run_at, last_duration, last_scanned, last_added) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(forum_id) DO UPDATE SET last_archive_ts = excluded.last_archive_ts, last_run_at = excluded.last_run_at, "
+            "last_duration = excluded.last_duration, last_scanned = excluded.last_scanned, last_added = excluded.last_added",
+            (forum.id, forum.guild.id, archive_ts, time.time(), result.duration, result.scanned, result.added)
+        )
+
+    async def sync_forum(self, forum: discord.ForumChannel) -> ForumSyncResult:
+        """同步单个论坛：活跃帖子来自网关缓存，归档帖子只翻到上次的游标为止。"""
+        started = time.monotonic()
+        result = ForumSyncResult(forum.id, forum.name)
+        row = await self.db.fetchone("SELECT last_archive_ts FROM sync_cursors WHERE forum_id = ?", (forum.id,))
+        cursor = row[0] if row else None
+        if cursor is None:
+            has_threads = await self.db.fetchone("SELECT 1 FROM threads WHERE forum_id = ? LIMIT 1", (forum.id,))
+            if not has_threads:
+                result.skipped = True
+                return result
+            # 旧数据库还没有游标：完整扫描一次归档帖子，之后即可增量同步
+
+        newest = cursor
+        try:
+            # 置顶帖不进入卡池（与 on_thread_update 和卡池巡检的处理一致）
+            rows = [(thread.id, forum.id, forum.guild.id) for thread in forum.threads if not thread.flags.pinned]
+            result.scanned += len(rows)
+            result.added += await self.store(rows)
+
+            async for page in self.archived_pages(forum):
+                # 与游标归档时间相同的帖子也重新写入（INSERT OR IGNORE 会去重），以免漏掉同一时刻归档的帖子
+                fresh = [thread for thread in page if cursor is None or thread.archive_timestamp.timestamp() >= cursor]
+                if fresh:
+                    newest = max(newest or 0.0, fresh[0].archive_timestamp.timestamp())
+                    result.scanned += len(fresh)
+                    result.added += await self.store([(thread.id, forum.id, forum.guild.id) for thread in fresh])
+                if len(fresh) < len(page):
+                    # 已经翻到上次同步过的位置
+                    break
+        except discord.Forbidden:
+            result.error = "权限不足"
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+
+        result.duration = time.monotonic() - started
+        # 出错时保留旧游标，下一轮从原位置重新扫描，不会漏掉帖子
+        await self.save_cursor(forum, cursor if result.error else newest, result)
+        return result
+
+    async def _gather(self, forums: list[discord.ForumChannel], sync_fn) -> list[ForumSyncResult]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _run(forum):
+            async with semaphore:
+                return await sync_fn(forum)
+
+        return await asyncio.gather(*(_run(forum) for forum in forums))
+
+    async def sync_forums(self, forums: list[discord.ForumChannel]) -> list[ForumSyncResult]:
+        """并发同步多个论坛（并发数受 concurrency 限制），按传入顺序返回结果。"""
+        return await self._gather(forums, self.sync_forum)
+
+    # --- 全量同步 ---
+    async def begin_full_sync(self, forums: list[discord.ForumChannel], restart: bool = False) -> bool:
+        """
+        为一个服务器的一次全量同步登记断点（forums 都属于同一个服务器，其他服务器的断点不受影响）。
+        - 该服务器中不在 forums 里的未完成断点会被丢弃（论坛已移出配置或已被删除）。
+        - 若该服务器上一次全量同步仍有未完成的论坛，则保留其断点、为新加入的论坛补充断点并返回 True（继续上次的进度）。
+        - 否则（或 restart 为 True 时）把每个论坛的断点重置为从头开始，并返回 False。
+        """
+        if not forums:
+            return False
+        now = time.time()
+        guild_id = forums[0].guild.id
+        forum_ids = [forum.id for forum in forums]
+        placeholders = ",".join("?" * len(forum_ids))
+        rows = [(forum.id, guild_id, now) for forum in forums]
+
+        def _begin(con: sqlite3.Connection) -> bool:
+            con.execute(
+                f"DELETE FROM full_sync_checkpoints WHERE done = 0 AND guild_id = ? AND forum_id NOT IN ({placeholders})",
+                (guild_id, *forum_ids)
+            )
+            if not restart and con.execute("SELECT 1 FROM full_sync_checkpoints WHERE done = 0 AND guild_id = ? LIMIT 1", (guild_id,)).fetchone():
+                con.executemany("INSERT OR IGNORE INTO full_sync_checkpoints (forum_id, guild_id, started_at) VALUES (?, ?, ?)", rows)
+                return True
+            con.execute(f"DELETE FROM full_sync_checkpoints WHERE guild_id = ? AND forum_id NOT IN ({placeholders})", (guild_id, *forum_ids))
+            con.executemany(
+                "INSERT INTO full_sync_checkpoints (forum_id, guild_id, started_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(forum_id) DO UPDATE SET guild_id = excluded.guild_id, before_ts = NULL, newest_archive_ts = NULL, "
+                "scanned = 0, added = 0, done = 0, started_at = excluded.started_at",
+                rows
+            )
+            return False
+
+        return await self.db.transaction(_begin)
+
+    async def abandon_full_sync(self, forum_ids: list[int]):
+        """把无法继续的论坛断点标记为结束（论坛已删除或机器人无权访问），避免之后一直被当作未完成。断点以论坛ID为主键，只影响这些论坛。"""
+        if forum_ids:
+            await self.db.executemany("UPDATE full_sync_checkpoints SET done = 1 WHERE forum_id = ?", [(forum_id,) for forum_id in forum_ids])
+
+    async def unfinished_full_sync(self, guild_id: Optional[int] = None) -> list[int]:
+        """返回尚未完成全量同步的论坛ID；指定 guild_id 时只返回该服务器的（重启后不指定，恢复所有服务器的任务）。"""
+        if guild_id is None:
+            rows = await self.db.fetchall("SELECT forum_id FROM full_sync_checkpoints WHERE done = 0")
+        else:
+            rows = await self.db.fetchall("SELECT forum_id FROM full_sync_checkpoints WHERE done = 0 AND guild_id = ?", (guild_id,))
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _write_chunk(con: sqlite3.Connection, forum_id: int, rows: list[tuple[int, int, int]],
+                     before_ts: Optional[float], newest_ts: Optional[float]) -> int:
+        # 帖子与断点在同一个事务中提交：断点之前的帖子一定已经落盘
+        added = con.executemany("INSERT OR IGNORE INTO threads (thread_id, forum_id, guild_id) VALUES (?, ?, ?)", rows).rowcount
+        con.execute(
+            "UPDATE full_sync_checkpoints SET before_ts = ?, newest_archive_ts = ?, "
+            "scanned = scanned + ?, added = added + ? WHERE forum_id = ?",
+            (before_ts, newest_ts, len(rows), added, forum_id)
+        )
+        return added
+
+    @staticmethod
+    def _finish(con: sqlite3.Connection, forum_id: int, guild_id: int, newest_ts: Optional[float], result: ForumSyncResult):
+        con.execute("UPDATE full_sync_checkpoints SET done = 1 WHERE forum_id = ?", (forum_id,))
+        # 全量同步完成后，增量同步只需要从最新的归档时间继续
+        con.execute(
+            "INSERT INTO sync_cursors (forum_id, guild_id, last_archive_ts, last_run_at, last_duration, last_scanned, last_added) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(forum_id) DO UPDATE SET last_archive_ts = MAX(COALESCE(last_archive_ts, 0), COALESCE(excluded.last_archive_ts, 0)), "
+            "last_run_at = excluded.last_run_at, last_duration = excluded.last_duration, "
+            "last_scanned = excluded.last_scanned, last_added = excluded.last_added",
+            (forum_id, guild_id, newest_ts, time.time(), result.duration, result.scanned, result.added)
+        )
+
+    async def full_sync_forum(self, forum: discord.ForumChannel, on_progress: Optional[ProgressFn] = None) -> ForumSyncResult:
+        """从断点开始全量同步单个论坛，每写入一块数据就保存断点并回调 on_progress。"""
+        started = time.monotonic()
+        row = await self.db.fetchone(
+            "SELECT before_ts, newest_archive_ts, scanned, added, done FROM full_sync_checkpoints WHERE forum_id = ?", (forum.id,)
+        )
+        before_ts, newest_ts, scanned, added, done = row if row else (None, None, 0, 0, 0)
+        result = ForumSyncResult(forum.id, forum.name, scanned=scanned, added=added, done=bool(done))
+        if result.done:
+            return result
+
+        async def _flush(rows, position):
+            chunk_added = await self.db.transaction(self._write_chunk, forum.id, rows, position, newest_ts)
+            self.pool.add_rows(rows)
+            result.scanned += len(rows)
+            result.added += chunk_added
+            if on_progress:
+                await on_progress(result)
+
+        try:
+            buffer: list[tuple[int, int, int]] = []
+            if before_ts is None and scanned == 0:
+                # 全新开始：先写入活跃帖子（来自网关缓存，不消耗请求），置顶帖不进入卡池
+                buffer = [(thread.id, forum.id, forum.guild.id) for thread in forum.threads if not thread.flags.pinned]
+
+            # before 是开区间：从断点略往后一点开始，使与断点同一时刻归档的帖子不会被跳过（重复的帖子由 INSERT OR IGNORE 去重）
+            before = None
+            if before_ts is not None:
+                before = datetime.datetime.fromtimestamp(before_ts, tz=datetime.timezone.utc) + datetime.timedelta(milliseconds=1)
+            position = before_ts
+            async for page in self.archived_pages(forum, before=before):
+                if newest_ts is None:
+                    newest_ts = page[0].archive_timestamp.timestamp()
+                buffer.extend((thread.id, forum.id, forum.guild.id) for thread in page)
+                position = page[-1].archive_timestamp.timestamp()
+                if len(buffer) >= self.chunk_size:
+                    await _flush(buffer, position)
+                    buffer = []
+            if buffer:
+                await _flush(buffer, position)
+
+            result.duration = time.monotonic() - started
+            await self.db.transaction(self._finish, forum.id, forum.guild.id, newest_ts, result)
+            result.done = True
+        except (discord.Forbidden, discord.NotFound) as e:
+            # 重试也不会成功：结束这个论坛的断点，以免之后的全量同步一直停留在“继续上次进度”
+            result.error = "权限不足" if isinstance(e, discord.Forbidden) else "论坛不存在"
+            try:
+                await self.abandon_full_sync([forum.id])
+                result.done = True
+            except Exception as db_error:
+                print(f"[论坛同步] 结束论坛 {forum.id} 的全量同步断点失败: {db_error}")
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+        result.duration = time.monotonic() - started
+        return result
+
+    async def full_sync_forums(self, forums: list[discord.ForumChannel], on_progress: Optional[ProgressFn] = None) -> list[ForumSyncResult]:
+        """并发地从断点全量同步多个论坛，按传入顺序返回结果。"""
+        return await self._gather(forums, lambda forum: self.full_sync_forum(forum, on_progress))
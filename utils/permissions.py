@@ -0,0 +1,127 @@
+# utils/permissions.py
+import os
+import time
+from typing import Optional
+
+import discord
+from discord import app_commands
+from dotenv import dotenv_values
+
+# 由本模块统一解析的身份组配置
+ADMIN_ROLES = "ADMIN_ROLE_IDS"
+PRESET_CREATOR_ROLES = "PRESET_CREATOR_ROLE_IDS"
+PRESET_USER_ROLES = "PRESET_USER_ROLE_IDS"
+ROLE_SETTINGS = (ADMIN_ROLES, PRESET_CREATOR_ROLES, PRESET_USER_ROLES)
+
+
+class RolesNotConfigured(app_commands.CheckFailure):
+    """对应的身份组配置为空。"""
+    def __init__(self, setting: str):
+        super().__init__(f"{setting} 未配置")
+        self.setting = setting
+
+
+class MissingRoles(app_commands.CheckFailure):
+    """用户没有任何一个被允许的身份组。"""
+    def __init__(self, setting: str):
+        super().__init__(f"缺少 {setting} 中的身份组")
+        self.setting = setting
+
+
+class RolePermissions:
+    """
+    身份组权限服务。
+    - 启动时把 ROLE_SETTINGS 中的逗号分隔列表解析为 frozenset，之后每次检查只做一次集合运算。
+    - 每隔 reload_interval 秒最多检查一次 .env 的修改时间，文件有变化时重新解析（无需重启）；
+      .env 存在时以其内容为准（删除某项即清空该配置），只有 .env 不存在时才读取进程环境变量。
+    """
+    def __init__(self, dotenv_path: str = ".env", reload_interval: float = 5.0):
+        self.dotenv_path = dotenv_path
+        self.reload_interval = reload_interval
+        self._roles: dict[str, frozenset[int]] = {}
+        self._mtime: Optional[int] = None
+        self._checked_at = time.monotonic()
+        self.reload()
+
+    @staticmethod
+    def _parse(setting: str, value: str) -> Optional[frozenset[int]]:
+        try:
+            return frozenset(int(rid.strip()) for rid in value.split(',') if rid.strip())
+        except ValueError:
+            print(f"⚠️ {setting} 中包含无效的身份组ID，将继续使用之前的配置。")
+            return None
+
+    def reload(self):
+        """重新读取 .env 并解析所有身份组配置。"""
+        try:
+            self._mtime = os.stat(self.dotenv_path).st_mtime_ns
+            file_values = dotenv_values(self.dotenv_path)
+        except OSError:
+            self._mtime, file_values = None, None
+        for setting in ROLE_SETTINGS:
+            if file_values is None:
+                # 没有 .env 文件时才使用进程环境变量
+                value = os.getenv(setting, "")
+            elif file_values.get(setting) is None:
+                # .env 中删除了这一项：视为未配置，同时清除之前写入的环境变量
+                value = ""
+                os.environ.pop(setting, None)
+            else:
+                value = file_values[setting]
+                # 保持与 os.getenv 的读取结果一致
+                os.environ[setting] = value
+            roles = self._parse(setting, value)
+            if roles is not None:
+                self._roles[setting] = roles
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.dotenv_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            print("[权限] 检测到 .env 已修改，正在重新加载身份组配置。")
+            self.reload()
+
+    def roles(self, setting: str) -> frozenset[int]:
+        """返回某项配置允许的身份组ID集合（未配置时为空集合）。"""
+        self._maybe_reload()
+        return self._roles.get(setting, frozenset())
+
+    def allows(self, member: discord.abc.User, setting: str) -> bool:
+        """成员是否拥有该配置中的任意一个身份组。"""
+        return not self.roles(setting).isdisjoint(role.id for role in getattr(member, 'roles', ()))
+
+
+def require_roles(setting: str):
+    """
+    app_commands.check：要求用户拥有 setting 中的任意一个身份组。
+    不满足时抛出 RolesNotConfigured / MissingRoles，由 respond_to_check_failure 统一回复。
+    """
+    def predicate(interaction: discord.Interaction) -> bool:
+        roles = interaction.client.permissions.roles(setting)
+        if not roles:
+            raise RolesNotConfigured(setting)
+        if roles.isdisjoint(role.id for role in getattr(interaction.user, 'roles', ())):
+            raise MissingRoles(setting)
+        return True
+    return app_commands.check(predicate)
+
+
+async def respond_to_check_failure(interaction: discord.Interaction, error: app_commands.AppCommandError) -> bool:
+    """回复权限检查失败的交互；不是权限错误时返回 False，交给默认的错误处理。"""
+    if isinstance(error, RolesNotConfigured):
+        message = f"❌ **配置错误**：机器人管理员尚未在 `.env` 文件中配置 `{error.setting}`。"
+    elif isinstance(error, MissingRoles):
+        message = "🚫 **权限不足**：只有拥有特定身份组的用户才能执行此操作。"
+    else:
+        return False
+    if interaction.response.is_done():
+        await interaction.followup.send(message, ephemeral=True)
+    else:
+        await interaction.response.send_message(message, ephemeral=True)
+    return True
@@ -0,0 +1,123 @@
+# utils/preset_cache.py
+import asyncio
+import bisect
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Optional
+
+
+class GuildPresets:
+    """单个服务器的预设消息：按名称（忽略大小写）排序的列表用于前缀检索，字典用于按名称取内容。"""
+    def __init__(self, rows: list[tuple[str, str]] = ()):
+        self.contents: dict[str, str] = dict(rows)
+        self.names: list[str] = sorted(self.contents, key=str.lower)
+        self._keys: list[str] = [name.lower() for name in self.names]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def get(self, name: str) -> Optional[str]:
+        return self.contents.get(name)
+
+    def prefix(self, prefix: str, limit: int = 25) -> list[str]:
+        """返回以 prefix 开头（忽略大小写）的前 limit 个名称，O(log n + limit)。"""
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self._keys, prefix)
+        result = []
+        for i in range(start, len(self._keys)):
+            if len(result) >= limit or not self._keys[i].startswith(prefix):
+                break
+            result.append(self.names[i])
+        return result
+
+    def _position(self, name: str) -> int:
+        """名称在有序列表中的下标，不存在时返回 -1。"""
+        key = name.lower()
+        i = bisect.bisect_left(self._keys, key)
+        while i < len(self._keys) and self._keys[i] == key:
+            if self.names[i] == name:
+                return i
+            i += 1
+        return -1
+
+    def set(self, name: str, content: str):
+        if name not in self.contents:
+            i = bisect.bisect_right(self._keys, name.lower())
+            self._keys.insert(i, name.lower())
+            self.names.insert(i, name)
+        self.contents[name] = content
+
+    def delete(self, name: str):
+        if self.contents.pop(name, None) is None:
+            return
+        i = self._position(name)
+        if i >= 0:
+            del self._keys[i]
+            del self.names[i]
+
+
+class PresetCache:
+    """
+    按服务器缓存的预设消息（名称与内容）。
+    - 首次访问某个服务器时从数据库整体加载，之后的下拉菜单、按钮、自动补全和发送都直接读内存。
+    - 添加 / 覆盖 / 删除 / 导入时同步写入（write-through），保证与数据库一致。
+    - 最多缓存 max_guilds 个服务器，按 LRU 淘汰。
+    """
+    def __init__(self, db, max_guilds: int = 50):
+        self.db = db
+        self.max_guilds = max_guilds
+        self._guilds: OrderedDict[int, GuildPresets] = OrderedDict()
+        self._locks: dict[int, asyncio.Lock] = {}
+        # 每次写入都会递增；加载期间发生写入时丢弃加载结果，避免缓存过期的数据
+        self._generations: dict[int, int] = {}
+
+    @classmethod
+    def from_env(cls, db) -> "PresetCache":
+        """读取 PRESET_CACHE_MAX_GUILDS（内存中最多缓存的服务器数，默认 50）。"""
+        try:
+            max_guilds = int(os.getenv("PRESET_CACHE_MAX_GUILDS", "50"))
+        except ValueError:
+            print("⚠️ PRESET_CACHE_MAX_GUILDS 值无效，将使用默认值 50。")
+            max_guilds = 50
+        return cls(db, max(1, max_guilds))
+
+    @staticmethod
+    def _load_rows(con: sqlite3.Connection, guild_id: int) -> list[tuple[str, str]]:
+        return con.execute("SELECT name, content FROM preset_messages WHERE guild_id = ?", (guild_id,)).fetchall()
+
+    async def get(self, guild_id: int) -> GuildPresets:
+        presets = self._guilds.get(guild_id)
+        if presets is not None:
+            self._guilds.move_to_end(guild_id)
+            return presets
+        async with self._locks.setdefault(guild_id, asyncio.Lock()):
+            presets = self._guilds.get(guild_id)
+            if presets is not None:
+                return presets
+            generation = self._generations.get(guild_id, 0)
+            presets = GuildPresets(await self.db.read(self._load_rows, guild_id))
+            if self._generations.get(guild_id, 0) == generation:
+                self._guilds[guild_id] = presets
+                while len(self._guilds) > self.max_guilds:
+                    self._guilds.popitem(last=False)
+            return presets
+
+    def _touch(self, guild_id: int) -> Optional[GuildPresets]:
+        self._generations[guild_id] = self._generations.get(guild_id, 0) + 1
+        return self._guilds.get(guild_id)
+
+    def upsert(self, guild_id: int, name: str, content: str):
+        presets = self._touch(guild_id)
+        if presets is not None:
+            presets.set(name, content)
+
+    def remove(self, guild_id: int, name: str):
+        presets = self._touch(guild_id)
+        if presets is not None:
+            presets.delete(name)
+
+    def invalidate(self, guild_id: int):
+        """丢弃某个服务器的缓存（例如大批量导入后），下次访问时从数据库重新加载。"""
+        self._touch(guild_id)
+        self._guilds.pop(guild_id, None)
@@ -0,0 +1,326 @@
+# utils/preset_index.py
+import asyncio
+import functools
+import heapq
+import math
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+import jieba
+from thefuzz import fuzz, process
+
+NAME_WEIGHT = 10  # 名称中匹配，权重极高
+CONTENT_WEIGHT = 1  # 内容中匹配，权重较低
+
+# BM25 参数：名称中的词频按 NAME_BOOST 倍计入（BM25F 的简化形式）
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_NAME_BOOST = 3.0
+
+
+# 超过这个长度的查询文本在线程池中分词，避免长消息占用事件循环
+OFFLOAD_QUERY_LENGTH = 200
+
+_jieba_ready = threading.Event()
+
+
+def warm_up_jieba():
+    """加载 jieba 词典（阻塞数秒）。应在后台线程中调用，完成后 is_jieba_ready() 返回 True。"""
+    if _jieba_ready.is_set():
+        return
+    started = time.monotonic()
+    jieba.initialize()
+    _jieba_ready.set()
+    print(f"[预设消息] jieba 词典加载完成，耗时 {time.monotonic() - started:.1f} 秒。")
+
+
+def start_jieba_warm_up():
+    """在后台守护线程中预热 jieba，避免首次检索时在交互处理中加载词典。"""
+    if not _jieba_ready.is_set():
+        threading.Thread(target=warm_up_jieba, name="jieba-warm-up", daemon=True).start()
+
+
+def is_jieba_ready() -> bool:
+    return _jieba_ready.is_set()
+
+
+def tokenize(text: str) -> list[str]:
+    """用 jieba 的搜索引擎模式分词，返回小写、去掉空白后的词元列表。"""
+    return [token.lower() for token in jieba.cut_for_search(text) if token.strip()]
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_query_tokens(text: str) -> frozenset[str]:
+    return frozenset(tokenize(text))
+
+
+async def tokenize_query(text: str) -> frozenset[str]:
+    """
+    查询文本 -> 词元集合，结果按 LRU 缓存（同一条消息被反复检索时无需重新分词）。
+    词典尚未加载完成或文本较长时在线程池中分词，不阻塞事件循环。
+    """
+    if is_jieba_ready() and len(text) <= OFFLOAD_QUERY_LENGTH:
+        return _cached_query_tokens(text)
+    return await asyncio.to_thread(_cached_query_tokens, text)
+
+
+# --- FTS5 全文检索 ---
+# preset_messages_fts 中保存的是 jieba 分词后以空格连接的文本，FTS5 的 unicode61 分词器按空格切分即可得到中文词元。
+def segment(text: Optional[str]) -> str:
+    """供 SQL 触发器调用的分词函数：jieba_segment(text)。"""
+    return " ".join(tokenize(text)) if text else ""
+
+
+def register_sql_functions(con: sqlite3.Connection):
+    """在每条数据库连接上注册 jieba_segment，供 FTS 触发器使用（通过 Database.add_connection_hook 注册）。"""
+    con.create_function("jieba_segment", 1, segment, deterministic=True)
+
+
+def init_fts(con: sqlite3.Connection):
+    """创建预设消息的 FTS5 镜像表与同步触发器；首次创建时回填已有的预设。"""
+    exists = con.execute("SELECT 1 FROM sqlite_master WHERE name = 'preset_messages_fts'").fetchone()
+    con.execute("CREATE VIRTUAL TABLE IF NOT EXISTS preset_messages_fts USING fts5(name, content)")
+    con.execute('''
+        CREATE TRIGGER IF NOT EXISTS preset_messages_fts_insert AFTER INSERT ON preset_messages BEGIN
+            INSERT INTO preset_messages_fts (rowid, name, content) VALUES (new.id, jieba_segment(new.name), jieba_segment(new.content));
+        END
+    ''')
+    con.execute('''
+        CREATE TRIGGER IF NOT EXISTS preset_messages_fts_delete AFTER DELETE ON preset_messages BEGIN
+            DELETE FROM preset_messages_fts WHERE rowid = old.id;
+        END
+    ''')
+    con.execute('''
+        CREATE TRIGGER IF NOT EXISTS preset_messages_fts_update AFTER UPDATE OF name, content ON preset_messages BEGIN
+            UPDATE preset_messages_fts SET name = jieba_segment(new.name), content = jieba_segment(new.content) WHERE rowid = new.id;
+        END
+    ''')
+    if not exists:
+        con.execute(
+            "INSERT INTO preset_messages_fts (rowid, name, content) "
+            "SELECT id, jieba_segment(name), jieba_segment(content) FROM preset_messages"
+        )
+
+
+def fts_query(text: str, *, names_only: bool = False, any_term: bool = False) -> Optional[str]:
+    """
+    把用户输入转换为 FTS5 查询表达式：精确模式分词后每个词作为一个短语，最后一个词按前缀匹配（适合自动补全）。
+    any_term 为 True 时用 OR 连接，否则用 AND。没有可检索的词时返回 None。
+    """
+    terms = [token.lower() for token in jieba.cut(text) if any(ch.isalnum() for ch in token)]
+    if not terms:
+        return None
+    phrases = ['"' + term.replace('"', '""') + '"' for term in terms]
+    phrases[-1] += "*"
+    expression = (" OR " if any_term else " AND ").join(phrases)
+    return f"name : ({expression})" if names_only else expression
+
+
+async def fts_search(db, guild_id: int, text: str, *, names_only: bool = False, limit: int = 25) -> list[str]:
+    """
+    通过 FTS5 检索预设名称，按 bm25 相关度排序（名称权重远高于内容），最多返回 limit 个。
+    输入为空时按名称顺序返回前 limit 个；所有词同时命中的结果为空时，退回到任意词命中。
+    """
+    if not text.strip():
+        rows = await db.fetchall("SELECT name FROM preset_messages WHERE guild_id = ? ORDER BY name LIMIT ?", (guild_id, limit))
+        return [row[0] for row in rows]
+
+    sql = (
+        "SELECT p.name FROM preset_messages_fts f JOIN preset_messages p ON p.id = f.rowid "
+        "WHERE preset_messages_fts MATCH ? AND p.guild_id = ? "
+        "ORDER BY bm25(preset_messages_fts, 10.0, 1.0) LIMIT ?"
+    )
+    for any_term in (False, True):
+        if is_jieba_ready():
+            query = fts_query(text, names_only=names_only, any_term=any_term)
+        else:
+            query = await asyncio.to_thread(fts_query, text, names_only=names_only, any_term=any_term)
+        if query is None:
+            return []
+        rows = await db.fetchall(sql, (query, guild_id, limit))
+        if rows:
+            return [row[0] for row in rows]
+    return []
+
+
+class GuildPresetIndex:
+    """
+    单个服务器的预设消息倒排索引。
+    postings: 词元 -> {预设ID: (在名称中出现的次数, 在内容中出现的次数)}
+    检索时只访问查询词对应的倒排表，不再遍历所有预设。
+    """
+    def __init__(self):
+        self.postings: dict[str, dict[int, tuple[int, int]]] = {}
+        self.names: dict[int, str] = {}  # 预设ID -> 名称
+        self.ids: dict[str, int] = {}  # 名称 -> 预设ID
+        self._doc_terms: dict[int, tuple[str, ...]] = {}  # 预设ID -> 出现过的词元，用于删除
+        # 名称的三元组索引：三元组 -> 预设ID 集合，用于为模糊匹配预选候选
+        self.trigrams: dict[str, set[int]] = {}
+        # BM25 所需的文档长度（名称按 BM25_NAME_BOOST 加权后的词元数）；文档频率即倒排表的长度
+        self.doc_lengths: dict[int, float] = {}
+        self.total_length = 0.0
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @staticmethod
+    def analyze(name: str, content: str) -> tuple[Counter, Counter]:
+        """对名称和内容分词计数（纯计算，可以在线程池中执行）。"""
+        return Counter(tokenize(name)), Counter(tokenize(content))
+
+    def add(self, preset_id: int, name: str, content: str, analyzed: Optional[tuple[Counter, Counter]] = None):
+        """添加或替换一个预设（覆盖时会先移除旧的倒排项）。analyzed 为 analyze 的结果，省略时当场分词。"""
+        if preset_id in self.names:
+            self.remove(preset_id)
+        name_counts, content_counts = analyzed or self.analyze(name, content)
+        terms = tuple(name_counts.keys() | content_counts.keys())
+        for term in terms:
+            self.postings.setdefault(term, {})[preset_id] = (name_counts[term], content_counts[term])
+        self.names[preset_id] = name
+        self.ids[name] = preset_id
+        self._doc_terms[preset_id] = terms
+        for gram in self._name_trigrams(name):
+            self.trigrams.setdefault(gram, set()).add(preset_id)
+        length = BM25_NAME_BOOST * sum(name_counts.values()) + sum(content_counts.values())
+        self.doc_lengths[preset_id] = length
+        self.total_length += length
+
+    def remove(self, preset_id: int):
+        name = self.names.pop(preset_id, None)
+        if name is None:
+            return
+        self.ids.pop(name, None)
+        self.total_length -= self.doc_lengths.pop(preset_id, 0.0)
+        for gram in self._name_trigrams(name):
+            ids = self.trigrams.get(gram)
+            if ids is not None:
+                ids.discard(preset_id)
+                if not ids:
+                    del self.trigrams[gram]
+        for term in self._doc_terms.pop(preset_id, ()):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(preset_id, None)
+                if not posting:
+                    del self.postings[term]
+
+    @staticmethod
+    def _name_trigrams(text: str) -> set[str]:
+        # 与 pg_trgm 相同，首尾补空格，使短名称（如两个汉字）也能产生三元组
+        padded = f"  {text.lower()} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def fuzzy_names(self, query: str, *, limit: int = 25, max_candidates: int = 50, score_cutoff: int = 60) -> list[tuple[str, int]]:
+        """
+        容错的名称匹配：先用三元组索引预选共享三元组最多的 max_candidates 个名称，
+        只对这些候选计算 fuzz.WRatio，返回 [(预设名称, 分数), ...]（从高到低）。
+        """
+        counts: Counter = Counter()
+        for gram in self._name_trigrams(query):
+            counts.update(self.trigrams.get(gram, ()))
+        candidates = [self.names[preset_id] for preset_id, _ in counts.most_common(max_candidates)]
+        if not candidates:
+            return []
+        return process.extractBests(query, candidates, scorer=fuzz.WRatio, score_cutoff=score_cutoff, limit=limit)
+
+    def score(self, keywords: Iterable[str]) -> dict[str, int]:
+        """按“名称命中 +10、内容命中 +1”的规则计分，返回 {预设名称: 分数}（只包含命中的预设）。"""
+        scores: dict[int, int] = {}
+        for keyword in set(keywords):
+            for preset_id, (name_tf, content_tf) in self.postings.get(keyword, {}).items():
+                scores[preset_id] = scores.get(preset_id, 0) + (NAME_WEIGHT if name_tf else 0) + (CONTENT_WEIGHT if content_tf else 0)
+        return {self.names[preset_id]: score for preset_id, score in scores.items()}
+
+    def bm25(self, keywords: Iterable[str], k: int = 25) -> list[tuple[str, float]]:
+        """按 BM25 计分，用堆取出分数最高的 k 个预设，返回 [(预设名称, 分数), ...]（从高到低）。"""
+        n = len(self.names)
+        if n == 0:
+            return []
+        avg_length = self.total_length / n or 1.0
+        scores: dict[int, float] = {}
+        for keyword in set(keywords):
+            posting = self.postings.get(keyword)
+            if not posting:
+                continue
+            df = len(posting)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for preset_id, (name_tf, content_tf) in posting.items():
+                tf = BM25_NAME_BOOST * name_tf + content_tf
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[preset_id] / avg_length)
+                scores[preset_id] = scores.get(preset_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.names[preset_id], score) for preset_id, score in top]
+
+
+class PresetSearchIndex:
+    """
+    按服务器缓存的预设倒排索引集合。
+    - 首次检索某个服务器时从数据库构建（分词在线程池中执行，不阻塞事件循环）。
+    - 添加 / 覆盖 / 删除 / 导入预设时增量更新；尚未构建的服务器无需处理。
+    """
+    def __init__(self, db):
+        self.db = db
+        self._guilds: dict[int, GuildPresetIndex] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        # 每次写入都会递增；构建期间发生写入时丢弃构建结果，避免缓存过期的索引
+        self._generations: dict[int, int] = {}
+
+    @staticmethod
+    def _load_rows(con: sqlite3.Connection, guild_id: int) -> list[tuple[int, str, str]]:
+        return con.execute("SELECT id, name, content FROM preset_messages WHERE guild_id = ?", (guild_id,)).fetchall()
+
+    @staticmethod
+    def _build(rows: list[tuple[int, str, str]]) -> GuildPresetIndex:
+        index = GuildPresetIndex()
+        for preset_id, name, content in rows:
+            index.add(preset_id, name, content)
+        return index
+
+    async def get(self, guild_id: int) -> GuildPresetIndex:
+        index = self._guilds.get(guild_id)
+        if index is not None:
+            return index
+        async with self._locks.setdefault(guild_id, asyncio.Lock()):
+            index = self._guilds.get(guild_id)
+            if index is not None:
+                return index
+            generation = self._generations.get(guild_id, 0)
+            rows = await self.db.read(self._load_rows, guild_id)
+            index = await asyncio.to_thread(self._build, rows)
+            if self._generations.get(guild_id, 0) == generation:
+                self._guilds[guild_id] = index
+            return index
+
+    def _touch(self, guild_id: int) -> GuildPresetIndex | None:
+        self._generations[guild_id] = self._generations.get(guild_id, 0) + 1
+        return self._guilds.get(guild_id)
+
+    async def upsert(self, guild_id: int, preset_id: int, name: str, content: str):
+        index = self._touch(guild_id)
+        if index is not None:
+            # 分词放到线程池中，只在事件循环中修改倒排表
+            analyzed = await asyncio.to_thread(GuildPresetIndex.analyze, name, content)
+            if self._guilds.get(guild_id) is index:
+                index.add(preset_id, name, content, analyzed)
+
+    async def upsert_many(self, guild_id: int, rows: list[tuple[int, str, str]]):
+        """批量添加或替换 (预设ID, 名称, 内容)，所有分词在一次线程池调用中完成。"""
+        index = self._touch(guild_id)
+        if index is None or not rows:
+            return
+        analyzed = await asyncio.to_thread(lambda: [GuildPresetIndex.analyze(name, content) for _, name, content in rows])
+        if self._guilds.get(guild_id) is index:
+            for (preset_id, name, content), counts in zip(rows, analyzed):
+                index.add(preset_id, name, content, counts)
+
+    def remove(self, guild_id: int, name: str):
+        index = self._touch(guild_id)
+        if index is not None and name in index.ids:
+            index.remove(index.ids[name])
+
+    def invalidate(self, guild_id: int):
+        self._touch(guild_id)
+        self._guilds.pop(guild_id, None)
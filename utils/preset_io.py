@@ -0,0 +1,284 @@
+# utils/preset_io.py
+import csv
+import datetime
+import gzip
+import io
+import json
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Optional, TextIO
+
+# 导入模式：skip 跳过已存在的名称；overwrite 覆盖已存在的名称；dry-run 只统计差异，不写入
+IMPORT_MODES = ("skip", "overwrite", "dry-run")
+MAX_REPORTED_ERRORS = 10
+# 导入时每多少个预设写入一次（每块只查询这些名称是否已存在），内存占用与文件大小无关
+IMPORT_CHUNK_SIZE = 500
+# 最多记录多少条实际写入的预设用于更新内存缓存；超出时由调用方让缓存整体失效
+MAX_TRACKED_WRITES = 5000
+
+# 导出格式；导出的每条记录都带有 name 与 value，可以直接用“导入json”命令导回
+EXPORT_FORMATS = ("json", "jsonl", "csv")
+EXPORT_FIELDS = ("name", "value", "guild_id", "creator_id", "id", "updated_at")
+IMPORT_EXTENSIONS = ('.json', '.jsonl', '.csv', '.json.gz', '.jsonl.gz', '.csv.gz')
+
+
+def iter_json_items(stream: TextIO, chunk_size: int = 64 * 1024) -> Iterator[Any]:
+    """
+    从文本流中逐块读取并逐个解析 JSON 条目，内存中只保留当前块和正在解析的条目。
+    支持顶层数组 `[{...}, {...}]`，也支持每行一个对象的 JSON Lines。
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def _fill() -> bool:
+        # 丢弃已解析的部分并追加下一块，返回是否读到了新内容
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def _skip(separators: str) -> bool:
+        # 跳过空白与分隔符，返回后面是否还有内容
+        nonlocal pos
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] in separators):
+                pos += 1
+            if pos < len(buf) or not _fill():
+                return pos < len(buf)
+
+    def _decode() -> Any:
+        # 条目被块边界截断时读入更多内容再试；数字可能在块边界处被截断（如 "1." 或 "12"），解析到缓冲区末尾或紧跟数字字符时也要再读一块
+        nonlocal pos
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if _fill():
+                    continue
+                raise
+            if (end == len(buf) or buf[end] in "0123456789.eE+-") and _fill():
+                continue
+            pos = end
+            return item
+
+    _fill()
+    if buf.startswith("\ufeff"):  # 跳过 UTF-8 BOM
+        pos = 1
+    if _skip("") and buf[pos] == '[':
+        pos += 1
+        if not _skip(""):
+            raise ValueError("JSON 数组没有以 ] 结束")
+        if buf[pos] == ']':
+            return
+        while True:
+            yield _decode()
+            # 每个条目之后必须是逗号或数组结束
+            if not _skip(""):
+                raise ValueError("JSON 数组没有以 ] 结束")
+            if buf[pos] == ']':
+                return
+            if buf[pos] != ',':
+                raise ValueError(f"JSON 数组的条目之间缺少逗号（遇到了 `{buf[pos:pos + 20]}`）")
+            pos += 1
+            if not _skip(""):
+                raise ValueError("JSON 数组没有以 ] 结束")
+    while _skip(""):
+        yield _decode()
+
+
+@dataclass(slots=True)
+class ImportResult:
+    mode: str
+    added: int = 0
+    updated: int = 0
+    skipped: int = 0  # 名称已存在且未覆盖
+    unchanged: int = 0  # 覆盖模式下内容完全相同
+    errors: list[str] = field(default_factory=list)
+    written: list[tuple[int, str, str]] = field(default_factory=list)  # 实际写入的 (id, name, content)，最多 MAX_TRACKED_WRITES 条
+    written_truncated: bool = False  # 写入数超过 MAX_TRACKED_WRITES，written 不完整
+    duration: float = 0.0
+
+
+def iter_import_items(filename: str, data: bytes) -> Iterator[Any]:
+    """
+    按文件扩展名解析导入文件：.json / .jsonl / .csv，以及它们的 .gz 压缩版本。
+    解压与解码都是边读边做的，不会在内存中生成完整的解压内容或文本。
+    """
+    filename = filename.lower()
+    raw: io.BufferedIOBase = io.BytesIO(data)
+    if filename.endswith('.gz'):
+        raw = gzip.GzipFile(fileobj=raw)
+        filename = filename[:-3]
+    stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+    if filename.endswith('.csv'):
+        return csv.DictReader(stream)
+    if filename.endswith('.jsonl'):
+        return (json.loads(line) for line in stream if line.strip())
+    return iter_json_items(stream)
+
+
+def iter_presets(items: Iterable[Any], result: ImportResult) -> Iterator[tuple[str, str]]:
+    """
+    逐条校验条目，产出 (名称, 内容)；无效条目记入 result.errors。
+    内容字段为 value；也接受旧版导出脚本使用的 content。
+    """
+    for item in items:
+        if isinstance(item, dict) and 'value' not in item and 'content' in item:
+            item = {**item, 'value': item['content']}
+        if not isinstance(item, dict) or 'name' not in item or 'value' not in item:
+            result.errors.append(f"无效条目: `{str(item)[:100]}` (缺少 name 或 value)")
+            continue
+        name, content = item['name'], item['value']
+        if not isinstance(name, str) or not isinstance(content, str) or not name.strip():
+            result.errors.append(f"无效条目: `{str(item)[:100]}` (name 与 value 必须是非空字符串)")
+            continue
+        yield name, content
+
+
+def _apply_chunk(con: sqlite3.Connection, guild_id: int, creator_id: int, chunk: dict[str, str],
+                 seen: dict[str, bool], result: ImportResult):
+    names = list(chunk)
+    placeholders = ",".join("?" * len(names))
+    existing = dict(con.execute(
+        f"SELECT name, content FROM preset_messages WHERE guild_id = ? AND name IN ({placeholders})", (guild_id, *names)
+    ))
+    new_rows, changed_rows, rewritten_rows = [], [], []
+    for name, content in chunk.items():
+        if name in seen:
+            # 文件中重复的名称以最后一次为准，不重复计数；之前被跳过的名称仍然跳过
+            if seen[name]:
+                rewritten_rows.append((guild_id, name, content, creator_id))
+            continue
+        if name not in existing:
+            new_rows.append((guild_id, name, content, creator_id))
+            seen[name] = True
+        elif result.mode == "skip":
+            result.skipped += 1
+            seen[name] = False
+        elif existing[name] == content:
+            result.unchanged += 1
+            seen[name] = False
+        else:
+            changed_rows.append((guild_id, name, content, creator_id))
+            seen[name] = result.mode == "overwrite"
+    result.added += len(new_rows)
+    result.updated += len(changed_rows)
+
+    if result.mode == "dry-run":
+        return
+
+    to_write = new_rows + (changed_rows if result.mode == "overwrite" else []) + rewritten_rows
+    if not to_write:
+        return
+    con.executemany(
+        "INSERT INTO preset_messages (guild_id, name, content, creator_id) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(guild_id, name) DO UPDATE SET content = excluded.content, creator_id = excluded.creator_id",
+        to_write
+    )
+    if result.written_truncated:
+        return
+    written_names = [row[1] for row in to_write]
+    placeholders = ",".join("?" * len(written_names))
+    ids = dict(con.execute(
+        f"SELECT name, id FROM preset_messages WHERE guild_id = ? AND name IN ({placeholders})", (guild_id, *written_names)
+    ))
+    for _, name, content, _ in to_write:
+        if len(result.written) >= MAX_TRACKED_WRITES:
+            result.written_truncated = True
+            result.written.clear()
+            return
+        result.written.append((ids[name], name, content))
+
+
+def apply_import(con: sqlite3.Connection, guild_id: int, creator_id: int, items: Iterable[Any], result: ImportResult,
+                 chunk_size: int = IMPORT_CHUNK_SIZE) -> ImportResult:
+    """
+    在写线程的单个事务中边解析边导入（通过 bot.db.transaction 调用）：每 chunk_size 个预设查询一次已存在的名称并用 executemany 写入，
+    内存中只保留当前块和已处理过的名称。解析出错时抛出异常，整个事务回滚。
+    """
+    seen: dict[str, bool] = {}  # 名称 -> 本次导入是否写入了它
+    chunk: dict[str, str] = {}
+    for name, content in iter_presets(items, result):
+        chunk[name] = content
+        if len(chunk) >= chunk_size:
+            _apply_chunk(con, guild_id, creator_id, chunk, seen, result)
+            chunk = {}
+    if chunk:
+        _apply_chunk(con, guild_id, creator_id, chunk, seen, result)
+    return result
+
+
+# --- 导出 ---
+def parse_since(text: str) -> float:
+    """把 Unix 时间戳或 ISO 日期（如 2024-05-01、2024-05-01T12:00）解析为时间戳；无时区的日期按 UTC 处理。"""
+    text = text.strip()
+    try:
+        return float(text)
+    except ValueError:
+        moment = datetime.datetime.fromisoformat(text)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+
+def iter_preset_rows(con: sqlite3.Connection, *, guild_id: Optional[int] = None, since_id: Optional[int] = None,
+                     since_ts: Optional[float] = None, batch_size: int = 500) -> Iterator[dict]:
+    """按 ID 顺序流式读取预设（游标 + fetchmany），内存占用与表的大小无关。"""
+    # 兼容尚未被机器人迁移过的旧数据库（独立导出脚本可能直接读取它）
+    has_updated_at = any(row[1] == 'updated_at' for row in con.execute("PRAGMA table_info(preset_messages)"))
+    updated_at = "updated_at" if has_updated_at else "NULL"
+    conditions, params = [], []
+    if guild_id is not None:
+        conditions.append("guild_id = ?")
+        params.append(guild_id)
+    if since_id is not None:
+        conditions.append("id > ?")
+        params.append(since_id)
+    if since_ts is not None:
+        conditions.append(f"COALESCE({updated_at}, 0) > ?")
+        params.append(since_ts)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    cur = con.execute(f"SELECT name, content, guild_id, creator_id, id, {updated_at} FROM preset_messages{where} ORDER BY id", params)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            yield dict(zip(EXPORT_FIELDS, row))
+
+
+def write_presets(rows: Iterable[dict], out: TextIO, fmt: str) -> int:
+    """把记录逐条写入文本流，返回写入的条数。"""
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    elif fmt == "jsonl":
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    else:
+        out.write("[")
+        for row in rows:
+            out.write(("," if count else "") + "\n    " + json.dumps(row, ensure_ascii=False))
+            count += 1
+        out.write("\n]\n")
+    return count
+
+
+def export_presets(con: sqlite3.Connection, path: str, fmt: str = "json", compress: bool = False, **filters) -> int:
+    """把预设流式导出到文件（可选 gzip 压缩），filters 与 iter_preset_rows 相同。返回导出的条数。"""
+    opener = gzip.open if compress else open
+    with opener(path, 'wt', encoding='utf-8', newline='') as out:
+        return write_presets(iter_preset_rows(con, **filters), out, fmt)
@@ -0,0 +1,75 @@
+# utils/rate_limit.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class RequestBudget:
+    """
+    按“每分钟请求数”限制 REST 调用的异步令牌桶。
+    多个后台任务可以共享同一个预算；等待者按先来后到的顺序获得令牌。
+    """
+    def __init__(self, per_minute: float, burst: Optional[int] = None):
+        self.per_minute = max(0.1, per_minute)
+        self.rate = self.per_minute / 60.0
+        self.capacity = float(burst if burst is not None else max(1, int(self.per_minute // 6)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """获取一个请求令牌，预算不足时等待。"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class KeyedTokenBucket:
+    """
+    按键（如 (服务器ID, 用户ID)）分别计数的令牌桶，只做判断不等待，用于命令冷却。
+    长时间未使用的桶已经回满，与新建的桶等价，会在访问时顺带清除，内存只与近期活跃的键数量有关。
+    """
+    def __init__(self, per_minute: float, burst: int = 1):
+        self.rate = max(0.1, per_minute) / 60.0
+        self.capacity = float(max(1, burst))
+        self.ttl = self.capacity / self.rate  # 从空桶回满所需的时间
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()  # 键 -> (令牌数, 更新时间)，按更新时间排序
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _tokens(self, key: Hashable, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        tokens, updated = bucket
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def _expire(self, now: float):
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < self.ttl:
+                break
+            del self._buckets[key]
+
+    def retry_after(self, key: Hashable) -> float:
+        """距离该键可以再次使用还需等待的秒数；0 表示现在就可以。"""
+        tokens = self._tokens(key, time.monotonic())
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def consume(self, key: Hashable):
+        """记录一次使用（扣除一个令牌）。"""
+        now = time.monotonic()
+        self._expire(now)
+        self._buckets[key] = (max(0.0, self._tokens(key, now) - 1), now)
+        self._buckets.move_to_end(key)
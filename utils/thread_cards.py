@@ -0,0 +1,136 @@
+# utils/thread_cards.py
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, astuple
+from typing import Optional
+
+import discord
+
+CONTENT_PREVIEW_LENGTH = 400
+
+
+@dataclass(slots=True)
+class ThreadCard:
+    """渲染一张帖子卡片（抽卡结果 / 新帖速递）所需的全部信息。"""
+    thread_id: int
+    guild_id: int
+    forum_id: int
+    title: str
+    owner_name: Optional[str]
+    content: Optional[str]  # 已截断的内容速览；None 表示起始消息无法加载
+    image_url: Optional[str]
+    tags: str  # 以 ", " 连接的标签名，空字符串表示没有标签
+    forum_name: str
+    updated_at: float
+
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.com/channels/{self.guild_id}/{self.thread_id}"
+
+    @classmethod
+    def from_thread(cls, thread: discord.Thread, starter_message: Optional[discord.Message]) -> "ThreadCard":
+        content = None
+        image_url = None
+        if starter_message is not None:
+            content = starter_message.content
+            if len(content) > CONTENT_PREVIEW_LENGTH:
+                content = content[:CONTENT_PREVIEW_LENGTH] + "..."
+            for attachment in starter_message.attachments:
+                if attachment.content_type and attachment.content_type.startswith('image/'):
+                    image_url = attachment.url
+                    break
+        return cls(
+            thread_id=thread.id,
+            guild_id=thread.guild.id,
+            forum_id=thread.parent_id,
+            title=thread.name,
+            owner_name=thread.owner.name if thread.owner else None,
+            content=content,
+            image_url=image_url,
+            tags=", ".join(tag.name for tag in thread.applied_tags),
+            forum_name=thread.parent.name if thread.parent else "",
+            updated_at=time.time(),
+        )
+
+
+class ThreadCardCache:
+    """
+    帖子卡片缓存：内存中按 LRU 保留最近使用的卡片，同时持久化到 thread_cards 表。
+    卡片超过 TTL 后视为失效；帖子被编辑或更新时由监听器主动失效。
+    命中缓存的帖子在抽卡时不需要任何 REST 请求。
+    """
+    def __init__(self, max_entries: int = 2000, ttl_seconds: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[int, ThreadCard] = OrderedDict()
+        # 本次运行期间生成的卡片：帖子删除会通过网关事件及时失效；更早的卡片可能对应离线期间被删除的帖子
+        self.started_at = time.time()
+
+    @classmethod
+    def from_env(cls) -> "ThreadCardCache":
+        """读取 THREAD_CARD_CACHE_SIZE（内存中的卡片数，默认 2000）与 THREAD_CARD_TTL_HOURS（默认 24）。"""
+        try:
+            max_entries = int(os.getenv("THREAD_CARD_CACHE_SIZE", "2000"))
+            ttl_hours = float(os.getenv("THREAD_CARD_TTL_HOURS", "24"))
+        except ValueError:
+            print("⚠️ 帖子卡片缓存的 .env 配置值无效，将使用默认值。")
+            max_entries, ttl_hours = 2000, 24.0
+        return cls(max(1, max_entries), ttl_hours * 3600)
+
+    def _is_fresh(self, card: ThreadCard) -> bool:
+        return time.time() - card.updated_at < self.ttl_seconds
+
+    def _remember(self, card: ThreadCard):
+        self._entries[card.thread_id] = card
+        self._entries.move_to_end(card.thread_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _load_row(con: sqlite3.Connection, thread_id: int) -> Optional[ThreadCard]:
+        row = con.execute(
+            "SELECT thread_id, guild_id, forum_id, title, owner_name, content, image_url, tags, forum_name, updated_at "
+            "FROM thread_cards WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        return ThreadCard(*row) if row else None
+
+    async def get(self, db, thread_id: int) -> Optional[ThreadCard]:
+        card = self._entries.get(thread_id)
+        if card is None:
+            card = await db.read(self._load_row, thread_id)
+            if card is None:
+                return None
+        if not self._is_fresh(card):
+            self._entries.pop(thread_id, None)
+            return None
+        self._remember(card)
+        return card
+
+    async def put(self, db, card: ThreadCard):
+        self._remember(card)
+        await db.execute(
+            "INSERT OR REPLACE INTO thread_cards "
+            "(thread_id, guild_id, forum_id, title, owner_name, content, image_url, tags, forum_name, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            astuple(card)
+        )
+
+    def verified_this_run(self, card: ThreadCard) -> bool:
+        return card.updated_at >= self.started_at
+
+    def forget(self, thread_id: int):
+        """只从内存中移除卡片（数据库中的行由调用方负责批量删除）。"""
+        self._entries.pop(thread_id, None)
+
+    async def invalidate(self, db, thread_id: int):
+        self.forget(thread_id)
+        await db.execute("DELETE FROM thread_cards WHERE thread_id = ?", (thread_id,))
+
+    async def prune_expired(self, db) -> int:
+        """删除数据库中已过期的卡片，返回删除的行数。"""
+        cutoff = time.time() - self.ttl_seconds
+        for thread_id in [tid for tid, card in self._entries.items() if card.updated_at < cutoff]:
+            del self._entries[thread_id]
+        return await db.execute("DELETE FROM thread_cards WHERE updated_at < ?", (cutoff,))
@@ -0,0 +1,277 @@
+# utils/thread_pool.py
+import bisect
+import random
+import sqlite3
+from array import array
+from typing import Callable, Iterable, Optional
+
+PoolKey = tuple[int, int]  # (guild_id, forum_id)
+WeightFn = Callable[[int], float]
+
+
+class FenwickTree:
+    """
+    基于 array('d') 的树状数组，用于按权重抽样。
+    支持 O(log n) 的追加、单点修改、弹出末尾和“按前缀和定位”，与卡池桶的下标一一对应。
+    """
+    def __init__(self, values: Iterable[float] = ()):
+        self._values = array('d', values)
+        n = len(self._values)
+        # 线性时间建树：tree[i] 存放 values[i - lowbit(i) + 1 .. i] 之和（下标从 1 开始）
+        self._tree = array('d', [0.0]) + self._values
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def _prefix(self, i: int) -> float:
+        total = 0.0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def total(self) -> float:
+        return self._prefix(len(self._values))
+
+    def append(self, weight: float):
+        self._values.append(weight)
+        i = len(self._values)
+        lowbit = i & -i
+        self._tree.append(weight + self._prefix(i - 1) - self._prefix(i - lowbit))
+
+    def update(self, index: int, weight: float):
+        delta = weight - self._values[index]
+        self._values[index] = weight
+        i = index + 1
+        n = len(self._values)
+        while i <= n:
+            self._tree[i] += delta
+            i += i & -i
+
+    def pop(self) -> float:
+        # 末尾节点不会被任何更小下标的节点引用，直接弹出即可
+        self._tree.pop()
+        return self._values.pop()
+
+    def value(self, index: int) -> float:
+        return self._values[index]
+
+    def find(self, target: float) -> int:
+        """返回前缀和首次超过 target 的下标（从 0 开始），即按权重抽中的位置。"""
+        n = len(self._values)
+        position = 0
+        step = 1 << n.bit_length()
+        while step:
+            nxt = position + step
+            if nxt <= n and self._tree[nxt] <= target:
+                position = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return min(position, n - 1)
+
+
+class ThreadPool:
+    """
+    常驻内存的卡池索引。
+    以 (guild_id, forum_id) 为键，把帖子ID紧凑地存放在 array('q') 中，
+    抽卡时直接在内存里做 O(k) 采样，无需查询数据库。
+    所有方法都应在事件循环线程中调用；只有 load_from_db 会在数据库读线程中执行。
+    """
+    def __init__(self):
+        self._buckets: dict[PoolKey, array] = {}
+        # 启用加权抽样后，每个桶都有一棵与之下标对齐的树状数组
+        self._weight_fn: Optional[WeightFn] = None
+        self._trees: dict[PoolKey, FenwickTree] = {}
+
+    def set_weight_fn(self, weight_fn: Optional[WeightFn]):
+        """设置（或关闭）每个帖子的权重函数，并为现有的桶重建树状数组。"""
+        self._weight_fn = weight_fn
+        self._trees = self._build_trees(self._buckets)
+
+    def _build_trees(self, buckets: dict[PoolKey, array]) -> dict[PoolKey, FenwickTree]:
+        if self._weight_fn is None:
+            return {}
+        weight_fn = self._weight_fn
+        return {key: FenwickTree(weight_fn(thread_id) for thread_id in bucket) for key, bucket in buckets.items()}
+
+    # --- 加载 ---
+    @staticmethod
+    def _build_buckets(rows: Iterable[tuple[int, int, int]]) -> dict[PoolKey, array]:
+        buckets: dict[PoolKey, array] = {}
+        for thread_id, forum_id, guild_id in rows:
+            key = (guild_id, forum_id)
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = array('q')
+            bucket.append(thread_id)
+        return buckets
+
+    def load_from_db(self, con: sqlite3.Connection) -> int:
+        """从 threads 表全量重建索引（阻塞操作，请通过 bot.db.read 调用）。返回载入的帖子数。"""
+        cur = con.execute("SELECT thread_id, forum_id, guild_id FROM threads")
+        buckets = self._build_buckets(cur)
+        trees = self._build_trees(buckets)
+        # 整体替换，保证事件循环线程看到的始终是完整的索引
+        self._buckets, self._trees = buckets, trees
+        return self.total()
+
+    # --- 维护 ---
+    def _append(self, key: PoolKey, bucket: array, thread_id: int):
+        bucket.append(thread_id)
+        if self._weight_fn is not None:
+            tree = self._trees.get(key)
+            if tree is None:
+                tree = self._trees[key] = FenwickTree()
+            tree.append(self._weight_fn(thread_id))
+
+    def add(self, guild_id: int, forum_id: int, thread_id: int) -> bool:
+        """添加单个帖子，已存在时返回 False。"""
+        key = (guild_id, forum_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = array('q')
+        elif thread_id in bucket:
+            return False
+        self._append(key, bucket, thread_id)
+        return True
+
+    def add_rows(self, rows: Iterable[tuple[int, int, int]]) -> int:
+        """
+        批量添加帖子，参数格式与 threads 表的插入语句一致: (thread_id, forum_id, guild_id)。
+        返回实际新增的数量。
+        """
+        grouped: dict[PoolKey, list[int]] = {}
+        for thread_id, forum_id, guild_id in rows:
+            grouped.setdefault((guild_id, forum_id), []).append(thread_id)
+
+        added = 0
+        for key, thread_ids in grouped.items():
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = array('q')
+            # 批量去重时先转成集合，避免对 array 做 O(n) 的逐个查找
+            existing = set(bucket)
+            for thread_id in thread_ids:
+                if thread_id not in existing:
+                    existing.add(thread_id)
+                    self._append(key, bucket, thread_id)
+                    added += 1
+        return added
+
+    def discard(self, thread_id: int, guild_id: int | None = None, forum_id: int | None = None) -> bool:
+        """
+        移除一个帖子。已知所属论坛时只扫描对应的桶，否则扫描所有桶。
+        采用“与末尾元素交换后弹出”的方式删除，避免整体搬移数组。
+        """
+        if guild_id is not None and forum_id is not None:
+            key = (guild_id, forum_id)
+            candidates = [key] if key in self._buckets else []
+        else:
+            candidates = list(self._buckets)
+
+        for key in candidates:
+            bucket = self._buckets[key]
+            try:
+                index = bucket.index(thread_id)
+            except ValueError:
+                continue
+            last = bucket.pop()
+            if index < len(bucket):
+                bucket[index] = last
+            tree = self._trees.get(key)
+            if tree is not None:
+                last_weight = tree.pop()
+                if index < len(tree):
+                    tree.update(index, last_weight)
+            return True
+        return False
+
+    # --- 查询 ---
+    def total(self) -> int:
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def size(self, guild_id: int, forum_ids: Iterable[int]) -> int:
+        return sum(len(self._buckets.get((guild_id, forum_id), ())) for forum_id in forum_ids)
+
+    def sample(self, guild_id: int, forum_ids: Iterable[int], k: int) -> list[int]:
+        """从指定论坛的并集中无放回地随机抽取最多 k 个帖子ID。"""
+        buckets = [self._buckets[(guild_id, forum_id)] for forum_id in set(forum_ids) if self._buckets.get((guild_id, forum_id))]
+        total = sum(len(bucket) for bucket in buckets)
+        if total == 0 or k <= 0:
+            return []
+
+        # 在 [0, total) 上抽取全局下标，再映射回具体的桶，复杂度 O(k)，不需要复制任何数组
+        positions = random.sample(range(total), k=min(k, total))
+        chosen = []
+        for position in positions:
+            for bucket in buckets:
+                if position < len(bucket):
+                    chosen.append(bucket[position])
+                    break
+                position -= len(bucket)
+        return chosen
+
+    def draw(self, guild_id: int, forum_ids: Iterable[int], k: int, *,
+             exclude: Iterable[int] = (), forum_weights: Optional[dict[int, float]] = None,
+             recency_bias: float = 0.0) -> list[int]:
+        """
+        带排除集合与权重的无放回抽样。
+        - exclude: 不希望抽到的帖子ID（例如用户最近抽过的）。
+        - forum_weights: 论坛级权重，论坛的总质量 = 权重 × 帖子数（或 × 树状数组总权重）。
+        - recency_bias: 每次抽取时有该概率按帖子自身权重（树状数组）抽样，否则在桶内均匀抽样。
+        先做拒绝采样，每次 O(B + log n)；只有当排除集合几乎覆盖整个卡池时才退化为显式过滤。
+        """
+        exclude = set(exclude)
+        if not exclude and not forum_weights and recency_bias <= 0:
+            return self.sample(guild_id, forum_ids, k)
+
+        keys = [(guild_id, forum_id) for forum_id in set(forum_ids) if self._buckets.get((guild_id, forum_id))]
+        if not keys or k <= 0:
+            return []
+        buckets = [self._buckets[key] for key in keys]
+        forum_weights = forum_weights or {}
+        scales = [max(0.0, forum_weights.get(key[1], 1.0)) for key in keys]
+
+        def _cumulative(masses):
+            running, result = 0.0, []
+            for mass in masses:
+                running += mass
+                result.append(running)
+            return result
+
+        uniform_cumulative = _cumulative(scale * len(bucket) for scale, bucket in zip(scales, buckets))
+        trees = [self._trees.get(key) for key in keys]
+        use_trees = recency_bias > 0 and all(tree is not None for tree in trees)
+        tree_cumulative = _cumulative(scale * tree.total() for scale, tree in zip(scales, trees)) if use_trees else []
+
+        chosen: list[int] = []
+        taken = set(exclude)
+        for _ in range(k * 20):
+            if len(chosen) >= k:
+                break
+            weighted = use_trees and tree_cumulative[-1] > 0 and random.random() < recency_bias
+            cumulative = tree_cumulative if weighted else uniform_cumulative
+            if cumulative[-1] <= 0:
+                break
+            b = min(bisect.bisect_right(cumulative, random.random() * cumulative[-1]), len(buckets) - 1)
+            bucket = buckets[b]
+            if not bucket:
+                continue
+            if weighted:
+                index = trees[b].find(random.random() * trees[b].total())
+            else:
+                index = random.randrange(len(bucket))
+            thread_id = bucket[index]
+            if thread_id not in taken:
+                taken.add(thread_id)
+                chosen.append(thread_id)
+
+        if len(chosen) < k:
+            # 拒绝采样多次失败，说明可选帖子所剩无几：显式过滤后均匀补齐
+            remaining = [thread_id for scale, bucket in zip(scales, buckets) if scale > 0 for thread_id in bucket if thread_id not in taken]
+            chosen.extend(random.sample(remaining, k=min(k - len(chosen), len(remaining))))
+        return chosen
@@ -0,0 +1,70 @@
+# utils/tombstones.py
+import sqlite3
+import time
+from collections import deque
+from typing import Optional
+
+from .thread_cards import ThreadCardCache
+from .thread_pool import ThreadPool
+
+
+class TombstoneQueue:
+    """
+    失效帖子的墓碑队列。
+    - bury 会立即把帖子从内存卡池和卡片缓存中移除，之后的抽卡不会再抽到它。
+    - 数据库删除被推迟到 flush，由后台任务在写线程中用 executemany 批量提交。
+    - 按小时统计清理数量，保留最近 48 小时。
+    """
+    def __init__(self, pool: ThreadPool, cards: ThreadCardCache, history_hours: int = 48):
+        self.pool = pool
+        self.cards = cards
+        self._pending: set[int] = set()
+        self._hourly: deque[list[int]] = deque(maxlen=history_hours)  # [整点时间戳, 清理数量]
+
+    def bury(self, thread_id: int, guild_id: Optional[int] = None, forum_id: Optional[int] = None):
+        self.pool.discard(thread_id, guild_id, forum_id)
+        self.cards.forget(thread_id)
+        self._pending.add(thread_id)
+
+    def revive(self, thread_id: int):
+        """取消尚未写入数据库的删除（例如帖子被取消置顶、重新回到卡池）。"""
+        self._pending.discard(thread_id)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _record(self, count: int):
+        hour = int(time.time() // 3600 * 3600)
+        if self._hourly and self._hourly[-1][0] == hour:
+            self._hourly[-1][1] += count
+        else:
+            self._hourly.append([hour, count])
+
+    @staticmethod
+    def _delete_rows(con: sqlite3.Connection, rows: list[tuple[int]]) -> int:
+        deleted = con.executemany("DELETE FROM threads WHERE thread_id = ?", rows).rowcount
+        con.executemany("DELETE FROM thread_cards WHERE thread_id = ?", rows)
+        return deleted
+
+    async def flush(self, db) -> int:
+        """把待删除的帖子批量写入数据库，返回实际删除的行数。"""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, set()
+        try:
+            deleted = await db.transaction(self._delete_rows, [(thread_id,) for thread_id in batch])
+        except Exception:
+            # 写入失败时放回队列，等待下次重试
+            self._pending |= batch
+            raise
+        self._record(deleted)
+        return deleted
+
+    def purged_this_hour(self) -> int:
+        hour = int(time.time() // 3600 * 3600)
+        return self._hourly[-1][1] if self._hourly and self._hourly[-1][0] == hour else 0
+
+    def hourly_stats(self, hours: int = 24) -> list[tuple[int, int]]:
+        """返回最近若干小时内有清理记录的 (整点时间戳, 清理数量)，按时间先后排列。"""
+        cutoff = time.time() - hours * 3600
+        return [(hour, count) for hour, count in self._hourly if hour + 3600 > cutoff]